@@ -0,0 +1,162 @@
+"""活動追蹤模組
+
+在記憶體中累積聊天和語音活動，由機器人定時批量寫入數據文件，
+避免每條訊息或每次語音狀態變化都讀寫磁碟。
+"""
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# 同一用戶兩次獲得聊天經驗的最短間隔（秒）
+MESSAGE_EXP_COOLDOWN = float(os.getenv('MESSAGE_EXP_COOLDOWN', '60'))
+
+# 累積的經驗值寫入文件的間隔（秒）
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '60'))
+
+# 語音中用戶的結算間隔（秒），離開語音時會立即結算
+VOICE_CHECKPOINT_INTERVAL = float(os.getenv('VOICE_CHECKPOINT_INTERVAL', '900'))
+
+# 每次寫入最多處理的用戶數，其餘留到下次（限制每次寫入佔用事件循環的時間）
+ACTIVITY_FLUSH_MAX_USERS = int(os.getenv('ACTIVITY_FLUSH_MAX_USERS', '2000'))
+
+
+def split_batch(pending: Dict[Tuple[str, str], list], limit: int) -> Tuple[dict, dict]:
+    """把累積的獎勵分成本次寫入的部分和留到下次的部分"""
+    if len(pending) <= limit:
+        return pending, {}
+    keys = list(pending)
+    return {key: pending[key] for key in keys[:limit]}, {key: pending[key] for key in keys[limit:]}
+
+
+class MessageXPTracker:
+    """聊天經驗值追蹤器
+
+    每個用戶一個冷卻桶（下次可獲得經驗的時間），冷卻期外的訊息記為一次獎勵。
+    獎勵次數只在記憶體中累積，由 drain() 一次取出。
+    """
+
+    def __init__(self, cooldown: float = MESSAGE_EXP_COOLDOWN):
+        self.cooldown = cooldown
+        # {(guild_id, user_id): 下次可獲得經驗的時間}
+        self._ready_at: Dict[Tuple[str, str], float] = {}
+        # {(guild_id, user_id): [獎勵次數, 最後活動頻道ID]}
+        self._pending: Dict[Tuple[str, str], list] = {}
+
+    def record(self, guild_id: str, user_id: str, channel_id: int, now: Optional[float] = None) -> bool:
+        """記錄一條訊息，冷卻期外返回 True（獲得一次獎勵）"""
+        if now is None:
+            now = time.monotonic()
+        key = (guild_id, user_id)
+        if self._ready_at.get(key, 0) > now:
+            return False
+        self._ready_at[key] = now + self.cooldown
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [1, channel_id]
+        else:
+            entry[0] += 1
+            entry[1] = channel_id
+        return True
+
+    def drain(self, now: Optional[float] = None) -> Dict[Tuple[str, str], list]:
+        """取出所有累積的獎勵，同時清除已過期的冷卻桶"""
+        if now is None:
+            now = time.monotonic()
+        pending, self._pending = self._pending, {}
+        self._ready_at = {key: ready for key, ready in self._ready_at.items() if ready > now}
+        return pending
+
+    def restore(self, pending: Dict[Tuple[str, str], list]):
+        """寫入失敗時把獎勵放回，等待下次寫入"""
+        for key, (count, channel_id) in pending.items():
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [count, channel_id]
+            else:
+                entry[0] += count
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class VoiceSessionTracker:
+    """語音時長追蹤器
+
+    只記錄每個語音會話的開始時間，離開時或定期結算時才計算時長，
+    不需要每分鐘遍歷所有語音中的用戶。
+    """
+
+    def __init__(self):
+        # {(guild_id, user_id): [會話開始時間, 語音頻道ID]}
+        self._sessions: Dict[Tuple[str, str], list] = {}
+        # {(guild_id, user_id): [累積秒數, 語音頻道ID]}
+        self._pending: Dict[Tuple[str, str], list] = {}
+        self.last_checkpoint = time.time()
+
+    def join(self, guild_id: str, user_id: str, channel_id: int, now: Optional[float] = None):
+        """開始語音會話"""
+        if now is None:
+            now = time.time()
+        key = (guild_id, user_id)
+        if key not in self._sessions:
+            self._sessions[key] = [now, channel_id]
+
+    def leave(self, guild_id: str, user_id: str, now: Optional[float] = None):
+        """結束語音會話並結算時長"""
+        if now is None:
+            now = time.time()
+        session = self._sessions.pop((guild_id, user_id), None)
+        if session is not None:
+            self._accrue((guild_id, user_id), now - session[0], session[1])
+
+    def is_active(self, guild_id: str, user_id: str) -> bool:
+        return (guild_id, user_id) in self._sessions
+
+    def _accrue(self, key: Tuple[str, str], seconds: float, channel_id: int):
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [max(0.0, seconds), channel_id]
+        else:
+            entry[0] += max(0.0, seconds)
+            entry[1] = channel_id
+
+    def checkpoint(self, now: Optional[float] = None):
+        """結算所有進行中的會話（定期調用，避免長時間掛語音的時長只在離開時才入帳）"""
+        if now is None:
+            now = time.time()
+        for key, session in self._sessions.items():
+            self._accrue(key, now - session[0], session[1])
+            session[0] = now
+        self.last_checkpoint = now
+
+    def checkpoint_due(self, now: Optional[float] = None, interval: float = VOICE_CHECKPOINT_INTERVAL) -> bool:
+        if now is None:
+            now = time.time()
+        return now - self.last_checkpoint >= interval
+
+    def drain(self) -> Dict[Tuple[str, str], list]:
+        """取出累積的完整分鐘數 {(guild_id, user_id): [分鐘數, 語音頻道ID]}，不足一分鐘的秒數保留"""
+        minutes = {}
+        for key in list(self._pending):
+            seconds, channel_id = self._pending[key]
+            whole = int(seconds // 60)
+            if whole <= 0:
+                if key not in self._sessions:
+                    # 已離開且不足一分鐘，捨棄
+                    del self._pending[key]
+                continue
+            minutes[key] = [whole, channel_id]
+            remainder = seconds - whole * 60
+            if remainder > 0 and key in self._sessions:
+                self._pending[key][0] = remainder
+            else:
+                del self._pending[key]
+        return minutes
+
+    def restore(self, minutes: Dict[Tuple[str, str], list]):
+        """寫入失敗時把分鐘數放回，等待下次寫入"""
+        for key, (count, channel_id) in minutes.items():
+            self._accrue(key, count * 60, channel_id)
+
+    def __len__(self):
+        return len(self._sessions)
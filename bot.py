@@ -1,24 +1,132 @@
 import os
+import re
 import json
+import hashlib
+import inspect
+import functools
+import gzip
+import random
+import shutil
+import signal
 import asyncio
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional, List
 
 try:
     import discord
-    from discord.ext import commands
+    from discord.ext import commands, tasks
     from discord import app_commands
 except ImportError:
     print("❌ 錯誤: discord.py 未安裝")
     print("請執行: pip install discord.py")
     exit(1)
 
+import leveling
+import activity
+import combat
+import regen
+import equipment
+import ledger
+import leaderboard
+import exchange
+import ratelimit
+import datastore
+
 # 初始化機器人
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# ==================== 執行中的互動 ====================
+
+# 關閉中不再接受新的互動
+shutting_down = False
+# 正在執行的元件處理函數和 Modal 提交數量（關閉時等待歸零）
+in_flight_count = 0
+# 正在執行的斜線指令的 interaction ID（通過檢查時加入，完成或出錯時移除）
+in_flight_commands = set()
+
+SHUTTING_DOWN_MESSAGE = "🔧 機器人正在重新啟動，請稍後再試。"
+
+@contextmanager
+def track_in_flight():
+    global in_flight_count
+    in_flight_count += 1
+    try:
+        yield
+    finally:
+        in_flight_count -= 1
+
+def in_flight_total() -> int:
+    return in_flight_count + len(in_flight_commands)
+
+async def reject_if_shutting_down(interaction: discord.Interaction) -> bool:
+    """關閉中時回覆提示並返回 True"""
+    if not shutting_down:
+        return False
+    await interaction.response.send_message(SHUTTING_DOWN_MESSAGE, ephemeral=True)
+    return True
+
+class TrackedModal(discord.ui.Modal):
+    """關閉中拒絕提交，並把 on_submit 計入執行中的互動（子類別的 on_submit 自動包裝）"""
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        on_submit = cls.__dict__.get('on_submit')
+        if on_submit is None:
+            return
+        
+        @functools.wraps(on_submit)
+        async def tracked_on_submit(self, interaction: discord.Interaction):
+            if await reject_if_shutting_down(interaction):
+                return
+            with track_in_flight():
+                await on_submit(self, interaction)
+        cls.on_submit = tracked_on_submit
+
+# ==================== 指令頻率限制 ====================
+
+rate_limiter = ratelimit.RateLimiter()
+
+async def check_rate_limit(interaction: discord.Interaction, command: str) -> bool:
+    """檢查指令頻率，超過限制時回覆提示並返回 False"""
+    guild_id = interaction.guild.id if interaction.guild else None
+    retry_after = rate_limiter.acquire(command, interaction.user.id, guild_id)
+    if retry_after <= 0:
+        return True
+    await interaction.response.send_message(
+        f"⏳ 操作太頻繁了！請在 {retry_after:.1f} 秒後再試。",
+        ephemeral=True
+    )
+    return False
+
+class RateLimitedCommandTree(app_commands.CommandTree):
+    """所有斜線指令執行前先檢查頻率限制，並記錄執行中的指令
+    
+    只使用公開的 interaction_check 和 on_error，加上 on_app_command_completion 事件。
+    """
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.command is None:
+            return True
+        if await reject_if_shutting_down(interaction):
+            return False
+        if not await check_rate_limit(interaction, interaction.command.qualified_name):
+            return False
+        if interaction.type == discord.InteractionType.application_command:
+            in_flight_commands.add(interaction.id)
+        return True
+    
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        in_flight_commands.discard(interaction.id)
+        await super().on_error(interaction, error)
+
+bot = commands.Bot(command_prefix="!", intents=intents, tree_cls=RateLimitedCommandTree)
+
+@bot.listen('on_app_command_completion')
+async def finish_in_flight_command(interaction: discord.Interaction, command):
+    in_flight_commands.discard(interaction.id)
 
 # 數據文件路徑
 DATA_DIR = "data"
@@ -27,19 +135,49 @@ SHOPS_FILE = f"{DATA_DIR}/shops.json"
 USERS_FILE = f"{DATA_DIR}/users.json"
 CHARACTERS_FILE = f"{DATA_DIR}/characters.json"
 CHECKIN_FILE = f"{DATA_DIR}/checkins.json"
+LEDGER_DIR = f"{DATA_DIR}/ledger"
+ARCHIVE_DIR = f"{DATA_DIR}/archive"
+COMMAND_SYNC_FILE = f"{DATA_DIR}/command_sync.json"
 
 # 確保數據目錄存在
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# 用戶、商店、角色和簽到數據按伺服器分片存放，只快取活躍的伺服器
+DATA_CACHE_MAX_RECORDS = int(os.getenv('DATA_CACHE_MAX_RECORDS', datastore.DEFAULT_MAX_RECORDS))
+shop_store = datastore.ShardedStore(f"{DATA_DIR}/shops", datastore.guild_prefix_shard, DATA_CACHE_MAX_RECORDS, SHOPS_FILE)
+user_store = datastore.ShardedStore(f"{DATA_DIR}/users", datastore.guild_prefix_shard, DATA_CACHE_MAX_RECORDS, USERS_FILE)
+character_store = datastore.ShardedStore(f"{DATA_DIR}/characters", datastore.character_shard, DATA_CACHE_MAX_RECORDS, CHARACTERS_FILE)
+checkin_store = datastore.ShardedStore(f"{DATA_DIR}/checkins", datastore.guild_prefix_shard, DATA_CACHE_MAX_RECORDS, CHECKIN_FILE)
+
 # ==================== 管理員檢查函數 ====================
 
+# 機器人管理員快取 {guild_id: (管理員用戶ID集合, 管理員身份組ID集合)}
+# 只在首次檢查時讀取文件，添加或移除管理員時清除
+admin_cache = {}
+
+def get_admin_sets(guild_id: str) -> tuple:
+    """獲取伺服器的管理員用戶和管理員身份組"""
+    cached = admin_cache.get(guild_id)
+    if cached is None:
+        guild_data = load_json(GUILDS_FILE, {}).get(guild_id, {})
+        cached = (
+            frozenset(guild_data.get('bot_admins', [])),
+            frozenset(int(role_id) for role_id in guild_data.get('admin_roles', []))
+        )
+        admin_cache[guild_id] = cached
+    return cached
+
+def invalidate_admin_cache(guild_id: str):
+    """清除伺服器的管理員快取"""
+    admin_cache.pop(guild_id, None)
+
 def is_bot_admin(guild_id: str, user_id: str) -> bool:
     """檢查用戶是否為機器人管理員"""
-    guilds = load_json(GUILDS_FILE, {})
-    if guild_id not in guilds:
-        return False
-    bot_admins = guilds[guild_id].get('bot_admins', [])
-    return str(user_id) in bot_admins
+    return str(user_id) in get_admin_sets(guild_id)[0]
+
+def has_admin_role(guild_id: str, member: discord.Member) -> bool:
+    """檢查成員是否擁有機器人管理員身份組"""
+    return any(member.get_role(role_id) is not None for role_id in get_admin_sets(guild_id)[1])
 
 def add_bot_admin(guild_id: str, user_id: str):
     """添加機器人管理員"""
@@ -51,6 +189,7 @@ def add_bot_admin(guild_id: str, user_id: str):
     if str(user_id) not in guilds[guild_id]['bot_admins']:
         guilds[guild_id]['bot_admins'].append(str(user_id))
     save_json(GUILDS_FILE, guilds)
+    invalidate_admin_cache(guild_id)
 
 def remove_bot_admin(guild_id: str, user_id: str):
     """移除機器人管理員"""
@@ -59,16 +198,38 @@ def remove_bot_admin(guild_id: str, user_id: str):
         if str(user_id) in guilds[guild_id]['bot_admins']:
             guilds[guild_id]['bot_admins'].remove(str(user_id))
             save_json(GUILDS_FILE, guilds)
+    invalidate_admin_cache(guild_id)
+
+def add_admin_role(guild_id: str, role_id: str):
+    """添加機器人管理員身份組"""
+    guilds = load_json(GUILDS_FILE, {})
+    if guild_id not in guilds:
+        guilds[guild_id] = {'currencies': {}, 'income_roles': {}, 'bot_admins': [], 'checkin_settings': {}}
+    admin_roles = guilds[guild_id].setdefault('admin_roles', [])
+    if str(role_id) not in admin_roles:
+        admin_roles.append(str(role_id))
+    save_json(GUILDS_FILE, guilds)
+    invalidate_admin_cache(guild_id)
+
+def remove_admin_role(guild_id: str, role_id: str):
+    """移除機器人管理員身份組"""
+    guilds = load_json(GUILDS_FILE, {})
+    if guild_id in guilds and str(role_id) in guilds[guild_id].get('admin_roles', []):
+        guilds[guild_id]['admin_roles'].remove(str(role_id))
+        save_json(GUILDS_FILE, guilds)
+    invalidate_admin_cache(guild_id)
 
 async def check_admin_permission(interaction: discord.Interaction) -> bool:
-    """檢查用戶是否有管理員權限（Discord管理員或機器人管理員）"""
+    """檢查用戶是否有管理員權限（Discord管理員、機器人管理員或管理員身份組）"""
     # 檢查Discord管理員權限
     if interaction.user.guild_permissions.administrator:
         return True
-    # 檢查機器人自定義管理員
+    # 檢查機器人自定義管理員（記憶體快取，不讀取文件）
     guild_id = str(interaction.guild.id)
     user_id = str(interaction.user.id)
-    return is_bot_admin(guild_id, user_id)
+    if is_bot_admin(guild_id, user_id):
+        return True
+    return isinstance(interaction.user, discord.Member) and has_admin_role(guild_id, interaction.user)
 
 # ==================== 數據管理函數 ====================
 
@@ -97,6 +258,8 @@ def save_guilds(guilds):
 def init_guild(guild_id: str):
     """初始化伺服器數據"""
     guilds = get_guilds()
+    if guild_id not in guilds and restore_archived_guild(guild_id):
+        guilds = get_guilds()
     if guild_id not in guilds:
         guilds[guild_id] = {
             "currencies": {},  # 貨幣列表
@@ -113,42 +276,40 @@ def init_guild(guild_id: str):
     return guilds[guild_id]
 
 def get_shops():
-    """獲取所有商店數據"""
-    return load_json(SHOPS_FILE, {})
+    """獲取所有商店數據（按需載入伺服器分片）"""
+    return shop_store.get()
 
 def save_shops(shops):
-    """保存商店數據"""
-    save_json(SHOPS_FILE, shops)
+    """保存商店數據（只寫回訪問過的伺服器分片）"""
+    shop_store.save(shops)
 
 def get_users():
-    """獲取所有用戶數據"""
-    return load_json(USERS_FILE, {})
+    """獲取所有用戶數據（按需載入伺服器分片）"""
+    return user_store.get()
 
 def save_users(users):
-    """保存用戶數據"""
-    save_json(USERS_FILE, users)
+    """保存用戶數據（只寫回訪問過的伺服器分片）"""
+    user_store.save(users)
 
 def get_characters():
-    """獲取所有角色數據"""
-    return load_json(CHARACTERS_FILE, {})
+    """獲取所有角色數據（按需載入伺服器分片）"""
+    return character_store.get()
 
 def save_characters(characters):
-    """保存角色數據"""
-    save_json(CHARACTERS_FILE, characters)
+    """保存角色數據（只寫回訪問過的伺服器分片）"""
+    character_store.save(characters)
 
 def get_checkins():
-    """獲取簽到記錄"""
-    return load_json(CHECKIN_FILE, {})
+    """獲取簽到記錄（按需載入伺服器分片）"""
+    return checkin_store.get()
 
 def save_checkins(checkins):
-    """保存簽到記錄"""
-    save_json(CHECKIN_FILE, checkins)
+    """保存簽到記錄（只寫回訪問過的伺服器分片）"""
+    checkin_store.save(checkins)
 
-def init_user(user_id: str, guild_id: str):
-    """初始化用戶數據"""
-    users = get_users()
+def ensure_user_record(users: dict, user_id: str, guild_id: str) -> dict:
+    """在已載入的用戶數據中確保用戶存在（不保存，供批量操作使用）"""
     user_key = f"{guild_id}_{user_id}"
-    
     if user_key not in users:
         users[user_key] = {
             "user_id": user_id,
@@ -157,6 +318,16 @@ def init_user(user_id: str, guild_id: str):
             "inventory": {},
             "character": None
         }
+    return users[user_key]
+
+def init_user(user_id: str, guild_id: str):
+    """初始化用戶數據（伺服器有歸檔時先恢復，避免新建的空記錄蓋住歸檔的數據）"""
+    restore_archived_guild(guild_id)
+    users = get_users()
+    user_key = f"{guild_id}_{user_id}"
+    
+    if user_key not in users:
+        ensure_user_record(users, user_id, guild_id)
         save_users(users)
     return users[user_key]
 
@@ -164,9 +335,153 @@ def get_user_key(guild_id: str, user_id: str) -> str:
     """獲取用戶的唯一鍵"""
     return f"{guild_id}_{user_id}"
 
+# ==================== 交易帳本 ====================
+
+ledger_book = ledger.Ledger(LEDGER_DIR)
+# 本次運行中已檢查過期初餘額的伺服器
+bootstrapped_ledgers = set()
+
+DUPLICATE_TRANSACTION_MESSAGE = "⚠️ 這筆交易已經處理過了，不會重複入帳。"
+
+# 交易類型的顯示名稱
+TRANSACTION_KIND_NAMES = {
+    'opening': '📋 期初餘額',
+    'checkin': '📅 每日簽到',
+    'purchase': '🛒 購買商品',
+    'transfer': '💸 轉帳',
+    'admin_add': '🛠️ 管理員添加',
+    'admin_remove': '🛠️ 管理員移除',
+    'batch_add': '🛠️ 批量發放',
+    'batch_remove': '🛠️ 批量移除',
+    'voice_income': '🎙️ 語音收入',
+    'passive_income': '💎 身份組收入',
+    'exchange': '💱 貨幣兌換',
+    'exchange_seed': '💱 兌換池注資',
+    'currency_removed': '🗑️ 貨幣刪除'
+}
+
+def interaction_key(interaction: discord.Interaction, action: str) -> str:
+    """由 interaction ID 產生冪等鍵（同一互動重試時得到相同的鍵）"""
+    return f"{action}:{interaction.id}"
+
+def get_guild_ledger(guild_id: str, users: Optional[dict] = None) -> ledger.GuildLedger:
+    """獲取伺服器帳本，全新的帳本先把現有餘額記為期初餘額（使統計包含所有玩家）"""
+    book = ledger_book.guild(guild_id)
+    if book.last_seq == 0 and guild_id not in bootstrapped_ledgers:
+        bootstrapped_ledgers.add(guild_id)
+        if users is None:
+            users = get_users()
+        entries = []
+        for user in users.guild(guild_id).values():
+            for currency_id, balance in user.get('balances', {}).items():
+                if balance:
+                    entries.append((ledger.user_account(user['user_id']), currency_id, balance))
+                    entries.append((ledger.system_account('opening'), currency_id, -balance))
+        if entries:
+            book.post('opening', entries, memo="帳本建立前的餘額")
+    return book
+
+def sync_opening_balances(users: dict, guild_id: str, book: ledger.GuildLedger, pairs):
+    """帳本建立前已有的餘額（或帳外修改）先記為期初餘額，使帳本與用戶數據一致
+    
+    帳本建立時的餘額已由 get_guild_ledger 記入，這裡出現的差額表示帳外修改，
+    或交易已寫入帳本但之後保存用戶數據失敗（見 post_transaction），因此每次都會記錄日誌。
+    """
+    entries = []
+    for user_id, currency_id in pairs:
+        user = users.get(get_user_key(guild_id, user_id))
+        recorded = user['balances'].get(currency_id, 0) if user else 0
+        account = ledger.user_account(user_id)
+        drift = recorded - book.balance(account, currency_id)
+        if drift:
+            entries.append((account, currency_id, drift))
+            entries.append((ledger.system_account('opening'), currency_id, -drift))
+            print(f'⚠️ 伺服器 {guild_id} 玩家 {user_id} 的 {currency_id} 餘額與帳本相差 {drift:+}，已記為期初餘額')
+    if entries:
+        book.post('opening', entries, memo="用戶數據與帳本的差額")
+
+def post_transaction(
+    users: dict,
+    guild_id: str,
+    kind: str,
+    changes: list,
+    counterparty: Optional[str] = None,
+    key: Optional[str] = None,
+    memo: str = ""
+) -> dict:
+    """記錄一筆交易並更新玩家餘額（調用者負責保存用戶數據）
+    
+    changes 為 [(用戶ID, 貨幣ID, 金額變化)]，每種貨幣的差額記到對方帳戶（默認為該交易類型的系統帳戶）。
+    冪等鍵已入帳時拋出 ledger.DuplicateTransaction，不修改任何餘額。
+    
+    寫入順序: 先寫帳本日誌，再由調用者保存用戶數據。保存失敗時交易和冪等鍵已在帳本中，
+    重試會得到 DuplicateTransaction；下次涉及這些玩家的交易會由 sync_opening_balances
+    把用戶數據和帳本的差額記為期初餘額並記錄日誌。
+    """
+    book = get_guild_ledger(guild_id, users)
+    if key and book.seen(key):
+        raise ledger.DuplicateTransaction(book.find(key) or {'key': key})
+    
+    changes = [(user_id, currency_id, amount) for user_id, currency_id, amount in changes if amount]
+    if not changes:
+        return {}
+    
+    sync_opening_balances(users, guild_id, book, {(user_id, currency_id) for user_id, currency_id, _ in changes})
+    
+    if counterparty is None:
+        counterparty = ledger.system_account(kind)
+    entries = []
+    totals = {}
+    for user_id, currency_id, amount in changes:
+        entries.append((ledger.user_account(user_id), currency_id, amount))
+        totals[currency_id] = totals.get(currency_id, 0) + amount
+    for currency_id, total in totals.items():
+        if total:
+            entries.append((counterparty, currency_id, -total))
+    
+    txn = book.post(kind, entries, key=key, memo=memo)
+    
+    for user_id, currency_id, amount in changes:
+        user = ensure_user_record(users, user_id, guild_id)
+        user['balances'][currency_id] = user['balances'].get(currency_id, 0) + amount
+    return txn
+
+# ==================== 等級與簽到排行榜 ====================
+
+# {guild_id: 排行榜}（鍵為用戶ID），首次使用或背景預熱時才從伺服器分片建立
+exp_leaderboards = {}
+streak_leaderboards = {}
+
+def build_ranking_index(guild_id: str):
+    """從伺服器的角色和簽到分片建立經驗值和連續簽到排行榜"""
+    exp_items = [(char['user_id'], char['exp']) for char in character_store.shard(guild_id).values()]
+    exp_leaderboards[guild_id] = leaderboard.Leaderboard(exp_items, keep_zero=True)
+    
+    streak_items = []
+    for checkin_key, record in checkin_store.shard(guild_id).items():
+        # 簽到記錄的鍵: {guild_id}_{user_id}_checkin
+        parts = checkin_key.split('_')
+        if len(parts) == 3 and parts[2] == 'checkin':
+            streak_items.append((parts[1], record.get('streak', 0)))
+    streak_leaderboards[guild_id] = leaderboard.Leaderboard(streak_items)
+
+def get_exp_leaderboard(guild_id: str) -> leaderboard.Leaderboard:
+    if guild_id not in exp_leaderboards:
+        build_ranking_index(guild_id)
+    return exp_leaderboards[guild_id]
+
+def get_streak_leaderboard(guild_id: str) -> leaderboard.Leaderboard:
+    if guild_id not in streak_leaderboards:
+        build_ranking_index(guild_id)
+    return streak_leaderboards[guild_id]
+
+def record_exp(char: dict):
+    """角色經驗值變更後更新排行榜"""
+    get_exp_leaderboard(char['guild_id']).update(char['user_id'], char['exp'])
+
 # ==================== 簽到設置Modal ====================
 
-class CheckinSettingsModal(discord.ui.Modal, title='簽到設置'):
+class CheckinSettingsModal(TrackedModal, title='簽到設置'):
     base_amount = discord.ui.TextInput(
         label='基礎簽到金額',
         placeholder='輸入基礎簽到獲得的金額',
@@ -254,7 +569,7 @@ class CheckinSettingsModal(discord.ui.Modal, title='簽到設置'):
 
 # ==================== 貨幣管理Modal ====================
 
-class CreateCurrencyModal(discord.ui.Modal, title='創建貨幣'):
+class CreateCurrencyModal(TrackedModal, title='創建貨幣'):
     currency_id = discord.ui.TextInput(
         label='貨幣ID',
         placeholder='例如: gold, diamond, coin（英文，不可重複）',
@@ -299,6 +614,13 @@ class CreateCurrencyModal(discord.ui.Modal, title='創建貨幣'):
             )
             return
         
+        if is_tombstoned(guilds[guild_id], 'currencies', currency_id):
+            await interaction.response.send_message(
+                f"❌ 貨幣ID `{currency_id}` 剛被刪除，舊數據還在清理中，請稍後再試或使用其他ID。",
+                ephemeral=True
+            )
+            return
+        
         # 檢查ID格式（只允許英文和數字）
         if not currency_id.replace('_', '').isalnum() or not currency_id[0].isalpha():
             await interaction.response.send_message(
@@ -406,7 +728,11 @@ async def checkin(interaction: discord.Interaction):
     # 執行簽到 - 獲得所有貨幣
     users = get_users()
     member = interaction.guild.get_member(interaction.user.id)
-    income_roles = guilds[guild_id].get('income_roles', {})
+    # 啟用定時收入時身份組收入改為自動發放，簽到不再重複加成
+    if get_passive_income_settings(guilds[guild_id])['enabled']:
+        income_roles = {}
+    else:
+        income_roles = guilds[guild_id].get('income_roles', {})
     checkin_settings_list = guilds[guild_id].get('checkin_settings', {})
     
     # 收集所有獎勵
@@ -441,21 +767,28 @@ async def checkin(interaction: discord.Interaction):
         
         total_reward = base_amount + bonus
         
-        # 更新餘額
-        if curr_id not in users[user_key]['balances']:
-            users[user_key]['balances'][curr_id] = 0
-        users[user_key]['balances'][curr_id] += total_reward
-        
         # 記錄獎勵信息
         rewards.append({
             'currency_id': curr_id,
             'currency_data': curr_data,
             'base': base_amount,
             'bonus': bonus,
-            'total': total_reward,
-            'balance': users[user_key]['balances'][curr_id]
+            'total': total_reward
         })
     
+    # 所有貨幣的獎勵記為一筆交易
+    try:
+        post_transaction(
+            users, guild_id, 'checkin',
+            [(user_id, reward['currency_id'], reward['total']) for reward in rewards],
+            key=interaction_key(interaction, 'checkin'),
+            memo="每日簽到"
+        )
+    except ledger.DuplicateTransaction:
+        await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+        return
+    for reward in rewards:
+        reward['balance'] = users[user_key]['balances'].get(reward['currency_id'], 0)
     save_users(users)
     
     # 更新簽到記錄
@@ -471,6 +804,7 @@ async def checkin(interaction: discord.Interaction):
             checkins[global_checkin_key]['streak'] = 1
     else:
         checkins[global_checkin_key]['streak'] = 1
+    get_streak_leaderboard(guild_id).update(user_id, checkins[global_checkin_key]['streak'])
     
     checkins[global_checkin_key]['last_checkin'] = today
     save_checkins(checkins)
@@ -583,7 +917,7 @@ async def list_checkin_settings(interaction: discord.Interaction):
 
 # ==================== 商店相關Modal ====================
 
-class CreateShopModal(discord.ui.Modal, title='創建商店'):
+class CreateShopModal(TrackedModal, title='創建商店'):
     shop_id = discord.ui.TextInput(
         label='商店ID',
         placeholder='自定義ID，例如: magic_shop, weapon_store',
@@ -635,6 +969,13 @@ class CreateShopModal(discord.ui.Modal, title='創建商店'):
             )
             return
         
+        if is_tombstoned(get_guilds().get(self.guild_id, {}), 'shops', shop_tombstone_key(shop_key, shop_id)):
+            await interaction.response.send_message(
+                f"❌ 商店ID `{shop_id}` 剛被刪除，舊數據還在清理中，請稍後再試或使用其他ID。",
+                ephemeral=True
+            )
+            return
+        
         # 檢查ID格式
         if not shop_id.replace('_', '').isalnum() or not shop_id[0].isalpha():
             await interaction.response.send_message(
@@ -666,7 +1007,7 @@ class CreateShopModal(discord.ui.Modal, title='創建商店'):
         
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
-class AddItemModal(discord.ui.Modal, title='添加商品'):
+class AddItemModal(TrackedModal, title='添加商品'):
     item_id = discord.ui.TextInput(
         label='商品ID',
         placeholder='自定義ID，例如: sword_01, potion_hp',
@@ -793,16 +1134,78 @@ class AddItemModal(discord.ui.Modal, title='添加商品'):
         
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
+# ==================== 持久化元件路由 ====================
+
+# 按鈕和選單的狀態編碼在 custom_id 中（"前綴:參數1:參數2..."），互動由 on_interaction
+# 按前綴分派到處理函數。發出的 View 不保存在記憶體中，不會過期，重啟後仍然有效。
+# {前綴: (處理函數, 頻率限制名稱, 處理函數的簽名)}
+COMPONENT_HANDLERS = {}
+
+# 改為持久化元件之前使用的 custom_id（沒有參數，無法得知要操作的對象）
+LEGACY_COMPONENT_IDS = {'currency_select', 'toggle_consumable', 'toggle_resellable', 'toggle_usable'}
+
+EXPIRED_COMPONENT_MESSAGE = "⌛ 這個按鈕已過期，請重新使用指令。"
+
+def component_handler(prefix: str, rate_limit: Optional[str] = None):
+    """註冊元件處理函數，處理函數的參數為 (interaction, *custom_id中的參數)"""
+    def decorator(func):
+        COMPONENT_HANDLERS[prefix] = (func, rate_limit, inspect.signature(func))
+        return func
+    return decorator
+
+def component_id(prefix: str, *args) -> str:
+    """組合元件的 custom_id（參數不能包含冒號，總長度不超過100）"""
+    custom_id = ":".join([prefix, *map(str, args)])
+    if len(custom_id) > 100:
+        raise ValueError(f"custom_id 過長: {custom_id}")
+    return custom_id
+
+async def route_component(interaction: discord.Interaction) -> bool:
+    """把元件互動分派到註冊的處理函數，返回是否已處理"""
+    if interaction.type != discord.InteractionType.component:
+        return False
+    custom_id = (interaction.data or {}).get('custom_id', '')
+    prefix, _, rest = custom_id.partition(':')
+    entry = COMPONENT_HANDLERS.get(prefix)
+    if entry is None and custom_id not in LEGACY_COMPONENT_IDS:
+        return False
+    
+    # 舊訊息的元件，或參數數量和處理函數不符（元件格式已變更）時提示重新使用指令
+    args = rest.split(':') if rest else []
+    expired = entry is None
+    if not expired:
+        handler, rate_limit, signature = entry
+        try:
+            signature.bind(interaction, *args)
+        except TypeError:
+            expired = True
+    if expired:
+        await interaction.response.send_message(EXPIRED_COMPONENT_MESSAGE, ephemeral=True)
+        return True
+    
+    if await reject_if_shutting_down(interaction):
+        return True
+    if rate_limit and not await check_rate_limit(interaction, rate_limit):
+        return True
+    with track_in_flight():
+        await handler(interaction, *args)
+    return True
+
+class PersistentView(discord.ui.View):
+    """只用於發送的 View（不註冊到 discord.py 的 View 存儲，互動由 route_component 處理）"""
+    
+    def __init__(self):
+        super().__init__(timeout=None)
+    
+    def is_finished(self) -> bool:
+        # discord.py 發送訊息時只存儲未結束的 View
+        return True
+
 # ==================== 選擇貨幣View ====================
 
-class CurrencySelectView(discord.ui.View):
+class CurrencySelectView(PersistentView):
     def __init__(self, guild_id: str, user_id: str, shop_id: str, action: str):
-        super().__init__(timeout=300)
-        self.guild_id = guild_id
-        self.user_id = user_id
-        self.shop_id = shop_id
-        self.action = action
-        self.selected_currency = None
+        super().__init__()
         
         # 添加貨幣選擇菜單
         guilds = get_guilds()
@@ -820,30 +1223,34 @@ class CurrencySelectView(discord.ui.View):
             
             select = discord.ui.Select(
                 placeholder="選擇貨幣類型...",
-                options=options,
-                custom_id="currency_select"
+                options=options[:25],
+                custom_id=component_id('currency_select', action, user_id, shop_id)
             )
-            select.callback = self.currency_selected
             self.add_item(select)
+
+@component_handler('currency_select')
+async def currency_selected(interaction: discord.Interaction, action: str, user_id: str, shop_id: str):
+    if str(interaction.user.id) != user_id:
+        await interaction.response.send_message("❌ 這不是你的操作！", ephemeral=True)
+        return
     
-    async def currency_selected(self, interaction: discord.Interaction):
-        if str(interaction.user.id) != self.user_id:
-            await interaction.response.send_message("❌ 這不是你的操作！", ephemeral=True)
-            return
-        
-        currency_id = interaction.data['values'][0]
-        guilds = get_guilds()
-        currency_data = guilds[self.guild_id]['currencies'][currency_id]
-        
-        if self.action == "add_item":
-            # 打開添加商品的Modal
-            shop_key = f"{self.guild_id}_{self.user_id}"
-            modal = AddItemModal(shop_key, self.shop_id, currency_id, currency_data)
-            await interaction.response.send_modal(modal)
+    guild_id = str(interaction.guild.id)
+    currency_id = interaction.data['values'][0]
+    guilds = get_guilds()
+    currency_data = guilds.get(guild_id, {}).get('currencies', {}).get(currency_id)
+    if currency_data is None:
+        await interaction.response.send_message("❌ 找不到該貨幣！", ephemeral=True)
+        return
+    
+    if action == "add_item":
+        # 打開添加商品的Modal
+        shop_key = f"{guild_id}_{user_id}"
+        modal = AddItemModal(shop_key, shop_id, currency_id, currency_data)
+        await interaction.response.send_modal(modal)
 
 # ==================== 購買數量選擇Modal ====================
 
-class PurchaseQuantityModal(discord.ui.Modal, title='選擇購買數量'):
+class PurchaseQuantityModal(TrackedModal, title='選擇購買數量'):
     quantity = discord.ui.TextInput(
         label='購買數量',
         placeholder='輸入要購買的數量',
@@ -869,10 +1276,15 @@ class PurchaseQuantityModal(discord.ui.Modal, title='選擇購買數量'):
             return
         
         shops = get_shops()
-        shop = shops[self.shop_key][self.shop_id]
-        item = shop['items'][self.item_id]
+        item = find_shop_item(shops, self.shop_key, self.shop_id, self.item_id)
+        if item is None:
+            await interaction.response.send_message("❌ 找不到該商品！", ephemeral=True)
+            return
         guilds = get_guilds()
-        currency_data = guilds[self.guild_id]['currencies'][item['currency_id']]
+        currency_data = guilds[self.guild_id]['currencies'].get(item['currency_id'])
+        if currency_data is None:
+            await interaction.response.send_message("❌ 這個商品使用的貨幣已被刪除，無法購買！", ephemeral=True)
+            return
         
         # 檢查庫存
         current_stock = item.get('stock', -1)
@@ -902,13 +1314,25 @@ class PurchaseQuantityModal(discord.ui.Modal, title='選擇購買數量'):
             )
             return
         
+        # 扣款（記帳失敗或重複時不扣庫存、不發放物品）
+        owner_id = self.shop_key.split('_', 1)[1]
+        try:
+            post_transaction(
+                users, self.guild_id, 'purchase',
+                [(user_id, item['currency_id'], -total_price)],
+                counterparty=ledger.shop_account(owner_id, self.shop_id),
+                key=interaction_key(interaction, 'purchase'),
+                memo=f"{item['name']} x{quantity}"
+            )
+        except ledger.DuplicateTransaction:
+            await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+            return
+        
         # 扣除庫存
         if current_stock != -1:
             item['stock'] -= quantity
         
-        # 扣款並添加物品
-        users[user_key]['balances'][item['currency_id']] = user_balance - total_price
-        
+        # 添加物品
         if self.item_id not in users[user_key]['inventory']:
             users[user_key]['inventory'][self.item_id] = {
                 "name": item['name'],
@@ -953,428 +1377,553 @@ class PurchaseQuantityModal(discord.ui.Modal, title='選擇購買數量'):
         
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
-# ==================== 商店和背包View ====================
+# ==================== 使用物品Modal ====================
 
-class ItemSettingsView(discord.ui.View):
-    def __init__(self, shop_key: str, shop_id: str, item_id: str, owner_id: str):
-        super().__init__(timeout=300)
-        self.shop_key = shop_key
-        self.shop_id = shop_id
-        self.item_id = item_id
-        self.owner_id = owner_id
-        self.update_buttons()
-    
-    def update_buttons(self):
-        """更新按鈕狀態"""
-        shops = get_shops()
-        if self.shop_key in shops and self.shop_id in shops[self.shop_key]:
-            if self.item_id in shops[self.shop_key][self.shop_id]['items']:
-                item = shops[self.shop_key][self.shop_id]['items'][self.item_id]
-                
-                # 清除所有按鈕
-                self.clear_items()
-                
-                # 添加更新後的按鈕
-                usable_button = discord.ui.Button(
-                    label='可使用',
-                    style=discord.ButtonStyle.green if item.get('usable', True) else discord.ButtonStyle.red,
-                    custom_id='toggle_usable'
-                )
-                usable_button.callback = self.toggle_usable
-                self.add_item(usable_button)
-                
-                resellable_button = discord.ui.Button(
-                    label='可轉售',
-                    style=discord.ButtonStyle.green if item.get('resellable', True) else discord.ButtonStyle.red,
-                    custom_id='toggle_resellable'
-                )
-                resellable_button.callback = self.toggle_resellable
-                self.add_item(resellable_button)
-                
-                consumable_button = discord.ui.Button(
-                    label='消耗型',
-                    style=discord.ButtonStyle.green if item.get('consumable', True) else discord.ButtonStyle.red,
-                    custom_id='toggle_consumable'
-                )
-                consumable_button.callback = self.toggle_consumable
-                self.add_item(consumable_button)
-    
-    async def toggle_usable(self, interaction: discord.Interaction):
-        if str(interaction.user.id) != self.owner_id:
-            await interaction.response.send_message("❌ 只有商店擁有者可以修改設定！", ephemeral=True)
-            return
-        
-        shops = get_shops()
-        item = shops[self.shop_key][self.shop_id]['items'][self.item_id]
-        item['usable'] = not item.get('usable', True)
-        save_shops(shops)
-        
-        # 更新按鈕和embed
-        self.update_buttons()
-        
-        embed = discord.Embed(
-            title=f"⚙️ {item['name']} (`{self.item_id}`) - 設置",
-            color=discord.Color.blue()
-        )
-        embed.add_field(name="可使用", value="✅ 是" if item.get('usable', True) else "❌ 否", inline=True)
-        embed.add_field(name="可轉售", value="✅ 是" if item.get('resellable', True) else "❌ 否", inline=True)
-        embed.add_field(name="消耗型", value="✅ 是" if item.get('consumable', True) else "❌ 否", inline=True)
-        
-        stock = item.get('stock', -1)
-        stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
-        embed.add_field(name="📦 庫存", value=stock_display, inline=True)
+def use_inventory_items(inventory: dict, requests: dict) -> list:
+    """批量使用背包物品（先全部檢查，再一次性扣除）
+    
+    requests 為 {item_id: 數量}，任何一項無法使用時拋出 ValueError 且不修改背包。
+    返回每個物品的使用結果列表。
+    """
+    for item_id, quantity in requests.items():
+        if item_id not in inventory:
+            raise ValueError(f"背包中沒有此物品 `{item_id}`")
+        item_data = inventory[item_id]
+        if not item_data['item_data'].get('usable', True):
+            raise ValueError(f"**{item_data['name']}** 無法使用")
+        if item_data['item_data'].get('consumable', True) and item_data['quantity'] < quantity:
+            raise ValueError(f"**{item_data['name']}** 數量不足！你只有 **{item_data['quantity']}** 個")
+    
+    results = []
+    for item_id, quantity in requests.items():
+        item_data = inventory[item_id]
+        consumable = item_data['item_data'].get('consumable', True)
+        if consumable:
+            item_data['quantity'] -= quantity
+        remaining = item_data['quantity']
+        if consumable and remaining <= 0:
+            del inventory[item_id]
+        results.append({
+            'item_id': item_id,
+            'name': item_data['name'],
+            'quantity': quantity,
+            'consumable': consumable,
+            'remaining': remaining,
+            'item_data': item_data['item_data']
+        })
+    return results
+
+class UseItemModal(TrackedModal, title='使用物品'):
+    def __init__(self, user_key: str, item_ids: List[str], inventory: dict):
+        super().__init__()
+        self.user_key = user_key
+        self.item_ids = item_ids
+        self.quantity_inputs = {}
         
-        await interaction.response.edit_message(embed=embed, view=self)
+        # Modal最多5個輸入欄位，每個選擇的物品一個數量欄位
+        for item_id in item_ids[:5]:
+            item_data = inventory[item_id]
+            quantity_input = discord.ui.TextInput(
+                label=f"{item_data['name']} 使用數量"[:45],
+                placeholder=f"擁有 {item_data['quantity']} 個",
+                required=True,
+                max_length=10,
+                default="1"
+            )
+            self.quantity_inputs[item_id] = quantity_input
+            self.add_item(quantity_input)
     
-    async def toggle_resellable(self, interaction: discord.Interaction):
-        if str(interaction.user.id) != self.owner_id:
-            await interaction.response.send_message("❌ 只有商店擁有者可以修改設定！", ephemeral=True)
+    async def on_submit(self, interaction: discord.Interaction):
+        requests = {}
+        for item_id, quantity_input in self.quantity_inputs.items():
+            try:
+                quantity = int(quantity_input.value)
+                if quantity <= 0:
+                    raise ValueError
+            except ValueError:
+                await interaction.response.send_message("❌ 數量必須是正整數！", ephemeral=True)
+                return
+            requests[item_id] = quantity
+        
+        users = get_users()
+        if self.user_key not in users:
+            await interaction.response.send_message("❌ 找不到你的背包！", ephemeral=True)
             return
         
-        shops = get_shops()
-        item = shops[self.shop_key][self.shop_id]['items'][self.item_id]
-        item['resellable'] = not item.get('resellable', True)
-        save_shops(shops)
+        try:
+            results = use_inventory_items(users[self.user_key]['inventory'], requests)
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
         
-        # 更新按鈕和embed
-        self.update_buttons()
+        save_users(users)
         
+        used_text = "、".join(f"**{r['name']} x{r['quantity']}**" for r in results)
         embed = discord.Embed(
-            title=f"⚙️ {item['name']} (`{self.item_id}`) - 設置",
-            color=discord.Color.blue()
+            title="✨ 使用物品",
+            description=f"你使用了 {used_text}",
+            color=discord.Color.purple()
         )
-        embed.add_field(name="可使用", value="✅ 是" if item.get('usable', True) else "❌ 否", inline=True)
-        embed.add_field(name="可轉售", value="✅ 是" if item.get('resellable', True) else "❌ 否", inline=True)
-        embed.add_field(name="消耗型", value="✅ 是" if item.get('consumable', True) else "❌ 否", inline=True)
-        
-        stock = item.get('stock', -1)
-        stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
-        embed.add_field(name="📦 庫存", value=stock_display, inline=True)
-        
-        await interaction.response.edit_message(embed=embed, view=self)
-    
-    async def toggle_consumable(self, interaction: discord.Interaction):
-        if str(interaction.user.id) != self.owner_id:
-            await interaction.response.send_message("❌ 只有商店擁有者可以修改設定！", ephemeral=True)
-            return
-        
-        shops = get_shops()
-        item = shops[self.shop_key][self.shop_id]['items'][self.item_id]
-        item['consumable'] = not item.get('consumable', True)
-        save_shops(shops)
         
-        # 更新按鈕和embed
-        self.update_buttons()
+        for result in results[:20]:
+            use_desc = result['item_data'].get('use_description') or result['item_data']['description']
+            if not result['consumable']:
+                remaining_text = "可重複使用"
+            elif result['remaining'] > 0:
+                remaining_text = f"剩餘 {result['remaining']} 個"
+            else:
+                remaining_text = "已用完"
+            embed.add_field(
+                name=f"{result['name']} x{result['quantity']}（{remaining_text}）",
+                value=use_desc[:1024],
+                inline=False
+            )
         
-        embed = discord.Embed(
-            title=f"⚙️ {item['name']} (`{self.item_id}`) - 設置",
-            color=discord.Color.blue()
-        )
-        embed.add_field(name="可使用", value="✅ 是" if item.get('usable', True) else "❌ 否", inline=True)
-        embed.add_field(name="可轉售", value="✅ 是" if item.get('resellable', True) else "❌ 否", inline=True)
-        embed.add_field(name="消耗型", value="✅ 是" if item.get('consumable', True) else "❌ 否", inline=True)
+        if len(results) == 1 and results[0]['item_data'].get('image_url'):
+            embed.set_thumbnail(url=results[0]['item_data']['image_url'])
         
-        stock = item.get('stock', -1)
-        stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
-        embed.add_field(name="📦 庫存", value=stock_display, inline=True)
+        total_used = sum(r['quantity'] for r in results)
+        embed.set_footer(text=f"共使用 {len(results)} 種物品，{total_used} 個")
         
-        await interaction.response.edit_message(embed=embed, view=self)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
-class ShopView(discord.ui.View):
-    def __init__(self, shop_key: str, shop_id: str, guild_id: str, page: int = 0):
-        super().__init__(timeout=300)
-        self.shop_key = shop_key
-        self.shop_id = shop_id
-        self.guild_id = guild_id
-        self.page = page
+# ==================== 商店和背包View ====================
+
+# 商品設置按鈕的代碼（縮短 custom_id）
+ITEM_FLAG_CODES = {'u': 'usable', 'r': 'resellable', 'c': 'consumable'}
+
+def build_item_settings_embed(item: dict, item_id: str) -> discord.Embed:
+    embed = discord.Embed(
+        title=f"⚙️ {item['name']} (`{item_id}`) - 設置",
+        description="點擊下方按鈕切換商品屬性",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="可使用", value="✅ 是" if item.get('usable', True) else "❌ 否", inline=True)
+    embed.add_field(name="可轉售", value="✅ 是" if item.get('resellable', True) else "❌ 否", inline=True)
+    embed.add_field(name="消耗型", value="✅ 是" if item.get('consumable', True) else "❌ 否", inline=True)
     
-    @discord.ui.button(label='購買', style=discord.ButtonStyle.green, emoji='🛒')
-    async def buy_item(self, interaction: discord.Interaction, button: discord.ui.Button):
-        shops = get_shops()
-        shop = shops[self.shop_key][self.shop_id]
-        items = list(shop['items'].items())
-        
-        if not items:
-            await interaction.response.send_message("❌ 商店目前沒有商品！", ephemeral=True)
-            return
-        
-        guilds = get_guilds()
-        options = []
-        for item_id, item in items:
-            if item['price'] > 0:
-                current_stock = item.get('stock', -1)
-                
-                if current_stock == 0:
-                    continue
-                
-                currency_data = guilds[self.guild_id]['currencies'][item['currency_id']]
-                price_display = f"{item['price']} {currency_data['emoji']}"
-                
-                stock_display = "♾️" if current_stock == -1 else f"剩{current_stock}"
-                
-                options.append(
-                    discord.SelectOption(
-                        label=item['name'],
-                        description=f"💰 {price_display} | {item['category']} | 📦 {stock_display}",
-                        value=item_id
-                    )
-                )
-        
-        if not options:
-            await interaction.response.send_message("❌ 沒有可購買的商品或所有商品都已售罄！", ephemeral=True)
-            return
-        
-        select = discord.ui.Select(placeholder="選擇要購買的商品...", options=options[:25])
-        
-        async def select_callback(select_interaction: discord.Interaction):
-            item_id = select.values[0]
-            modal = PurchaseQuantityModal(self.shop_key, self.shop_id, item_id, self.guild_id)
-            await select_interaction.response.send_modal(modal)
-        
-        select.callback = select_callback
-        view = discord.ui.View()
-        view.add_item(select)
-        
-        await interaction.response.send_message("請選擇要購買的商品：", view=view, ephemeral=True)
+    stock = item.get('stock', -1)
+    stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
+    embed.add_field(name="📦 庫存", value=stock_display, inline=True)
     
-    @discord.ui.button(label='上一頁', style=discord.ButtonStyle.gray, emoji='◀️')
-    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.page > 0:
-            self.page -= 1
-            await self.update_shop_display(interaction)
-        else:
-            await interaction.response.send_message("已經是第一頁了！", ephemeral=True)
+    # 顯示描述
+    embed.add_field(name="📝 商品描述", value=item.get('description', '無'), inline=False)
+    if item.get('use_description'):
+        embed.add_field(name="✨ 使用描述", value=item['use_description'], inline=False)
+    else:
+        embed.add_field(name="✨ 使用描述", value="未設置（使用 `/修改使用描述` 設置）", inline=False)
+    return embed
+
+class ItemSettingsView(PersistentView):
+    def __init__(self, item: dict, shop_id: str, item_id: str, owner_id: str):
+        super().__init__()
+        for code, label in (('u', '可使用'), ('r', '可轉售'), ('c', '消耗型')):
+            self.add_item(discord.ui.Button(
+                label=label,
+                style=discord.ButtonStyle.green if item.get(ITEM_FLAG_CODES[code], True) else discord.ButtonStyle.red,
+                custom_id=component_id('item_toggle', code, owner_id, shop_id, item_id)
+            ))
+
+@component_handler('item_toggle')
+async def toggle_item_flag(interaction: discord.Interaction, code: str, owner_id: str, shop_id: str, item_id: str):
+    if str(interaction.user.id) != owner_id:
+        await interaction.response.send_message("❌ 只有商店擁有者可以修改設定！", ephemeral=True)
+        return
     
-    @discord.ui.button(label='下一頁', style=discord.ButtonStyle.gray, emoji='▶️')
-    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        shops = get_shops()
-        shop = shops[self.shop_key][self.shop_id]
-        items = list(shop['items'].items())
-        
-        if (self.page + 1) * 5 < len(items):
-            self.page += 1
-            await self.update_shop_display(interaction)
-        else:
-            await interaction.response.send_message("已經是最後一頁了！", ephemeral=True)
+    shops = get_shops()
+    shop_key = f"{interaction.guild.id}_{owner_id}"
+    item = find_shop_item(shops, shop_key, shop_id, item_id)
+    if item is None or code not in ITEM_FLAG_CODES:
+        await interaction.response.send_message("❌ 找不到該商品！", ephemeral=True)
+        return
     
-    async def update_shop_display(self, interaction: discord.Interaction):
-        shops = get_shops()
-        shop = shops[self.shop_key][self.shop_id]
-        guilds = get_guilds()
-        
-        embed = discord.Embed(
-            title=f"🏪 {shop['name']}",
-            description=shop['description'],
-            color=discord.Color.blue()
-        )
-        
-        if shop['banner_url']:
-            embed.set_image(url=shop['banner_url'])
-        
-        items = list(shop['items'].items())
-        start_idx = self.page * 5
-        end_idx = start_idx + 5
-        page_items = items[start_idx:end_idx]
-        
-        if page_items:
-            for item_id, item in page_items:
-                currency_data = guilds[self.guild_id]['currencies'][item['currency_id']]
-                price_str = "非賣品" if item['price'] == 0 else f"{item['price']} {currency_data['emoji']} {currency_data['name']}"
-                
-                stock = item.get('stock', -1)
-                if stock == -1:
-                    stock_str = "📦 庫存: 無限 ♾️"
-                elif stock == 0:
-                    stock_str = "❌ 已售罄"
-                else:
-                    stock_str = f"📦 庫存: **{stock}** 個"
-                
-                embed.add_field(
-                    name=f"{item['name']} (`{item_id}`)",
-                    value=f"{item['description']}\n💰 價格: {price_str}\n{stock_str}\n📁 類別: {item['category']}",
-                    inline=False
-                )
-        else:
-            embed.add_field(name="商品列表", value="目前沒有商品", inline=False)
-        
-        embed.set_footer(text=f"第 {self.page + 1} 頁 | 共 {len(items)} 件商品")
-        
-        await interaction.response.edit_message(embed=embed, view=self)
+    flag = ITEM_FLAG_CODES[code]
+    item[flag] = not item.get(flag, True)
+    save_shops(shops)
+    
+    # 更新按鈕和embed
+    await interaction.response.edit_message(
+        embed=build_item_settings_embed(item, item_id),
+        view=ItemSettingsView(item, shop_id, item_id, owner_id)
+    )
 
-class InventoryView(discord.ui.View):
-    def __init__(self, user_key: str, guild_id: str, page: int = 0, category: str = None):
-        super().__init__(timeout=300)
-        self.user_key = user_key
-        self.guild_id = guild_id
-        self.page = page
-        self.category = category
+def build_shop_page_embed(shop: dict, guild_id: str, page: int) -> discord.Embed:
+    guilds = get_guilds()
+    embed = discord.Embed(
+        title=f"🏪 {shop['name']}",
+        description=shop['description'],
+        color=discord.Color.blue()
+    )
     
-    @discord.ui.button(label='使用物品', style=discord.ButtonStyle.green, emoji='✨')
-    async def use_item(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = self.user_key.split('_', 1)[1]
-        if str(interaction.user.id) != user_id:
-            await interaction.response.send_message("❌ 這不是你的背包！", ephemeral=True)
-            return
-        
-        users = get_users()
-        inventory = users[self.user_key]['inventory']
-        
-        if not inventory:
-            await interaction.response.send_message("❌ 背包是空的！", ephemeral=True)
-            return
-        
-        options = []
-        for item_id, item_data in inventory.items():
-            if item_data['quantity'] > 0 and item_data['item_data'].get('usable', True):
-                options.append(
-                    discord.SelectOption(
-                        label=item_data['name'],
-                        description=f"數量: {item_data['quantity']} | {item_data['item_data']['category']}",
-                        value=item_id
-                    )
-                )
-        
-        if not options:
-            await interaction.response.send_message("❌ 沒有可使用的物品！", ephemeral=True)
-            return
-        
-        select = discord.ui.Select(placeholder="選擇要使用的物品...", options=options[:25])
-        
-        async def select_callback(select_interaction: discord.Interaction):
-            item_id = select.values[0]
-            item_data = inventory[item_id]
+    if shop['banner_url']:
+        embed.set_image(url=shop['banner_url'])
+    
+    items = list(shop['items'].items())
+    start_idx = page * 5
+    end_idx = start_idx + 5
+    page_items = items[start_idx:end_idx]
+    
+    if page_items:
+        for item_id, item in page_items:
+            currency_data = guilds[guild_id]['currencies'].get(item['currency_id'])
+            if currency_data is None:
+                continue
+            price_str = "非賣品" if item['price'] == 0 else f"{item['price']} {currency_data['emoji']} {currency_data['name']}"
+            
+            stock = item.get('stock', -1)
+            if stock == -1:
+                stock_str = "📦 庫存: 無限 ♾️"
+            elif stock == 0:
+                stock_str = "❌ 已售罄"
+            else:
+                stock_str = f"📦 庫存: **{stock}** 個"
             
-            embed = discord.Embed(
-                title="✨ 使用物品",
-                description=f"你使用了 **{item_data['name']}**",
-                color=discord.Color.purple()
+            embed.add_field(
+                name=f"{item['name']} (`{item_id}`)",
+                value=f"{item['description']}\n💰 價格: {price_str}\n{stock_str}\n📁 類別: {item['category']}",
+                inline=False
             )
+    else:
+        embed.add_field(name="商品列表", value="目前沒有商品", inline=False)
+    
+    embed.set_footer(text=f"第 {page + 1} 頁 | 共 {len(items)} 件商品")
+    return embed
+
+class ShopView(PersistentView):
+    def __init__(self, owner_id: str, shop_id: str, page: int = 0):
+        super().__init__()
+        self.add_item(discord.ui.Button(
+            label='購買', style=discord.ButtonStyle.green, emoji='🛒',
+            custom_id=component_id('shop_buy', owner_id, shop_id)
+        ))
+        # 翻頁按鈕直接記錄目標頁數
+        self.add_item(discord.ui.Button(
+            label='上一頁', style=discord.ButtonStyle.gray, emoji='◀️',
+            custom_id=component_id('shop_page', owner_id, shop_id, page - 1)
+        ))
+        self.add_item(discord.ui.Button(
+            label='下一頁', style=discord.ButtonStyle.gray, emoji='▶️',
+            custom_id=component_id('shop_page', owner_id, shop_id, page + 1)
+        ))
+
+def find_view_shop(interaction: discord.Interaction, owner_id: str, shop_id: str) -> Optional[dict]:
+    """按鈕所屬的商店（已刪除時返回 None）"""
+    return get_shops().get(f"{interaction.guild.id}_{owner_id}", {}).get(shop_id)
+
+@component_handler('shop_buy', rate_limit='shop_view')
+async def buy_item(interaction: discord.Interaction, owner_id: str, shop_id: str):
+    guild_id = str(interaction.guild.id)
+    shop = find_view_shop(interaction, owner_id, shop_id)
+    if shop is None:
+        await interaction.response.send_message("❌ 找不到該商店！", ephemeral=True)
+        return
+    items = list(shop['items'].items())
+    
+    if not items:
+        await interaction.response.send_message("❌ 商店目前沒有商品！", ephemeral=True)
+        return
+    
+    guilds = get_guilds()
+    options = []
+    for item_id, item in items:
+        if item['price'] > 0:
+            current_stock = item.get('stock', -1)
             
-            use_desc = item_data['item_data'].get('use_description') or item_data['item_data']['description']
-            embed.add_field(name="效果", value=use_desc, inline=False)
+            if current_stock == 0:
+                continue
             
-            if item_data['item_data'].get('image_url'):
-                embed.set_thumbnail(url=item_data['item_data']['image_url'])
+            # 貨幣已刪除的商品不顯示
+            currency_data = guilds[guild_id]['currencies'].get(item['currency_id'])
+            if currency_data is None:
+                continue
+            price_display = f"{item['price']} {currency_data['emoji']}"
             
-            if item_data['item_data'].get('consumable', True):
-                item_data['quantity'] -= 1
-                if item_data['quantity'] <= 0:
-                    del users[self.user_key]['inventory'][item_id]
-                    embed.set_footer(text="物品已用完")
-                else:
-                    embed.set_footer(text=f"剩餘數量: {item_data['quantity']}")
-            else:
-                embed.set_footer(text="物品保留在背包中（可重複使用）")
+            stock_display = "♾️" if current_stock == -1 else f"剩{current_stock}"
             
-            save_users(users)
-            await select_interaction.response.send_message(embed=embed, ephemeral=True)
-        
-        select.callback = select_callback
-        view = discord.ui.View()
-        view.add_item(select)
-        
-        await interaction.response.send_message("請選擇要使用的物品：", view=view, ephemeral=True)
+            options.append(
+                discord.SelectOption(
+                    label=item['name'],
+                    description=f"💰 {price_display} | {item['category']} | 📦 {stock_display}",
+                    value=item_id
+                )
+            )
     
-    @discord.ui.button(label='切換類別', style=discord.ButtonStyle.blurple, emoji='📁')
-    async def change_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_id = self.user_key.split('_', 1)[1]
-        if str(interaction.user.id) != user_id:
-            await interaction.response.send_message("❌ 這不是你的背包！", ephemeral=True)
-            return
-        
-        users = get_users()
-        inventory = users[self.user_key]['inventory']
-        
-        categories = set()
-        for item_data in inventory.values():
-            if item_data['quantity'] > 0:
-                categories.add(item_data['item_data']['category'])
-        
-        if not categories:
-            await interaction.response.send_message("❌ 背包是空的！", ephemeral=True)
-            return
-        
-        options = [discord.SelectOption(label="全部", value="all", description="顯示所有物品")]
-        for cat in sorted(categories):
-            options.append(discord.SelectOption(label=cat, value=cat))
-        
-        select = discord.ui.Select(placeholder="選擇類別...", options=options[:25])
-        
-        async def select_callback(select_interaction: discord.Interaction):
-            selected = select.values[0]
-            self.category = None if selected == "all" else selected
-            self.page = 0
-            await self.update_inventory_display(select_interaction)
-        
-        select.callback = select_callback
-        view = discord.ui.View()
-        view.add_item(select)
-        
-        await interaction.response.send_message("選擇物品類別：", view=view, ephemeral=True)
+    if not options:
+        await interaction.response.send_message("❌ 沒有可購買的商品或所有商品都已售罄！", ephemeral=True)
+        return
+    
+    view = PersistentView()
+    view.add_item(discord.ui.Select(
+        placeholder="選擇要購買的商品...",
+        options=options[:25],
+        custom_id=component_id('shop_select', owner_id, shop_id)
+    ))
+    
+    await interaction.response.send_message("請選擇要購買的商品：", view=view, ephemeral=True)
 
-    async def update_inventory_display(self, interaction: discord.Interaction):
-        users = get_users()
-        inventory = users[self.user_key]['inventory']
-        guilds = get_guilds()
-        
-        filtered_items = []
-        for item_id, item_data in inventory.items():
-            if item_data['quantity'] > 0:
-                if self.category is None or item_data['item_data']['category'] == self.category:
-                    filtered_items.append((item_id, item_data))
-        
-        embed = discord.Embed(
-            title="🎒 我的背包",
-            description=f"類別: {self.category or '全部'}",
-            color=discord.Color.gold()
-        )
-        
-        balances_text = []
-        for curr_id, balance in users[self.user_key]['balances'].items():
-            if curr_id in guilds[self.guild_id]['currencies']:
-                curr_data = guilds[self.guild_id]['currencies'][curr_id]
-                balances_text.append(f"{curr_data['emoji']} {curr_data['name']}: {balance}")
-        
-        if balances_text:
-            embed.add_field(name="💰 餘額", value="\n".join(balances_text), inline=False)
+@component_handler('shop_select', rate_limit='shop_view')
+async def select_purchase_item(interaction: discord.Interaction, owner_id: str, shop_id: str):
+    guild_id = str(interaction.guild.id)
+    item_id = interaction.data['values'][0]
+    modal = PurchaseQuantityModal(f"{guild_id}_{owner_id}", shop_id, item_id, guild_id)
+    await interaction.response.send_modal(modal)
+
+@component_handler('shop_page', rate_limit='shop_view')
+async def change_shop_page(interaction: discord.Interaction, owner_id: str, shop_id: str, page: str):
+    shop = find_view_shop(interaction, owner_id, shop_id)
+    if shop is None:
+        await interaction.response.send_message("❌ 找不到該商店！", ephemeral=True)
+        return
+    
+    page = int(page)
+    if page < 0:
+        await interaction.response.send_message("已經是第一頁了！", ephemeral=True)
+        return
+    if page > 0 and page * 5 >= len(shop['items']):
+        await interaction.response.send_message("已經是最後一頁了！", ephemeral=True)
+        return
+    
+    await interaction.response.edit_message(
+        embed=build_shop_page_embed(shop, str(interaction.guild.id), page),
+        view=ShopView(owner_id, shop_id, page)
+    )
+
+def build_inventory_page_embed(user: dict, guild_id: str, category: Optional[str], page: int = 0) -> discord.Embed:
+    inventory = user['inventory']
+    guilds = get_guilds()
+    
+    filtered_items = []
+    for item_id, item_data in inventory.items():
+        if item_data['quantity'] > 0:
+            if category is None or item_data['item_data']['category'] == category:
+                filtered_items.append((item_id, item_data))
+    
+    embed = discord.Embed(
+        title="🎒 我的背包",
+        description=f"類別: {category or '全部'}",
+        color=discord.Color.gold()
+    )
+    
+    balances_text = []
+    for curr_id, balance in user['balances'].items():
+        if curr_id in guilds[guild_id]['currencies']:
+            curr_data = guilds[guild_id]['currencies'][curr_id]
+            balances_text.append(f"{curr_data['emoji']} {curr_data['name']}: {balance}")
+    
+    if balances_text:
+        embed.add_field(name="💰 餘額", value="\n".join(balances_text), inline=False)
+    
+    if filtered_items:
+        start_idx = page * 10
+        end_idx = start_idx + 10
+        page_items = filtered_items[start_idx:end_idx]
         
-        if filtered_items:
-            start_idx = self.page * 10
-            end_idx = start_idx + 10
-            page_items = filtered_items[start_idx:end_idx]
+        for item_id, item_data in page_items:
+            consumable_tag = "🔄 可重複使用" if not item_data['item_data'].get('consumable', True) else "💨 消耗品"
+            usable_tag = "✅ 可使用" if item_data['item_data'].get('usable', True) else "❌ 不可使用"
             
-            for item_id, item_data in page_items:
-                consumable_tag = "🔄 可重複使用" if not item_data['item_data'].get('consumable', True) else "💨 消耗品"
-                usable_tag = "✅ 可使用" if item_data['item_data'].get('usable', True) else "❌ 不可使用"
-                
-                embed.add_field(
-                    name=f"{item_data['name']} x{item_data['quantity']}",
-                    value=f"{item_data['item_data']['category']} | {consumable_tag} | {usable_tag}",
-                    inline=False
+            embed.add_field(
+                name=f"{item_data['name']} x{item_data['quantity']}",
+                value=f"{item_data['item_data']['category']} | {consumable_tag} | {usable_tag}",
+                inline=False
+            )
+    else:
+        embed.add_field(name="背包", value="空空如也...", inline=False)
+    
+    embed.set_footer(text=f"第 {page + 1} 頁 | 共 {len(filtered_items)} 件物品")
+    return embed
+
+class InventoryView(PersistentView):
+    def __init__(self, user_id: str):
+        super().__init__()
+        self.add_item(discord.ui.Button(
+            label='使用物品', style=discord.ButtonStyle.green, emoji='✨',
+            custom_id=component_id('inv_use', user_id)
+        ))
+        self.add_item(discord.ui.Button(
+            label='切換類別', style=discord.ButtonStyle.blurple, emoji='📁',
+            custom_id=component_id('inv_category', user_id)
+        ))
+
+async def get_view_inventory_owner(interaction: discord.Interaction, user_id: str) -> Optional[dict]:
+    """檢查按鈕是否屬於操作者，返回用戶數據（已回覆錯誤時返回 None）"""
+    if str(interaction.user.id) != user_id:
+        await interaction.response.send_message("❌ 這不是你的背包！", ephemeral=True)
+        return None
+    user = get_users().get(get_user_key(str(interaction.guild.id), user_id))
+    if user is None or not user['inventory']:
+        await interaction.response.send_message("❌ 背包是空的！", ephemeral=True)
+        return None
+    return user
+
+@component_handler('inv_use', rate_limit='inventory_view')
+async def use_item(interaction: discord.Interaction, user_id: str):
+    user = await get_view_inventory_owner(interaction, user_id)
+    if user is None:
+        return
+    
+    options = []
+    for item_id, item_data in user['inventory'].items():
+        if item_data['quantity'] > 0 and item_data['item_data'].get('usable', True):
+            options.append(
+                discord.SelectOption(
+                    label=item_data['name'],
+                    description=f"數量: {item_data['quantity']} | {item_data['item_data']['category']}",
+                    value=item_id
                 )
-        else:
-            embed.add_field(name="背包", value="空空如也...", inline=False)
-        
-        embed.set_footer(text=f"第 {self.page + 1} 頁 | 共 {len(filtered_items)} 件物品")
-        
-        await interaction.response.edit_message(embed=embed, view=self)
+            )
+    
+    if not options:
+        await interaction.response.send_message("❌ 沒有可使用的物品！", ephemeral=True)
+        return
+    
+    options = options[:25]
+    view = PersistentView()
+    view.add_item(discord.ui.Select(
+        placeholder="選擇要使用的物品（可多選，最多5種）...",
+        options=options,
+        min_values=1,
+        max_values=min(5, len(options)),
+        custom_id=component_id('inv_use_select', user_id)
+    ))
+    
+    await interaction.response.send_message("請選擇要使用的物品：", view=view, ephemeral=True)
+
+@component_handler('inv_use_select', rate_limit='inventory_view')
+async def select_use_items(interaction: discord.Interaction, user_id: str):
+    user = await get_view_inventory_owner(interaction, user_id)
+    if user is None:
+        return
+    
+    # 在Modal中為每個選擇的物品輸入數量，提交後一次性使用並保存
+    item_ids = [item_id for item_id in interaction.data['values'] if item_id in user['inventory']]
+    if not item_ids:
+        await interaction.response.send_message("❌ 背包中已經沒有這些物品了！", ephemeral=True)
+        return
+    modal = UseItemModal(get_user_key(str(interaction.guild.id), user_id), item_ids, user['inventory'])
+    await interaction.response.send_modal(modal)
+
+@component_handler('inv_category', rate_limit='inventory_view')
+async def change_category(interaction: discord.Interaction, user_id: str):
+    user = await get_view_inventory_owner(interaction, user_id)
+    if user is None:
+        return
+    
+    categories = set()
+    for item_data in user['inventory'].values():
+        if item_data['quantity'] > 0:
+            categories.add(item_data['item_data']['category'])
+    
+    if not categories:
+        await interaction.response.send_message("❌ 背包是空的！", ephemeral=True)
+        return
+    
+    options = [discord.SelectOption(label="全部", value="all", description="顯示所有物品")]
+    for cat in sorted(categories):
+        options.append(discord.SelectOption(label=cat, value=cat))
+    
+    view = PersistentView()
+    view.add_item(discord.ui.Select(
+        placeholder="選擇類別...",
+        options=options[:25],
+        custom_id=component_id('inv_category_select', user_id)
+    ))
+    
+    await interaction.response.send_message("選擇物品類別：", view=view, ephemeral=True)
+
+@component_handler('inv_category_select', rate_limit='inventory_view')
+async def select_category(interaction: discord.Interaction, user_id: str):
+    user = await get_view_inventory_owner(interaction, user_id)
+    if user is None:
+        return
+    
+    selected = interaction.data['values'][0]
+    category = None if selected == "all" else selected
+    await interaction.response.edit_message(
+        embed=build_inventory_page_embed(user, str(interaction.guild.id), category),
+        view=InventoryView(user_id)
+    )
 
 # ==================== 角色卡Modal和等級系統 ====================
 
-# 等級經驗值計算函數
-def calculate_exp_for_level(level: int) -> int:
+# 等級經驗值計算函數（使用 leveling 模組的預計算門檻表）
+def get_level_table(guild_id: str, guilds: dict = None) -> leveling.LevelTable:
+    """獲取伺服器的等級門檻表（曲線變更時才重新編譯）"""
+    if guilds is None:
+        guilds = get_guilds()
+    curve_config = guilds.get(guild_id, {}).get('leveling_curve')
+    return leveling.get_table(guild_id, curve_config)
+
+def calculate_exp_for_level(level: int, guild_id: str = None) -> int:
     """計算升到指定等級所需的總經驗值"""
-    # 使用公式: 100 * level^1.5
-    return int(100 * (level ** 1.5))
+    if guild_id is None:
+        return leveling.exp_for_level(level)
+    return get_level_table(guild_id).exp_for_level(level)
 
-def calculate_level_from_exp(exp: int) -> int:
+def calculate_level_from_exp(exp: int, guild_id: str = None) -> int:
     """根據經驗值計算等級"""
-    level = 1
-    while calculate_exp_for_level(level + 1) <= exp:
-        level += 1
-    return level
+    if guild_id is None:
+        return leveling.level_from_exp(exp)
+    return get_level_table(guild_id).level_from_exp(exp)
+
+def recalculate_guild_levels(guild_id: str, table: leveling.LevelTable) -> int:
+    """等級曲線變更後，一次性重新計算伺服器所有角色的等級，返回等級有變化的角色數量"""
+    characters = get_characters()
+    changed = 0
+    for char in characters.guild(guild_id).values():
+        new_level = table.level_from_exp(char.get('exp', 0))
+        if char.get('level') != new_level:
+            char['level'] = new_level
+            changed += 1
+    if changed:
+        save_characters(characters)
+    return changed
+
+# 裝備衍生屬性
+def get_catalog_version(guild_id: str, guilds: dict) -> int:
+    """伺服器裝備目錄的版本（裝備屬性變更時遞增，使角色的衍生屬性快取失效）"""
+    return guilds.get(guild_id, {}).get('equipment_catalog_version', 0)
+
+def bump_catalog_version(guild_id: str, guilds: dict):
+    """裝備目錄變更（調用者負責保存伺服器數據）"""
+    guilds[guild_id]['equipment_catalog_version'] = get_catalog_version(guild_id, guilds) + 1
+
+def find_shop_item(shops: dict, shop_key: str, shop_id: str, item_id: str) -> Optional[dict]:
+    """在商品目錄中查找商品（已刪除時返回 None）"""
+    return shops.get(shop_key, {}).get(shop_id, {}).get('items', {}).get(item_id)
+
+def ensure_character_stats(char: dict, guild_id: str, guilds: dict = None) -> bool:
+    """確保角色的衍生屬性快取有效
+    
+    沒有裝備的角色直接使用基礎屬性，不需要快取。
+    快取失效（目錄版本變更）時從商品目錄同步裝備屬性並重新計算，返回 True 表示角色數據需要保存。
+    """
+    if not char.get('equipment'):
+        if 'derived_stats' in char:
+            del char['derived_stats']
+            return True
+        return False
+    
+    if guilds is None:
+        guilds = get_guilds()
+    version = get_catalog_version(guild_id, guilds)
+    if equipment.cached_stats(char, version) is not None:
+        return False
+    
+    shops = get_shops()
+    for entry in char['equipment'].values():
+        item = find_shop_item(shops, entry['shop_key'], entry['shop_id'], entry['item_id'])
+        if item is not None:
+            entry['stats'] = equipment.item_stats(item)
+    equipment.refresh_stats(char, version)
+    return True
 
-class CreateCharacterModal(discord.ui.Modal, title='創建角色'):
+def format_stat_with_bonus(value: int, base: int) -> str:
+    """顯示屬性值和裝備加成，例如: 25 (+5)"""
+    bonus = value - base
+    return f"{value} ({bonus:+d})" if bonus else str(value)
+
+class CreateCharacterModal(TrackedModal, title='創建角色'):
     char_name = discord.ui.TextInput(
         label='角色名稱',
         placeholder='輸入角色名稱...',
@@ -1444,12 +1993,14 @@ class CreateCharacterModal(discord.ui.Modal, title='創建角色'):
             "defense": defense,
             "level": 1,
             "exp": 0,
+            "vitals_updated_at": datetime.now().timestamp(),
             "created_at": datetime.now().isoformat()
         }
         
         users[user_key]['character'] = char_id
         save_characters(characters)
         save_users(users)
+        record_exp(characters[char_id])
         
         embed = discord.Embed(
             title="✅ 角色創建成功！",
@@ -1461,91 +2012,767 @@ class CreateCharacterModal(discord.ui.Modal, title='創建角色'):
         embed.add_field(name="攻擊力", value=attack, inline=True)
         embed.add_field(name="防禦力", value=defense, inline=True)
         embed.add_field(name="等級", value="1", inline=True)
-        embed.add_field(name="經驗值", value=f"0/{calculate_exp_for_level(2)}", inline=True)
+        embed.add_field(name="經驗值", value=f"0/{calculate_exp_for_level(2, self.guild_id)}", inline=True)
         
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
-# ==================== 斜線指令 ====================
+# ==================== 聊天與語音活動獎勵 ====================
 
-# ========== 貨幣管理指令 ==========
+# 聊天經驗值默認設置（每次獎勵的經驗值範圍）
+DEFAULT_MESSAGE_EXP = {'enabled': False, 'min': 15, 'max': 25}
 
-@bot.tree.command(name="創建貨幣", description="創建一種新的貨幣（管理員）")
-async def create_currency(interaction: discord.Interaction):
-    if not await check_admin_permission(interaction):
-        await interaction.response.send_message(
-            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
-            ephemeral=True
-        )
-        return
-    
-    await interaction.response.send_modal(CreateCurrencyModal())
+# 語音收入默認設置（每分鐘獲得的貨幣和經驗值）
+DEFAULT_VOICE_INCOME = {'enabled': False, 'currency_id': None, 'amount_per_minute': 0, 'exp_per_minute': 0}
 
-@bot.tree.command(name="貨幣列表", description="查看伺服器的所有貨幣")
-async def list_currencies(interaction: discord.Interaction):
-    guild_id = str(interaction.guild.id)
+# 活動獎勵只在記憶體中累積，由 flush_activity 定時批量寫入
+message_xp_tracker = activity.MessageXPTracker()
+voice_tracker = activity.VoiceSessionTracker()
+
+# 聊天經驗值是否啟用的快取 {guild_id: bool}
+# 只在首次收到訊息時讀取文件，修改設置時清除
+message_exp_enabled_cache = {}
+
+def get_message_exp_settings(guild_data: dict) -> dict:
+    """獲取伺服器的聊天經驗值設置"""
+    settings = dict(DEFAULT_MESSAGE_EXP)
+    settings.update(guild_data.get('message_exp', {}))
+    return settings
+
+def is_message_exp_enabled(guild_id: str) -> bool:
+    """伺服器是否啟用聊天經驗值（未啟用的伺服器不記錄訊息）"""
+    enabled = message_exp_enabled_cache.get(guild_id)
+    if enabled is None:
+        guild_data = load_json(GUILDS_FILE, {}).get(guild_id, {})
+        enabled = bool(get_message_exp_settings(guild_data)['enabled'])
+        message_exp_enabled_cache[guild_id] = enabled
+    return enabled
+
+def get_voice_income_settings(guild_data: dict) -> dict:
+    """獲取伺服器的語音收入設置"""
+    settings = dict(DEFAULT_VOICE_INCOME)
+    settings.update(guild_data.get('voice_income', {}))
+    return settings
+
+def is_voice_earning(state: Optional[discord.VoiceState]) -> bool:
+    """語音狀態是否計入收入（不在AFK頻道且沒有拒聽）"""
+    if state is None or state.channel is None:
+        return False
+    if state.self_deaf or state.deaf:
+        return False
+    afk_channel = state.channel.guild.afk_channel
+    return afk_channel is None or state.channel.id != afk_channel.id
+
+def prepare_activity_rewards(message_pending: dict, voice_minutes: dict) -> dict:
+    """在數據視圖中計算累積的聊天和語音獎勵（不寫入任何數據，出錯時可以整批重試）"""
     guilds = get_guilds()
-    init_guild(guild_id)
-    
-    if not guilds[guild_id]['currencies']:
-        await interaction.response.send_message(
-            "❌ 伺服器還沒有創建任何貨幣！\n管理員可以使用 `/創建貨幣` 來創建。",
-            ephemeral=True
-        )
-        return
-    
-    embed = discord.Embed(
-        title="💎 貨幣列表",
-        description=f"{interaction.guild.name} 的所有貨幣",
-        color=discord.Color.gold()
-    )
+    characters = get_characters()
+    level_ups = {}
+    # 經驗值有變化的角色
+    updated = []
+    # 語音收入按伺服器合併記帳 {guild_id: [(用戶ID, 貨幣ID, 金額)]}
+    voice_income = {}
+    
+    # 合併經驗值 {(guild_id, user_id): [經驗值, 通知頻道ID]}
+    exp_gains = {}
+    
+    for (guild_id, user_id), (count, channel_id) in message_pending.items():
+        if guild_id not in guilds:
+            continue
+        settings = get_message_exp_settings(guilds[guild_id])
+        if not settings['enabled']:
+            continue
+        gained = sum(random.randint(settings['min'], settings['max']) for _ in range(count))
+        exp_gains[(guild_id, user_id)] = [gained, channel_id]
+    
+    for (guild_id, user_id), (minutes, channel_id) in voice_minutes.items():
+        if guild_id not in guilds:
+            continue
+        settings = get_voice_income_settings(guilds[guild_id])
+        if not settings['enabled']:
+            continue
+        
+        currency_id = settings['currency_id']
+        amount = settings['amount_per_minute'] * minutes
+        if amount > 0 and currency_id in guilds[guild_id]['currencies']:
+            voice_income.setdefault(guild_id, []).append((user_id, currency_id, amount))
+        
+        exp = settings['exp_per_minute'] * minutes
+        if exp > 0:
+            entry = exp_gains.setdefault((guild_id, user_id), [0, channel_id])
+            entry[0] += exp
+    
+    for (guild_id, user_id), (gained, channel_id) in exp_gains.items():
+        char = characters.get(f"char_{get_user_key(guild_id, user_id)}")
+        if char is None:
+            continue
+        table = get_level_table(guild_id, guilds)
+        old_level = table.level_from_exp(char['exp'])
+        char['exp'] += gained
+        char['level'] = table.level_from_exp(char['exp'])
+        updated.append(char)
+        
+        if char['level'] > old_level:
+            level_ups.setdefault(channel_id, []).append((user_id, char['name'], char['level']))
+    
+    return {
+        'characters': characters,
+        'updated': updated,
+        'voice_income': voice_income,
+        'level_ups': level_ups
+    }
+
+def commit_activity_rewards(rewards: dict) -> dict:
+    """寫入計算好的活動獎勵（每個文件最多保存一次），返回升級記錄 {channel_id: [(user_id, 角色名稱, 新等級)]}
     
-    for curr_id, curr_data in guilds[guild_id]['currencies'].items():
-        embed.add_field(
-            name=f"{curr_data['emoji']} {curr_data['name']} (`{curr_id}`)",
-            value=curr_data.get('description', '沒有描述'),
-            inline=False
-        )
+    出錯時部分獎勵可能已經寫入，調用者不應再重試同一批獎勵。
+    """
+    if rewards['updated']:
+        save_characters(rewards['characters'])
+        for char in rewards['updated']:
+            record_exp(char)
     
-    await interaction.response.send_message(embed=embed)
+    if rewards['voice_income']:
+        users = get_users()
+        for guild_id, changes in rewards['voice_income'].items():
+            post_transaction(users, guild_id, 'voice_income', changes, memo="語音收入")
+        save_users(users)
+    return rewards['level_ups']
 
-@bot.tree.command(name="刪除貨幣", description="刪除一種貨幣（管理員，謹慎使用！）")
-@app_commands.describe(貨幣id="要刪除的貨幣ID")
-async def delete_currency(interaction: discord.Interaction, 貨幣id: str):
-    if not await check_admin_permission(interaction):
-        await interaction.response.send_message(
-            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
-            ephemeral=True
+def apply_activity_rewards(message_pending: dict, voice_minutes: dict) -> dict:
+    """計算並寫入累積的聊天和語音獎勵，返回升級記錄"""
+    return commit_activity_rewards(prepare_activity_rewards(message_pending, voice_minutes))
+
+async def announce_level_ups(level_ups: dict):
+    """每個頻道合併發送一條升級通知"""
+    for channel_id, entries in level_ups.items():
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            continue
+        
+        lines = [f"<@{user_id}> 的 **{name}** 升到了 **Lv.{level}**！" for user_id, name, level in entries[:20]]
+        if len(entries) > 20:
+            lines.append(f"……還有 {len(entries) - 20} 位玩家升級")
+        
+        embed = discord.Embed(
+            title="🎉 升級通知",
+            description="\n".join(lines),
+            color=discord.Color.gold()
         )
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException as e:
+            print(f'❌ 發送升級通知時出錯: {e}')
+
+@tasks.loop(seconds=activity.ACTIVITY_FLUSH_INTERVAL)
+async def flush_activity():
+    """定時把記憶體中累積的活動獎勵寫入文件"""
+    if voice_tracker.checkpoint_due():
+        voice_tracker.checkpoint()
+    
+    ledger_book.checkpoint_all()
+    
+    # 每次最多寫入固定數量的用戶，超出的放回追蹤器留到下次
+    message_pending, message_rest = activity.split_batch(message_xp_tracker.drain(), activity.ACTIVITY_FLUSH_MAX_USERS)
+    voice_minutes, voice_rest = activity.split_batch(voice_tracker.drain(), activity.ACTIVITY_FLUSH_MAX_USERS)
+    message_xp_tracker.restore(message_rest)
+    voice_tracker.restore(voice_rest)
+    if not message_pending and not voice_minutes:
         return
     
-    guild_id = str(interaction.guild.id)
-    guilds = get_guilds()
-    init_guild(guild_id)
-    
-    currency_id = 貨幣id.lower().strip()
-    
-    if currency_id not in guilds[guild_id]['currencies']:
-        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+    try:
+        rewards = prepare_activity_rewards(message_pending, voice_minutes)
+    except Exception as e:
+        # 計算階段沒有寫入任何數據，保留獎勵下次再寫
+        message_xp_tracker.restore(message_pending)
+        voice_tracker.restore(voice_minutes)
+        print(f'❌ 計算活動獎勵時出錯: {e}')
         return
     
-    currency_name = guilds[guild_id]['currencies'][currency_id]['name']
-    del guilds[guild_id]['currencies'][currency_id]
-    
-    # 同時刪除簽到設置
-    if currency_id in guilds[guild_id].get('checkin_settings', {}):
-        del guilds[guild_id]['checkin_settings'][currency_id]
-    
-    save_guilds(guilds)
+    try:
+        level_ups = commit_activity_rewards(rewards)
+    except Exception as e:
+        # 部分獎勵可能已經寫入，放回追蹤器會重複發放
+        print(f'❌ 寫入活動獎勵時出錯（這批獎勵不會重試）: {e}')
+        return
     
-    await interaction.response.send_message(
-        f"✅ 已刪除貨幣 **{currency_name}** (`{currency_id}`)\n⚠️ 注意：已有的商品和餘額仍然保留此貨幣的記錄",
-        ephemeral=True
-    )
+    await announce_level_ups(level_ups)
 
-# ========== 商店管理指令 ==========
+# ==================== 身份組定時收入 ====================
 
-@bot.tree.command(name="創建商店", description="創建一個新的商店")
-async def create_shop(interaction: discord.Interaction):
+# 檢查是否到了發放時間的間隔（分鐘）
+PASSIVE_INCOME_CHECK_MINUTES = 10
+# 每處理（或入帳）多少位成員的收入讓出一次事件循環
+PASSIVE_INCOME_CHUNK_SIZE = 1000
+
+# pending 為發放中的週期 {'period', 'interval_hours', 'buckets', 'done'}，全部分組入帳後清除
+DEFAULT_PASSIVE_INCOME = {'enabled': False, 'interval_hours': 24, 'last_period': None, 'pending': None}
+
+def get_passive_income_settings(guild_data: dict) -> dict:
+    """伺服器的定時收入設置（未設置時使用默認值）"""
+    settings = dict(DEFAULT_PASSIVE_INCOME)
+    settings.update(guild_data.get('passive_income') or {})
+    return settings
+
+def passive_income_period(settings: dict, now: float) -> int:
+    """當前所在的發放週期編號"""
+    return int(now // (settings['interval_hours'] * 3600))
+
+async def collect_passive_income(guild: discord.Guild, income_roles: dict) -> list:
+    """遍歷一次伺服器成員，按身份組加成計算每位成員的收入
+    
+    返回 [(用戶ID, 貨幣ID, 金額)]，每處理一批成員讓出一次事件循環。
+    """
+    # {role_id: [(貨幣ID, 金額)]}
+    role_bonuses = {}
+    for role_id, role_data in income_roles.items():
+        bonuses = [(curr_id, amount) for curr_id, amount in role_data.get('currencies', {}).items() if amount > 0]
+        if bonuses and guild.get_role(int(role_id)) is not None:
+            role_bonuses[int(role_id)] = bonuses
+    if not role_bonuses:
+        return []
+    
+    changes = []
+    members = list(guild.members)
+    for start in range(0, len(members), PASSIVE_INCOME_CHUNK_SIZE):
+        for member in members[start:start + PASSIVE_INCOME_CHUNK_SIZE]:
+            if member.bot:
+                continue
+            totals = {}
+            for role_id, bonuses in role_bonuses.items():
+                if member.get_role(role_id) is None:
+                    continue
+                for curr_id, amount in bonuses:
+                    totals[curr_id] = totals.get(curr_id, 0) + amount
+            user_id = str(member.id)
+            changes.extend((user_id, curr_id, amount) for curr_id, amount in totals.items())
+        await asyncio.sleep(0)
+    return changes
+
+def update_passive_income_settings(guild_id: str, **updates):
+    """重新讀取伺服器設置後修改定時收入設置並保存（不覆蓋發放期間其他指令的修改）"""
+    guilds = get_guilds()
+    if guild_id not in guilds:
+        return
+    settings = get_passive_income_settings(guilds[guild_id])
+    settings.update(updates)
+    guilds[guild_id]['passive_income'] = settings
+    save_guilds(guilds)
+
+@tasks.loop(minutes=PASSIVE_INCOME_CHECK_MINUTES)
+async def pay_passive_income():
+    """定時檢查並發放身份組收入（計入執行中的互動，關閉時等待發放在分組之間停下）"""
+    if shutting_down:
+        return
+    with track_in_flight():
+        await pay_due_passive_income()
+
+async def pay_due_passive_income():
+    """到期的伺服器按身份組發放定時收入
+    
+    成員按 用戶ID % 分組數 分組，每組一筆交易（冪等鍵包含週期和分組）並單獨保存，組與組之間讓出事件循環。
+    分組數在開始發放時保存到 pending，中斷後（例如重新部署）下次繼續同一週期:
+    同一位成員總是落在同一組，已入帳的組會被跳過，因此不會重複發放或漏發已在伺服器中的成員。
+    """
+    now = datetime.now().timestamp()
+    guilds = get_guilds()
+    
+    paid = 0
+    for guild in bot.guilds:
+        guild_id = str(guild.id)
+        if guild_id not in guilds:
+            continue
+        settings = get_passive_income_settings(guilds[guild_id])
+        if not settings['enabled']:
+            continue
+        pending = settings['pending']
+        if pending is None:
+            period = passive_income_period(settings, now)
+            if settings['last_period'] is not None and period <= settings['last_period']:
+                continue
+        
+        currencies = guilds[guild_id]['currencies']
+        changes = await collect_passive_income(guild, guilds[guild_id].get('income_roles', {}))
+        changes = [change for change in changes if change[1] in currencies]
+        
+        if pending is None:
+            recipients = len({user_id for user_id, _, _ in changes})
+            pending = {
+                'period': period,
+                'interval_hours': settings['interval_hours'],
+                'buckets': max(1, -(-recipients // PASSIVE_INCOME_CHUNK_SIZE)),
+                'done': []
+            }
+            update_passive_income_settings(guild_id, pending=pending)
+        
+        buckets = {}
+        for change in changes:
+            buckets.setdefault(int(change[0]) % pending['buckets'], []).append(change)
+        for bucket in sorted(buckets):
+            if shutting_down:
+                # 已完成的分組已保存，下次啟動時繼續這個週期
+                return
+            if bucket in pending['done']:
+                continue
+            users = get_users()
+            try:
+                post_transaction(
+                    users, guild_id, 'passive_income', buckets[bucket],
+                    key=f"passive_income:{pending['interval_hours']}:{pending['period']}:{bucket}/{pending['buckets']}",
+                    memo="身份組定時收入"
+                )
+            except ledger.DuplicateTransaction:
+                pass
+            save_users(users)
+            pending['done'].append(bucket)
+            update_passive_income_settings(guild_id, pending=pending)
+            await asyncio.sleep(0)
+        
+        update_passive_income_settings(guild_id, last_period=pending['period'], pending=None)
+        paid += 1
+    
+    if paid:
+        print(f'💎 已發放 {paid} 個伺服器的身份組定時收入')
+
+@pay_passive_income.before_loop
+async def before_pay_passive_income():
+    await bot.wait_until_ready()
+
+# ==================== 刪除清理 ====================
+
+# 背景清理的檢查間隔（秒）
+TOMBSTONE_SWEEP_INTERVAL = 60
+# 每掃描多少筆記錄讓出一次事件循環
+TOMBSTONE_SWEEP_CHUNK_SIZE = 1000
+
+def shop_tombstone_key(shop_key: str, shop_id: str) -> str:
+    return f"{shop_key}/{shop_id}"
+
+def add_tombstone(guild_data: dict, kind: str, key: str):
+    """記錄已刪除的貨幣或商店（kind 為 'currencies' 或 'shops'，調用者負責保存）"""
+    tombstones = guild_data.setdefault('tombstones', {})
+    tombstones.setdefault(kind, {})[key] = datetime.now().timestamp()
+
+def is_tombstoned(guild_data: dict, kind: str, key: str) -> bool:
+    return key in guild_data.get('tombstones', {}).get(kind, {})
+
+def remove_currency_settings(guild_data: dict, currency_id: str):
+    """刪除伺服器設置中對貨幣的引用（身份組收入、語音收入、匯率和兌換池）"""
+    for role_data in guild_data.get('income_roles', {}).values():
+        role_data.get('currencies', {}).pop(currency_id, None)
+    
+    voice_income = guild_data.get('voice_income')
+    if voice_income and voice_income.get('currency_id') == currency_id:
+        voice_income['currency_id'] = None
+        voice_income['amount_per_minute'] = 0
+    
+    config = guild_data.get('exchange')
+    if config:
+        config['rates'] = {
+            key: rate for key, rate in config.get('rates', {}).items()
+            if currency_id not in key.split('>')
+        }
+        config['pools'] = {
+            pool: pool_config for pool, pool_config in config.get('pools', {}).items()
+            if currency_id not in pool.split('|')
+        }
+        # 版本變更後匯率矩陣快取自動失效
+        config['version'] = config.get('version', 0) + 1
+
+async def scan_in_chunks(store: datastore.ShardedStore, guild_ids, match) -> list:
+    """分批掃描伺服器的記錄，返回 match(鍵, 值) 為真的鍵（每批之間讓出事件循環）
+    
+    直接讀取快取中的分片（只讀，不複製記錄）；保存時分片整個替換，掃描期間的變更不影響本次掃描。
+    """
+    matched = []
+    for guild_id in guild_ids:
+        shard = store.shard(guild_id)
+        keys = list(shard)
+        for start in range(0, len(keys), TOMBSTONE_SWEEP_CHUNK_SIZE):
+            for key in keys[start:start + TOMBSTONE_SWEEP_CHUNK_SIZE]:
+                record = shard.get(key)
+                if record is not None and match(key, record):
+                    matched.append(key)
+            await asyncio.sleep(0)
+    return matched
+
+def references_deleted_shop(entry: dict, shop_tombstones: dict) -> bool:
+    shop_key = entry.get('shop_key')
+    return shop_key is not None and shop_tombstone_key(shop_key, entry.get('shop_id')) in shop_tombstones
+
+@tasks.loop(seconds=TOMBSTONE_SWEEP_INTERVAL)
+async def sweep_tombstones():
+    """清理已刪除的貨幣和商店留下的數據
+    
+    先分批掃描找出受影響的記錄（期間讓出事件循環），
+    再重新載入數據一次性修改和保存，最後移除已處理的墓碑。
+    """
+    guilds = get_guilds()
+    # {guild_id: (貨幣墓碑, 商店墓碑)}
+    pending = {}
+    for guild_id, guild_data in guilds.items():
+        tombstones = guild_data.get('tombstones', {})
+        if tombstones.get('currencies') or tombstones.get('shops'):
+            pending[guild_id] = (dict(tombstones.get('currencies', {})), dict(tombstones.get('shops', {})))
+    if not pending:
+        return
+    
+    def user_affected(user_key, user):
+        deleted_currencies, deleted_shops = pending.get(user.get('guild_id'), ({}, {}))
+        if any(currency_id in deleted_currencies for currency_id in user.get('balances', {})):
+            return True
+        return bool(deleted_shops) and any(
+            references_deleted_shop(entry, deleted_shops) for entry in user.get('inventory', {}).values()
+        )
+    
+    def character_affected(char_id, char):
+        deleted_shops = pending.get(char.get('guild_id'), ({}, {}))[1]
+        return bool(deleted_shops) and any(
+            references_deleted_shop(entry, deleted_shops) for entry in (char.get('equipment') or {}).values()
+        )
+    
+    def shop_affected(shop_key, owner_shops):
+        deleted_currencies = pending.get(shop_key.split('_', 1)[0], ({}, {}))[0]
+        return bool(deleted_currencies) and any(
+            item.get('currency_id') in deleted_currencies
+            for shop in owner_shops.values() for item in shop.get('items', {}).values()
+        )
+    
+    user_keys = await scan_in_chunks(user_store, pending, user_affected)
+    char_ids = await scan_in_chunks(character_store, pending, character_affected)
+    shop_keys = await scan_in_chunks(shop_store, pending, shop_affected)
+    
+    # 一次性修改（重新載入，掃描期間的變更不會被覆蓋）
+    if user_keys:
+        users = get_users()
+        # {guild_id: [(用戶ID, 貨幣ID, -餘額)]}
+        removals = {}
+        for user_key in user_keys:
+            user = users.get(user_key)
+            if user is None:
+                continue
+            deleted_currencies, deleted_shops = pending.get(user['guild_id'], ({}, {}))
+            for currency_id in [c for c in user['balances'] if c in deleted_currencies]:
+                if user['balances'][currency_id]:
+                    removals.setdefault(user['guild_id'], []).append((user['user_id'], currency_id, -user['balances'][currency_id]))
+            for entry in user.get('inventory', {}).values():
+                if references_deleted_shop(entry, deleted_shops):
+                    entry['shop_key'] = None
+                    entry['shop_id'] = None
+        for guild_id, changes in removals.items():
+            post_transaction(users, guild_id, 'currency_removed', changes, memo="貨幣已刪除")
+        for user_key in user_keys:
+            user = users.get(user_key)
+            if user is None:
+                continue
+            deleted_currencies = pending.get(user['guild_id'], ({}, {}))[0]
+            for currency_id in [c for c in user['balances'] if c in deleted_currencies]:
+                del user['balances'][currency_id]
+        save_users(users)
+    
+    if char_ids:
+        characters = get_characters()
+        for char_id in char_ids:
+            char = characters.get(char_id)
+            if char is None:
+                continue
+            deleted_shops = pending.get(char['guild_id'], ({}, {}))[1]
+            for entry in (char.get('equipment') or {}).values():
+                if references_deleted_shop(entry, deleted_shops):
+                    entry['shop_key'] = None
+                    entry['shop_id'] = None
+        save_characters(characters)
+    
+    if shop_keys:
+        shops = get_shops()
+        for shop_key in shop_keys:
+            deleted_currencies = pending.get(shop_key.split('_', 1)[0], ({}, {}))[0]
+            for shop in shops.get(shop_key, {}).values():
+                shop['items'] = {
+                    item_id: item for item_id, item in shop.get('items', {}).items()
+                    if item.get('currency_id') not in deleted_currencies
+                }
+        save_shops(shops)
+    
+    # 只移除這次處理過的墓碑（清理期間新增的墓碑留到下次）
+    guilds = get_guilds()
+    for guild_id, (deleted_currencies, deleted_shops) in pending.items():
+        tombstones = guilds.get(guild_id, {}).get('tombstones')
+        if not tombstones:
+            continue
+        for currency_id, deleted_at in deleted_currencies.items():
+            if tombstones.get('currencies', {}).get(currency_id) == deleted_at:
+                del tombstones['currencies'][currency_id]
+        for shop_ref, deleted_at in deleted_shops.items():
+            if tombstones.get('shops', {}).get(shop_ref) == deleted_at:
+                del tombstones['shops'][shop_ref]
+    save_guilds(guilds)
+    print(f'🧹 已清理 {len(pending)} 個伺服器的已刪除貨幣和商店數據')
+
+@sweep_tombstones.before_loop
+async def before_sweep_tombstones():
+    await bot.wait_until_ready()
+
+# ==================== 離開伺服器的數據歸檔 ====================
+
+# 離開伺服器後保留數據的天數（期間重新加入不受影響）
+GUILD_ARCHIVE_GRACE_DAYS = 7
+# 檢查需要歸檔的伺服器的間隔（小時）
+GUILD_ARCHIVE_CHECK_HOURS = 1
+
+# 本次運行中已確認沒有歸檔文件的伺服器（歸檔時移除）
+unarchived_guilds = set()
+
+def guild_archive_path(guild_id: str) -> str:
+    return f"{ARCHIVE_DIR}/{guild_id}.json.gz"
+
+def guild_ledger_archive_base(guild_id: str) -> str:
+    """帳本目錄壓縮檔的路徑（不含 .tar.gz）"""
+    return f"{ARCHIVE_DIR}/{guild_id}-ledger"
+
+def drop_guild_caches(guild_id: str):
+    """移除伺服器在記憶體中的索引和快取"""
+    exp_leaderboards.pop(guild_id, None)
+    streak_leaderboards.pop(guild_id, None)
+    invalidate_admin_cache(guild_id)
+    message_exp_enabled_cache.pop(guild_id, None)
+    exchange.invalidate(guild_id)
+    bootstrapped_ledgers.discard(guild_id)
+
+def archive_guilds(guild_ids: list) -> int:
+    """把伺服器的數據移到壓縮歸檔文件（只載入這些伺服器的分片），返回歸檔的伺服器數量
+    
+    先寫入歸檔文件再從數據文件移除，中途失敗不會丟失數據。
+    """
+    if not guild_ids:
+        return 0
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    guilds = get_guilds()
+    datasets = {
+        'users': get_users(),
+        'shops': get_shops(),
+        'characters': get_characters(),
+        'checkins': get_checkins()
+    }
+    
+    for guild_id in guild_ids:
+        archive = {
+            'guild_id': guild_id,
+            'archived_at': datetime.now().timestamp(),
+            'guild': guilds.get(guild_id)
+        }
+        for name, records in datasets.items():
+            archive[name] = dict(records.guild(guild_id))
+        
+        tmp_path = guild_archive_path(guild_id) + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(archive, f, ensure_ascii=False)
+        os.replace(tmp_path, guild_archive_path(guild_id))
+        
+        # 帳本目錄整個壓縮
+        ledger_book.unload(guild_id)
+        ledger_dir = os.path.join(LEDGER_DIR, guild_id)
+        if os.path.isdir(ledger_dir):
+            shutil.make_archive(guild_ledger_archive_base(guild_id), 'gztar', root_dir=LEDGER_DIR, base_dir=guild_id)
+            shutil.rmtree(ledger_dir)
+        
+        for records in datasets.values():
+            records.guild(guild_id).clear()
+        guilds.pop(guild_id, None)
+        drop_guild_caches(guild_id)
+        unarchived_guilds.discard(guild_id)
+    
+    save_users(datasets['users'])
+    save_shops(datasets['shops'])
+    save_characters(datasets['characters'])
+    save_checkins(datasets['checkins'])
+    save_guilds(guilds)
+    return len(guild_ids)
+
+def is_blank_user_record(record: dict) -> bool:
+    """剛由 init_user 建立、還沒有任何數據的用戶記錄"""
+    return not record.get('balances') and not record.get('inventory') and record.get('character') is None
+
+def restore_archived_guild(guild_id: str) -> bool:
+    """伺服器有歸檔時恢復（每個伺服器在本次運行中只檢查一次歸檔文件）"""
+    if guild_id in unarchived_guilds:
+        return False
+    restored = restore_guild(guild_id)
+    unarchived_guilds.add(guild_id)
+    return restored
+
+def restore_guild(guild_id: str) -> bool:
+    """從歸檔文件恢復伺服器數據（沒有歸檔時返回 False）
+    
+    補回數據文件中不存在的記錄，並替換歸檔後才建立的空用戶記錄；
+    歸檔後新產生的其他記錄不會被覆蓋。
+    """
+    archive_path = guild_archive_path(guild_id)
+    if not os.path.exists(archive_path):
+        return False
+    with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+        archive = json.load(f)
+    
+    ledger_archive = guild_ledger_archive_base(guild_id) + ".tar.gz"
+    if os.path.exists(ledger_archive):
+        ledger_book.unload(guild_id)
+        ledger_dir = os.path.join(LEDGER_DIR, guild_id)
+        # 歸檔後只建立過空帳本時直接替換，已有交易時保留現有帳本
+        if not any(os.path.exists(os.path.join(ledger_dir, name)) for name in ('accounts.json', 'journal-000000.jsonl')):
+            shutil.rmtree(ledger_dir, ignore_errors=True)
+            shutil.unpack_archive(ledger_archive, LEDGER_DIR)
+            os.remove(ledger_archive)
+        else:
+            # 改名保留歸檔的交易日誌，避免下次歸檔時被覆蓋
+            kept_archive = f"{guild_ledger_archive_base(guild_id)}-kept-{int(datetime.now().timestamp())}.tar.gz"
+            os.replace(ledger_archive, kept_archive)
+            print(f'⚠️ 伺服器 {guild_id} 已有新的帳本，歸檔的帳本保留在 {kept_archive}')
+    
+    for name, get_data, save_data in (
+        ('users', get_users, save_users),
+        ('shops', get_shops, save_shops),
+        ('characters', get_characters, save_characters),
+        ('checkins', get_checkins, save_checkins)
+    ):
+        records = archive.get(name) or {}
+        if not records:
+            continue
+        data = get_data()
+        shard = data.guild(guild_id)
+        for key, record in records.items():
+            if key not in shard or (name == 'users' and is_blank_user_record(shard[key])):
+                shard[key] = record
+        save_data(data)
+    
+    guilds = get_guilds()
+    if archive.get('guild') is not None:
+        guild_data = guilds.setdefault(guild_id, archive['guild'])
+        guild_data.pop('left_at', None)
+    save_guilds(guilds)
+    os.remove(archive_path)
+    
+    # 排行榜索引在下次使用時從恢復的分片重建
+    drop_guild_caches(guild_id)
+    print(f'📦 已從歸檔恢復伺服器 {guild_id} 的數據')
+    return True
+
+@tasks.loop(hours=GUILD_ARCHIVE_CHECK_HOURS)
+async def archive_departed_guilds():
+    """歸檔離開超過寬限期的伺服器
+    
+    也會補記機器人離線期間離開的伺服器，並清除離線期間重新加入的伺服器的離開標記。
+    """
+    guilds = get_guilds()
+    now = datetime.now().timestamp()
+    changed = False
+    due = []
+    for guild_id, guild_data in guilds.items():
+        present = bot.get_guild(int(guild_id)) is not None
+        left_at = guild_data.get('left_at')
+        if present:
+            if left_at is not None:
+                del guild_data['left_at']
+                changed = True
+        elif left_at is None:
+            guild_data['left_at'] = now
+            changed = True
+        elif now - left_at >= GUILD_ARCHIVE_GRACE_DAYS * 86400:
+            due.append(guild_id)
+    if changed:
+        save_guilds(guilds)
+    
+    archived = archive_guilds(due)
+    if archived:
+        print(f'📦 已歸檔 {archived} 個已離開的伺服器的數據')
+
+@archive_departed_guilds.before_loop
+async def before_archive_departed_guilds():
+    await bot.wait_until_ready()
+
+# ==================== 斜線指令 ====================
+
+# ========== 貨幣管理指令 ==========
+
+@bot.tree.command(name="創建貨幣", description="創建一種新的貨幣（管理員）")
+async def create_currency(interaction: discord.Interaction):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    await interaction.response.send_modal(CreateCurrencyModal())
+
+@bot.tree.command(name="貨幣列表", description="查看伺服器的所有貨幣")
+async def list_currencies(interaction: discord.Interaction):
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
+    init_guild(guild_id)
+    
+    if not guilds[guild_id]['currencies']:
+        await interaction.response.send_message(
+            "❌ 伺服器還沒有創建任何貨幣！\n管理員可以使用 `/創建貨幣` 來創建。",
+            ephemeral=True
+        )
+        return
+    
+    embed = discord.Embed(
+        title="💎 貨幣列表",
+        description=f"{interaction.guild.name} 的所有貨幣",
+        color=discord.Color.gold()
+    )
+    
+    for curr_id, curr_data in guilds[guild_id]['currencies'].items():
+        embed.add_field(
+            name=f"{curr_data['emoji']} {curr_data['name']} (`{curr_id}`)",
+            value=curr_data.get('description', '沒有描述'),
+            inline=False
+        )
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="刪除貨幣", description="刪除一種貨幣（管理員，謹慎使用！）")
+@app_commands.describe(貨幣id="要刪除的貨幣ID")
+async def delete_currency(interaction: discord.Interaction, 貨幣id: str):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
+    init_guild(guild_id)
+    
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    currency_name = guilds[guild_id]['currencies'][currency_id]['name']
+    del guilds[guild_id]['currencies'][currency_id]
+    
+    # 同時刪除簽到設置
+    if currency_id in guilds[guild_id].get('checkin_settings', {}):
+        del guilds[guild_id]['checkin_settings'][currency_id]
+    
+    remove_currency_settings(guilds[guild_id], currency_id)
+    
+    # 玩家餘額和商品由背景清理
+    add_tombstone(guilds[guild_id], 'currencies', currency_id)
+    save_guilds(guilds)
+    
+    await interaction.response.send_message(
+        f"✅ 已刪除貨幣 **{currency_name}** (`{currency_id}`)\n🧹 玩家的餘額和使用此貨幣的商品會在背景中清理",
+        ephemeral=True
+    )
+
+# ========== 商店管理指令 ==========
+
+@bot.tree.command(name="創建商店", description="創建一個新的商店")
+async def create_shop(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
     guilds = get_guilds()
     init_guild(guild_id)
@@ -1643,7 +2870,9 @@ async def list_items(interaction: discord.Interaction, 商店id: str):
     )
     
     for item_id, item in shop['items'].items():
-        currency_data = guilds[guild_id]['currencies'][item['currency_id']]
+        currency_data = guilds[guild_id]['currencies'].get(item['currency_id'])
+        if currency_data is None:
+            continue
         price_display = "非賣品" if item['price'] == 0 else f"{item['price']} {currency_data['emoji']}"
         stock = item.get('stock', -1)
         stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
@@ -1691,7 +2920,9 @@ async def view_shop(interaction: discord.Interaction, 用戶: discord.User, 商
     guilds = get_guilds()
     if shop['items']:
         for item_id, item in list(shop['items'].items())[:5]:
-            currency_data = guilds[guild_id]['currencies'][item['currency_id']]
+            currency_data = guilds[guild_id]['currencies'].get(item['currency_id'])
+            if currency_data is None:
+                continue
             price_str = "非賣品" if item['price'] == 0 else f"{item['price']} {currency_data['emoji']} {currency_data['name']}"
             
             stock = item.get('stock', -1)
@@ -1708,7 +2939,7 @@ async def view_shop(interaction: discord.Interaction, 用戶: discord.User, 商
                 inline=False
             )
     
-    view = ShopView(shop_key, shop_id, guild_id)
+    view = ShopView(str(用戶.id), shop_id)
     await interaction.response.send_message(embed=embed, view=view)
 
 @bot.tree.command(name="刪除商店", description="刪除你的商店")
@@ -1733,6 +2964,12 @@ async def delete_shop(interaction: discord.Interaction, 商店id: str):
     
     save_shops(shops)
     
+    # 背包和裝備中對此商店的引用由背景清理
+    init_guild(guild_id)
+    guilds = get_guilds()
+    add_tombstone(guilds[guild_id], 'shops', shop_tombstone_key(shop_key, shop_id))
+    save_guilds(guilds)
+    
     await interaction.response.send_message(
         f"✅ 已刪除商店 **{shop_name}** (`{shop_id}`)",
         ephemeral=True
@@ -1842,7 +3079,7 @@ async def inventory(interaction: discord.Interaction):
     else:
         embed.add_field(name="背包", value="空空如也...", inline=False)
     
-    view = InventoryView(user_key, guild_id)
+    view = InventoryView(user_id)
     await interaction.response.send_message(embed=embed, view=view)
 
 @bot.tree.command(name="創建角色", description="創建你的RPG角色")
@@ -1875,18 +3112,18 @@ async def character_sheet(interaction: discord.Interaction, 用戶: Optional[dis
     characters = get_characters()
     char_id = users[user_key]['character']
     char = characters[char_id]
+    guilds = get_guilds()
     
-    # 計算等級
-    current_level = calculate_level_from_exp(char['exp'])
-    exp_for_current = calculate_exp_for_level(current_level)
-    exp_for_next = calculate_exp_for_level(current_level + 1)
-    exp_progress = char['exp'] - exp_for_current
-    exp_needed = exp_for_next - exp_for_current
-    
-    # 更新等級（如果有變化）
-    if current_level != char['level']:
-        char['level'] = current_level
+    # 衍生屬性只在裝備目錄變更後第一次讀取時重新計算
+    if ensure_character_stats(char, guild_id, guilds):
         save_characters(characters)
+    stats = equipment.stats_of(char)
+    
+    # 計算等級（等級在經驗值或曲線變更時已批量更新，這裡只讀取）
+    progress = get_level_table(guild_id, guilds).progress(char['exp'])
+    current_level = progress['level']
+    exp_progress = progress['progress']
+    exp_needed = progress['needed']
     
     embed = discord.Embed(
         title=f"⚔️ {char['name']}",
@@ -1894,25 +3131,43 @@ async def character_sheet(interaction: discord.Interaction, 用戶: Optional[dis
         color=discord.Color.purple()
     )
     
-    hp_percent = char['hp'] / char['max_hp']
+    # HP/MP 按時間推算自然恢復（只讀取，不寫入）
+    current_hp, current_mp = regen.current_vitals(char)
+    hp_minutes, mp_minutes = regen.minutes_until_full(char)
+    
+    hp_percent = current_hp / stats['max_hp']
     hp_bar = "█" * int(hp_percent * 10) + "░" * (10 - int(hp_percent * 10))
+    hp_text = f"{hp_bar} {current_hp}/{stats['max_hp']}"
+    if hp_minutes > 0:
+        hp_text += f"\n⏳ 約 {int(hp_minutes) + 1} 分鐘後完全恢復"
     embed.add_field(
         name=f"❤️ HP",
-        value=f"{hp_bar} {char['hp']}/{char['max_hp']}",
+        value=hp_text,
         inline=False
     )
     
-    mp_percent = char['mp'] / char['max_mp']
+    mp_percent = current_mp / stats['max_mp']
     mp_bar = "█" * int(mp_percent * 10) + "░" * (10 - int(mp_percent * 10))
+    mp_text = f"{mp_bar} {current_mp}/{stats['max_mp']}"
+    if mp_minutes > 0:
+        mp_text += f"\n⏳ 約 {int(mp_minutes) + 1} 分鐘後完全恢復"
     embed.add_field(
         name=f"💙 MP",
-        value=f"{mp_bar} {char['mp']}/{char['max_mp']}",
+        value=mp_text,
         inline=False
     )
     
-    embed.add_field(name="⚔️ 攻擊力", value=char['attack'], inline=True)
-    embed.add_field(name="🛡️ 防禦力", value=char['defense'], inline=True)
-    embed.add_field(name="⭐ 等級", value=char['level'], inline=True)
+    embed.add_field(name="⚔️ 攻擊力", value=format_stat_with_bonus(stats['attack'], char['attack']), inline=True)
+    embed.add_field(name="🛡️ 防禦力", value=format_stat_with_bonus(stats['defense'], char['defense']), inline=True)
+    embed.add_field(name="⭐ 等級", value=current_level, inline=True)
+    
+    if char.get('equipment'):
+        equipment_text = []
+        for slot, slot_name in equipment.SLOTS.items():
+            entry = char['equipment'].get(slot)
+            if entry:
+                equipment_text.append(f"{slot_name}: **{entry['name']}** ({equipment.format_stats(entry.get('stats', {}))})")
+        embed.add_field(name="🎽 裝備", value="\n".join(equipment_text), inline=False)
     
     # 經驗值進度條
     exp_percent = exp_progress / exp_needed if exp_needed > 0 else 1
@@ -1934,13 +3189,20 @@ async def character_sheet(interaction: discord.Interaction, 用戶: Optional[dis
 @bot.tree.command(name="等級經驗表", description="查看等級與經驗值對照表")
 @app_commands.describe(起始等級="起始等級（默認1）", 結束等級="結束等級（默認20）")
 async def exp_table(interaction: discord.Interaction, 起始等級: int = 1, 結束等級: int = 20):
-    if 起始等級 < 1 or 結束等級 < 起始等級 or 結束等級 > 100:
+    guild_id = str(interaction.guild.id)
+    table = get_level_table(guild_id)
+    
+    if 起始等級 < 1 or 結束等級 < 起始等級 or 結束等級 > table.max_level:
         await interaction.response.send_message(
-            "❌ 等級範圍無效！起始等級必須≥1，結束等級必須≤100，且結束等級≥起始等級",
+            f"❌ 等級範圍無效！起始等級必須≥1，結束等級必須≤{table.max_level}，且結束等級≥起始等級",
             ephemeral=True
         )
         return
     
+    if 結束等級 - 起始等級 >= 50:
+        await interaction.response.send_message("❌ 一次最多只能查看50個等級！", ephemeral=True)
+        return
+    
     embed = discord.Embed(
         title="📊 等級經驗值對照表",
         description=f"Lv.{起始等級} ~ Lv.{結束等級}",
@@ -1949,9 +3211,9 @@ async def exp_table(interaction: discord.Interaction, 起始等級: int = 1, 結
     
     table_text = []
     for level in range(起始等級, 結束等級 + 1):
-        total_exp = calculate_exp_for_level(level)
+        total_exp = table.exp_for_level(level)
         if level > 起始等級:
-            exp_from_prev = total_exp - calculate_exp_for_level(level - 1)
+            exp_from_prev = total_exp - table.exp_for_level(level - 1)
             table_text.append(f"**Lv.{level}** - 總計: {total_exp} EXP (需 +{exp_from_prev})")
         else:
             table_text.append(f"**Lv.{level}** - 總計: {total_exp} EXP")
@@ -1967,10 +3229,109 @@ async def exp_table(interaction: discord.Interaction, 起始等級: int = 1, 結
             inline=False
         )
     
-    embed.set_footer(text="💡 經驗值計算公式: 100 × level^1.5")
+    embed.set_footer(text=f"💡 經驗值計算公式: {table.describe()}")
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="設置等級曲線", description="設置伺服器的等級經驗曲線（管理員）")
+@app_commands.describe(
+    類型="曲線類型",
+    基數="多項式/指數曲線的基數（默認100）",
+    參數="多項式的指數（默認1.5）或指數曲線的成長率（默認1.1）",
+    等級表="自訂表格：每個等級所需總經驗值的文字檔（逗號或換行分隔，從Lv.1開始）"
+)
+@app_commands.choices(類型=[
+    app_commands.Choice(name="默認 (100 × level^1.5)", value="default"),
+    app_commands.Choice(name="多項式 (基數 × level^指數)", value="polynomial"),
+    app_commands.Choice(name="指數 (基數 × 成長率^(level-1))", value="exponential"),
+    app_commands.Choice(name="自訂表格（上傳文字檔）", value="table")
+])
+async def set_level_curve(
+    interaction: discord.Interaction,
+    類型: app_commands.Choice[str],
+    基數: Optional[float] = None,
+    參數: Optional[float] = None,
+    等級表: Optional[discord.Attachment] = None
+):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    curve_type = 類型.value
+    
+    if curve_type == "default":
+        curve_config = None
+    elif curve_type == "polynomial":
+        curve_config = {
+            'type': 'polynomial',
+            'base': 基數 if 基數 is not None else leveling.DEFAULT_BASE,
+            'exponent': 參數 if 參數 is not None else leveling.DEFAULT_EXPONENT
+        }
+    elif curve_type == "exponential":
+        curve_config = {
+            'type': 'exponential',
+            'base': 基數 if 基數 is not None else leveling.DEFAULT_BASE,
+            'growth': 參數 if 參數 is not None else 1.1
+        }
+    else:
+        if 等級表 is None:
+            await interaction.response.send_message("❌ 自訂表格需要上傳等級表文字檔！", ephemeral=True)
+            return
+        if 等級表.size > 256 * 1024:
+            await interaction.response.send_message("❌ 等級表文字檔不能超過256KB！", ephemeral=True)
+            return
+        try:
+            text = (await 等級表.read()).decode('utf-8')
+            curve_config = {'type': 'table', 'thresholds': leveling.parse_thresholds(text)}
+        except (UnicodeDecodeError, ValueError) as e:
+            await interaction.response.send_message(f"❌ 無法讀取等級表: {e}", ephemeral=True)
+            return
+    
+    # 驗證曲線參數（Lv.2 就超過經驗值上限的曲線無法使用）
+    try:
+        leveling.validate_config(curve_config)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ 曲線參數無效: {e}", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    init_guild(guild_id)
+    guilds = get_guilds()
+    
+    old_config = guilds[guild_id].get('leveling_curve') or {}
+    if curve_config is None:
+        guilds[guild_id].pop('leveling_curve', None)
+    else:
+        curve_config['version'] = old_config.get('version', 0) + 1
+        guilds[guild_id]['leveling_curve'] = curve_config
+    save_guilds(guilds)
+    
+    leveling.invalidate(guild_id)
+    table = get_level_table(guild_id, guilds)
+    changed = recalculate_guild_levels(guild_id, table)
+    
+    embed = discord.Embed(
+        title="✅ 等級曲線設置成功",
+        description=f"經驗值計算公式: **{table.describe()}**",
+        color=discord.Color.green()
+    )
+    preview = [f"Lv.{level}: {table.exp_for_level(level)} EXP" for level in range(1, min(table.max_level, 10) + 1)]
+    embed.add_field(name="📊 預覽", value="\n".join(preview), inline=False)
+    if table.capped:
+        embed.add_field(
+            name="⚠️ 最高等級",
+            value=f"Lv.{table.max_level + 1} 所需經驗值超過上限，此曲線最高只能升到 **Lv.{table.max_level}**",
+            inline=False
+        )
+    embed.add_field(name="🔄 重新計算", value=f"已更新 **{changed}** 個角色的等級", inline=False)
+    
+    await interaction.followup.send(embed=embed)
+
 @bot.tree.command(name="增加經驗值", description="為角色增加經驗值（管理員）")
 @app_commands.describe(
     用戶="要增加經驗值的玩家",
@@ -2001,16 +3362,17 @@ async def add_exp(interaction: discord.Interaction, 用戶: discord.User, 經驗
     char_id = users[user_key]['character']
     char = characters[char_id]
     
+    table = get_level_table(guild_id)
     old_exp = char['exp']
-    old_level = calculate_level_from_exp(old_exp)
+    old_level = table.level_from_exp(old_exp)
     
     char['exp'] += 經驗值
-    new_level = calculate_level_from_exp(char['exp'])
+    new_level = table.level_from_exp(char['exp'])
+    record_exp(char)
     
     level_up = new_level > old_level
     
-    if level_up:
-        char['level'] = new_level
+    char['level'] = new_level
     
     save_characters(characters)
     
@@ -2031,7 +3393,7 @@ async def add_exp(interaction: discord.Interaction, 用戶: discord.User, 經驗
         )
     
     # 顯示下一級所需經驗
-    exp_for_next = calculate_exp_for_level(new_level + 1)
+    exp_for_next = table.exp_for_level(new_level + 1)
     exp_needed = exp_for_next - char['exp']
     embed.add_field(
         name="📊 距離下一級",
@@ -2041,15 +3403,13 @@ async def add_exp(interaction: discord.Interaction, 用戶: discord.User, 經驗
     
     await interaction.response.send_message(embed=embed)
 
-# ========== 經濟系統指令 ==========
-
-@bot.tree.command(name="設置簽到收入", description="設置身份組的簽到收入（管理員）")
+@bot.tree.command(name="設置聊天經驗", description="設置聊天獲得經驗值（管理員）")
 @app_commands.describe(
-    身份組="要設置的身份組",
-    貨幣id="貨幣類型",
-    每日收入="每日簽到時獲得的額外收入"
+    啟用="是否啟用聊天經驗值",
+    最少="每次獲得的最少經驗值（默認15）",
+    最多="每次獲得的最多經驗值（默認25）"
 )
-async def set_income_role(interaction: discord.Interaction, 身份組: discord.Role, 貨幣id: str, 每日收入: int):
+async def set_message_exp(interaction: discord.Interaction, 啟用: bool, 最少: int = 15, 最多: int = 25):
     if not await check_admin_permission(interaction):
         await interaction.response.send_message(
             "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
@@ -2057,45 +3417,498 @@ async def set_income_role(interaction: discord.Interaction, 身份組: discord.R
         )
         return
     
-    guild_id = str(interaction.guild.id)
-    guilds = get_guilds()
-    init_guild(guild_id)
-    
-    currency_id = 貨幣id.lower().strip()
-    
-    if currency_id not in guilds[guild_id]['currencies']:
-        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+    if 最少 < 0 or 最多 < 最少:
+        await interaction.response.send_message("❌ 經驗值範圍無效！最少必須≥0，且最多≥最少", ephemeral=True)
         return
     
-    currency_data = guilds[guild_id]['currencies'][currency_id]
-    role_id = str(身份組.id)
-    
-    if 'income_roles' not in guilds[guild_id]:
-        guilds[guild_id]['income_roles'] = {}
-    
-    if role_id not in guilds[guild_id]['income_roles']:
-        guilds[guild_id]['income_roles'][role_id] = {
-            "name": 身份組.name,
-            "currencies": {}
-        }
-    
-    guilds[guild_id]['income_roles'][role_id]['currencies'][currency_id] = 每日收入
-    guilds[guild_id]['income_roles'][role_id]['name'] = 身份組.name
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
     
+    guilds[guild_id]['message_exp'] = {
+        'enabled': 啟用,
+        'min': 最少,
+        'max': 最多
+    }
     save_guilds(guilds)
+    message_exp_enabled_cache.pop(guild_id, None)
     
     embed = discord.Embed(
-        title="✅ 收入身份組設置成功",
-        description=f"身份組 **{身份組.name}** 的 {currency_data['emoji']} {currency_data['name']} 每日收入已設置為 **{每日收入}**",
-        color=discord.Color.green()
+        title="✅ 聊天經驗值設置成功",
+        description="已啟用聊天經驗值" if 啟用 else "已停用聊天經驗值",
+        color=discord.Color.green() if 啟用 else discord.Color.orange()
     )
+    if 啟用:
+        embed.add_field(name="每次獲得", value=f"{最少} ~ {最多} EXP", inline=True)
+        embed.add_field(name="冷卻時間", value=f"{int(activity.MESSAGE_EXP_COOLDOWN)} 秒", inline=True)
     
     await interaction.response.send_message(embed=embed)
 
-@bot.tree.command(name="收入身份組列表", description="查看所有收入身份組")
-async def list_income_roles(interaction: discord.Interaction):
-    guild_id = str(interaction.guild.id)
-    guilds = get_guilds()
+# ========== 裝備指令 ==========
+
+SLOT_CHOICES = [app_commands.Choice(name=name, value=slot) for slot, name in equipment.SLOTS.items()]
+
+def return_to_inventory(inventory: dict, entry: dict):
+    """把卸下的裝備放回背包"""
+    item_id = entry['item_id']
+    if item_id not in inventory:
+        inventory[item_id] = {
+            "name": entry['name'],
+            "quantity": 0,
+            "shop_id": entry['shop_id'],
+            "shop_key": entry['shop_key'],
+            "item_data": entry['item_data']
+        }
+    inventory[item_id]['quantity'] += 1
+
+@bot.tree.command(name="設置裝備屬性", description="把商品設為裝備並設置屬性加成（商店擁有者）")
+@app_commands.describe(
+    商店id="商店ID",
+    商品id="商品ID",
+    欄位="裝備欄位（選擇「不可裝備」取消裝備設定）",
+    攻擊力="攻擊力加成",
+    防禦力="防禦力加成",
+    生命上限="生命上限加成",
+    魔力上限="魔力上限加成"
+)
+@app_commands.choices(欄位=SLOT_CHOICES + [app_commands.Choice(name="❌ 不可裝備", value="none")])
+async def set_equipment_stats(
+    interaction: discord.Interaction,
+    商店id: str,
+    商品id: str,
+    欄位: app_commands.Choice[str],
+    攻擊力: int = 0,
+    防禦力: int = 0,
+    生命上限: int = 0,
+    魔力上限: int = 0
+):
+    guild_id = str(interaction.guild.id)
+    user_id = str(interaction.user.id)
+    shop_key = f"{guild_id}_{user_id}"
+    shops = get_shops()
+    
+    shop_id = 商店id.lower().strip()
+    item_id = 商品id.lower().strip()
+    
+    if shop_key not in shops or shop_id not in shops[shop_key]:
+        await interaction.response.send_message("❌ 找不到該商店！", ephemeral=True)
+        return
+    
+    if item_id not in shops[shop_key][shop_id]['items']:
+        await interaction.response.send_message("❌ 找不到該商品！", ephemeral=True)
+        return
+    
+    item = shops[shop_key][shop_id]['items'][item_id]
+    if 欄位.value == "none":
+        item['equip_slot'] = None
+        item['stats'] = {}
+    else:
+        item['equip_slot'] = 欄位.value
+        item['stats'] = {'attack': 攻擊力, 'defense': 防禦力, 'max_hp': 生命上限, 'max_mp': 魔力上限}
+    save_shops(shops)
+    
+    # 目錄變更，已穿戴此裝備的角色在下次讀取時重新計算衍生屬性
+    init_guild(guild_id)
+    guilds = get_guilds()
+    bump_catalog_version(guild_id, guilds)
+    save_guilds(guilds)
+    
+    embed = discord.Embed(
+        title="✅ 裝備屬性設置成功",
+        description=f"**{item['name']}** (`{item_id}`)",
+        color=discord.Color.green()
+    )
+    if item['equip_slot']:
+        embed.add_field(name="裝備欄位", value=欄位.name, inline=True)
+        embed.add_field(name="屬性加成", value=equipment.format_stats(item['stats']), inline=True)
+    else:
+        embed.add_field(name="裝備欄位", value="不可裝備", inline=True)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="裝備", description="從背包穿上裝備")
+@app_commands.describe(物品id="背包中的物品ID")
+async def equip_item(interaction: discord.Interaction, 物品id: str):
+    guild_id = str(interaction.guild.id)
+    user_id = str(interaction.user.id)
+    user_key = get_user_key(guild_id, user_id)
+    item_id = 物品id.lower().strip()
+    
+    users = get_users()
+    if user_key not in users or not users[user_key].get('character'):
+        await interaction.response.send_message("❌ 你還沒有創建角色！使用 `/創建角色` 創建。", ephemeral=True)
+        return
+    
+    inventory = users[user_key]['inventory']
+    if item_id not in inventory or inventory[item_id]['quantity'] <= 0:
+        await interaction.response.send_message("❌ 背包中沒有這個物品！", ephemeral=True)
+        return
+    
+    inv_item = inventory[item_id]
+    # 優先使用商品目錄中最新的屬性，商品已下架時使用購買時的記錄
+    shops = get_shops()
+    catalog_item = find_shop_item(shops, inv_item['shop_key'], inv_item['shop_id'], item_id) or inv_item['item_data']
+    slot = catalog_item.get('equip_slot')
+    if slot not in equipment.SLOTS:
+        await interaction.response.send_message(f"❌ **{inv_item['name']}** 不是裝備！", ephemeral=True)
+        return
+    
+    characters = get_characters()
+    char = characters[users[user_key]['character']]
+    guilds = get_guilds()
+    
+    entry = {
+        "item_id": item_id,
+        "name": inv_item['name'],
+        "shop_id": inv_item['shop_id'],
+        "shop_key": inv_item['shop_key'],
+        "stats": equipment.item_stats(catalog_item),
+        "item_data": inv_item['item_data']
+    }
+    
+    inv_item['quantity'] -= 1
+    if inv_item['quantity'] <= 0:
+        del inventory[item_id]
+    
+    ensure_character_stats(char, guild_id, guilds)
+    previous = equipment.equip(char, slot, entry, get_catalog_version(guild_id, guilds))
+    if previous is not None:
+        return_to_inventory(inventory, previous)
+    
+    save_characters(characters)
+    save_users(users)
+    
+    stats = equipment.stats_of(char)
+    embed = discord.Embed(
+        title="✅ 裝備成功",
+        description=f"{equipment.SLOTS[slot]}: **{entry['name']}** ({equipment.format_stats(entry['stats'])})",
+        color=discord.Color.green()
+    )
+    if previous is not None:
+        embed.add_field(name="替換下來", value=f"**{previous['name']}** 已放回背包", inline=False)
+    embed.add_field(name="⚔️ 攻擊力", value=format_stat_with_bonus(stats['attack'], char['attack']), inline=True)
+    embed.add_field(name="🛡️ 防禦力", value=format_stat_with_bonus(stats['defense'], char['defense']), inline=True)
+    embed.add_field(name="❤️ 生命上限", value=format_stat_with_bonus(stats['max_hp'], char['max_hp']), inline=True)
+    embed.add_field(name="💙 魔力上限", value=format_stat_with_bonus(stats['max_mp'], char['max_mp']), inline=True)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="卸下", description="卸下裝備並放回背包")
+@app_commands.describe(欄位="要卸下的裝備欄位")
+@app_commands.choices(欄位=SLOT_CHOICES)
+async def unequip_item(interaction: discord.Interaction, 欄位: app_commands.Choice[str]):
+    guild_id = str(interaction.guild.id)
+    user_id = str(interaction.user.id)
+    user_key = get_user_key(guild_id, user_id)
+    
+    users = get_users()
+    if user_key not in users or not users[user_key].get('character'):
+        await interaction.response.send_message("❌ 你還沒有創建角色！使用 `/創建角色` 創建。", ephemeral=True)
+        return
+    
+    characters = get_characters()
+    char = characters[users[user_key]['character']]
+    guilds = get_guilds()
+    
+    previous = equipment.unequip(char, 欄位.value, get_catalog_version(guild_id, guilds))
+    if previous is None:
+        await interaction.response.send_message(f"❌ {欄位.name}欄位沒有裝備！", ephemeral=True)
+        return
+    
+    ensure_character_stats(char, guild_id, guilds)
+    return_to_inventory(users[user_key]['inventory'], previous)
+    save_characters(characters)
+    save_users(users)
+    
+    await interaction.response.send_message(
+        f"✅ 已卸下 {欄位.name} **{previous['name']}**，已放回背包",
+        ephemeral=True
+    )
+
+# ========== 戰鬥指令 ==========
+
+MONSTER_CHOICES = [
+    app_commands.Choice(name=f"{monster['emoji']} {monster['name']}", value=monster_id)
+    for monster_id, monster in combat.MONSTERS.items()
+]
+
+def build_battle_embed(title: str, result: dict, a: combat.Combatant, b: combat.Combatant) -> discord.Embed:
+    """戰鬥結果Embed"""
+    if result['winner'] == 'a':
+        description = f"🏆 **{a.name}** 獲勝！"
+        color = discord.Color.green()
+    elif result['winner'] == 'b':
+        description = f"💀 **{b.name}** 獲勝！"
+        color = discord.Color.red()
+    else:
+        description = f"⏱️ {result['rounds']} 回合內未分勝負，平手！"
+        color = discord.Color.light_grey()
+    
+    embed = discord.Embed(title=title, description=description, color=color)
+    embed.add_field(name=a.name, value=f"❤️ {result['a_hp']}/{a.max_hp}", inline=True)
+    embed.add_field(name=b.name, value=f"❤️ {result['b_hp']}/{b.max_hp}", inline=True)
+    embed.add_field(name="回合數", value=result['rounds'], inline=True)
+    
+    log_lines = result['log'][-10:]
+    if log_lines:
+        embed.add_field(name="📜 戰鬥記錄", value="\n".join(log_lines)[:1024], inline=False)
+    return embed
+
+@bot.tree.command(name="討伐", description="與怪物戰鬥獲得經驗值")
+@app_commands.describe(怪物="要挑戰的怪物")
+@app_commands.choices(怪物=MONSTER_CHOICES)
+async def hunt(interaction: discord.Interaction, 怪物: app_commands.Choice[str]):
+    guild_id = str(interaction.guild.id)
+    user_id = str(interaction.user.id)
+    user_key = get_user_key(guild_id, user_id)
+    
+    users = get_users()
+    if user_key not in users or not users[user_key].get('character'):
+        await interaction.response.send_message("❌ 你還沒有創建角色！使用 `/創建角色` 創建。", ephemeral=True)
+        return
+    
+    characters = get_characters()
+    char = characters[users[user_key]['character']]
+    monster = combat.MONSTERS[怪物.value]
+    ensure_character_stats(char, guild_id)
+    
+    # 從自然恢復後的當前HP開始戰鬥
+    current_hp, _ = regen.current_vitals(char)
+    if current_hp <= 0:
+        hp_minutes, _ = regen.minutes_until_full(char)
+        await interaction.response.send_message(
+            f"❌ 你的角色需要休息！HP會自然恢復（約 {int(hp_minutes) + 1} 分鐘後完全恢復）",
+            ephemeral=True
+        )
+        return
+    
+    hero = combat.Combatant.from_character(char, hp=current_hp)
+    enemy = combat.Combatant.from_monster(怪物.value)
+    # 以互動ID為種子，結果可重播
+    result = combat.fight(hero, enemy, seed=interaction.id)
+    
+    embed = build_battle_embed(f"⚔️ {char['name']} vs {monster['emoji']} {monster['name']}", result, hero, enemy)
+    
+    # 戰鬥後的HP寫回角色，之後按時間自然恢復
+    regen.set_vitals(char, result['a_hp'])
+    
+    if result['winner'] == 'a':
+        table = get_level_table(guild_id)
+        old_level = table.level_from_exp(char['exp'])
+        char['exp'] += monster['exp']
+        char['level'] = table.level_from_exp(char['exp'])
+        record_exp(char)
+    
+    save_characters(characters)
+    
+    if result['winner'] == 'a':
+        reward_text = f"+{monster['exp']} EXP"
+        if char['level'] > old_level:
+            reward_text += f"\n🎉 升級！**Lv.{old_level}** → **Lv.{char['level']}**"
+        embed.add_field(name="🎁 獎勵", value=reward_text, inline=False)
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="決鬥", description="與其他玩家的角色決鬥（不影響角色數據）")
+@app_commands.describe(對手="要挑戰的玩家")
+async def duel(interaction: discord.Interaction, 對手: discord.User):
+    guild_id = str(interaction.guild.id)
+    
+    if 對手.id == interaction.user.id:
+        await interaction.response.send_message("❌ 不能和自己決鬥！", ephemeral=True)
+        return
+    
+    users = get_users()
+    challenger_key = get_user_key(guild_id, str(interaction.user.id))
+    opponent_key = get_user_key(guild_id, str(對手.id))
+    
+    if challenger_key not in users or not users[challenger_key].get('character'):
+        await interaction.response.send_message("❌ 你還沒有創建角色！使用 `/創建角色` 創建。", ephemeral=True)
+        return
+    if opponent_key not in users or not users[opponent_key].get('character'):
+        await interaction.response.send_message("❌ 對手還沒有創建角色！", ephemeral=True)
+        return
+    
+    characters = get_characters()
+    challenger_char = characters[users[challenger_key]['character']]
+    opponent_char = characters[users[opponent_key]['character']]
+    guilds = get_guilds()
+    stats_changed = ensure_character_stats(challenger_char, guild_id, guilds)
+    stats_changed = ensure_character_stats(opponent_char, guild_id, guilds) or stats_changed
+    if stats_changed:
+        save_characters(characters)
+    # 決鬥使用雙方當前HP，但不寫回角色數據
+    challenger = combat.Combatant.from_character(challenger_char, hp=max(1, regen.current_vitals(challenger_char)[0]))
+    opponent = combat.Combatant.from_character(opponent_char, hp=max(1, regen.current_vitals(opponent_char)[0]))
+    
+    result = combat.fight(challenger, opponent, seed=interaction.id)
+    embed = build_battle_embed(f"🤺 {challenger.name} vs {opponent.name}", result, challenger, opponent)
+    embed.description += f"\n{interaction.user.mention} 向 {對手.mention} 發起決鬥"
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="戰鬥模擬", description="批量模擬角色與怪物的戰鬥，用於平衡數值（管理員）")
+@app_commands.describe(
+    怪物="要模擬的怪物",
+    場數="模擬場數（默認1000，最多50000）",
+    用戶="使用此玩家的角色（不填則使用自己的角色）"
+)
+@app_commands.choices(怪物=MONSTER_CHOICES)
+async def simulate_battles(interaction: discord.Interaction, 怪物: app_commands.Choice[str], 場數: int = 1000, 用戶: Optional[discord.User] = None):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    if 場數 < 1 or 場數 > 50000:
+        await interaction.response.send_message("❌ 場數必須在1到50000之間！", ephemeral=True)
+        return
+    
+    guild_id = str(interaction.guild.id)
+    target_user = 用戶 or interaction.user
+    user_key = get_user_key(guild_id, str(target_user.id))
+    
+    users = get_users()
+    if user_key not in users or not users[user_key].get('character'):
+        await interaction.response.send_message("❌ 該用戶還沒有創建角色！", ephemeral=True)
+        return
+    
+    characters = get_characters()
+    char = characters[users[user_key]['character']]
+    if ensure_character_stats(char, guild_id):
+        save_characters(characters)
+    hero = combat.Combatant.from_character(char)
+    enemy = combat.Combatant.from_monster(怪物.value)
+    
+    start = datetime.now()
+    stats = combat.simulate_batch(hero, enemy, 場數, seed=interaction.id)
+    elapsed = (datetime.now() - start).total_seconds()
+    
+    monster = combat.MONSTERS[怪物.value]
+    embed = discord.Embed(
+        title=f"📊 戰鬥模擬: {hero.name} vs {monster['emoji']} {monster['name']}",
+        description=f"共模擬 **{場數}** 場",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="勝率", value=f"{stats['a_win_rate'] * 100:.1f}%", inline=True)
+    embed.add_field(name="勝 / 敗 / 平", value=f"{stats['a_wins']} / {stats['b_wins']} / {stats['draws']}", inline=True)
+    embed.add_field(name="平均回合", value=f"{stats['avg_rounds']:.1f}", inline=True)
+    embed.set_footer(text=f"耗時 {elapsed:.3f} 秒 | {場數 / elapsed if elapsed > 0 else 0:,.0f} 場/秒")
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ========== 經濟系統指令 ==========
+
+@bot.tree.command(name="設置語音收入", description="設置在語音頻道中每分鐘獲得的收入（管理員）")
+@app_commands.describe(
+    啟用="是否啟用語音收入",
+    貨幣id="獲得的貨幣類型（不填則只獲得經驗值）",
+    每分鐘金額="每分鐘獲得的貨幣數量",
+    每分鐘經驗="每分鐘獲得的經驗值"
+)
+async def set_voice_income(interaction: discord.Interaction, 啟用: bool, 貨幣id: Optional[str] = None, 每分鐘金額: int = 0, 每分鐘經驗: int = 0):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    if 每分鐘金額 < 0 or 每分鐘經驗 < 0:
+        await interaction.response.send_message("❌ 金額和經驗值不能為負數！", ephemeral=True)
+        return
+    
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    
+    currency_id = 貨幣id.lower().strip() if 貨幣id else None
+    if currency_id and currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    if 啟用 and not (currency_id and 每分鐘金額 > 0) and 每分鐘經驗 <= 0:
+        await interaction.response.send_message("❌ 請至少設置每分鐘金額（需指定貨幣）或每分鐘經驗！", ephemeral=True)
+        return
+    
+    guilds[guild_id]['voice_income'] = {
+        'enabled': 啟用,
+        'currency_id': currency_id,
+        'amount_per_minute': 每分鐘金額 if currency_id else 0,
+        'exp_per_minute': 每分鐘經驗
+    }
+    save_guilds(guilds)
+    
+    embed = discord.Embed(
+        title="✅ 語音收入設置成功",
+        description="已啟用語音收入" if 啟用 else "已停用語音收入",
+        color=discord.Color.green() if 啟用 else discord.Color.orange()
+    )
+    if 啟用:
+        if currency_id and 每分鐘金額 > 0:
+            currency_data = guilds[guild_id]['currencies'][currency_id]
+            embed.add_field(name="每分鐘金額", value=f"{每分鐘金額} {currency_data['emoji']} {currency_data['name']}", inline=True)
+        if 每分鐘經驗 > 0:
+            embed.add_field(name="每分鐘經驗", value=f"{每分鐘經驗} EXP", inline=True)
+        embed.add_field(name="💡 提示", value="拒聽或在AFK頻道中不計入收入，收入會定時發放", inline=False)
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="設置簽到收入", description="設置身份組的簽到收入（管理員）")
+@app_commands.describe(
+    身份組="要設置的身份組",
+    貨幣id="貨幣類型",
+    每日收入="每日簽到時獲得的額外收入"
+)
+async def set_income_role(interaction: discord.Interaction, 身份組: discord.Role, 貨幣id: str, 每日收入: int):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
+    init_guild(guild_id)
+    
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    currency_data = guilds[guild_id]['currencies'][currency_id]
+    role_id = str(身份組.id)
+    
+    if 'income_roles' not in guilds[guild_id]:
+        guilds[guild_id]['income_roles'] = {}
+    
+    if role_id not in guilds[guild_id]['income_roles']:
+        guilds[guild_id]['income_roles'][role_id] = {
+            "name": 身份組.name,
+            "currencies": {}
+        }
+    
+    guilds[guild_id]['income_roles'][role_id]['currencies'][currency_id] = 每日收入
+    guilds[guild_id]['income_roles'][role_id]['name'] = 身份組.name
+    
+    save_guilds(guilds)
+    
+    embed = discord.Embed(
+        title="✅ 收入身份組設置成功",
+        description=f"身份組 **{身份組.name}** 的 {currency_data['emoji']} {currency_data['name']} 每日收入已設置為 **{每日收入}**",
+        color=discord.Color.green()
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="收入身份組列表", description="查看所有收入身份組")
+async def list_income_roles(interaction: discord.Interaction):
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
     init_guild(guild_id)
     
     income_roles = guilds[guild_id].get('income_roles', {})
@@ -2125,15 +3938,12 @@ async def list_income_roles(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed)
 
-# ========== 管理員金錢管理指令 ==========
-
-@bot.tree.command(name="添加金錢", description="給玩家添加金錢（管理員）")
+@bot.tree.command(name="設置定時收入", description="設置收入身份組定時自動發放（管理員）")
 @app_commands.describe(
-    用戶="要添加金錢的玩家",
-    貨幣id="貨幣類型",
-    金額="要添加的金額"
+    啟用="是否定時自動發放身份組收入",
+    間隔小時="每隔多少小時發放一次"
 )
-async def add_money(interaction: discord.Interaction, 用戶: discord.User, 貨幣id: str, 金額: int):
+async def set_passive_income(interaction: discord.Interaction, 啟用: bool, 間隔小時: int = 24):
     if not await check_admin_permission(interaction):
         await interaction.response.send_message(
             "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
@@ -2141,51 +3951,757 @@ async def add_money(interaction: discord.Interaction, 用戶: discord.User, 貨
         )
         return
     
+    if 間隔小時 < 1 or 間隔小時 > 24 * 30:
+        await interaction.response.send_message("❌ 間隔必須在 1 到 720 小時之間！", ephemeral=True)
+        return
+    
     guild_id = str(interaction.guild.id)
-    guilds = get_guilds()
     init_guild(guild_id)
+    guilds = get_guilds()
     
-    currency_id = 貨幣id.lower().strip()
+    settings = get_passive_income_settings(guilds[guild_id])
+    if settings['interval_hours'] != 間隔小時 or not settings['enabled']:
+        # 從下一個週期開始發放，避免啟用或修改間隔時立即重複發放
+        settings['last_period'] = passive_income_period({'interval_hours': 間隔小時}, datetime.now().timestamp())
+        settings['pending'] = None
+    settings['enabled'] = 啟用
+    settings['interval_hours'] = 間隔小時
+    guilds[guild_id]['passive_income'] = settings
+    save_guilds(guilds)
     
-    if currency_id not in guilds[guild_id]['currencies']:
+    embed = discord.Embed(
+        title="✅ 定時收入設置成功",
+        description="已啟用身份組定時收入" if 啟用 else "已停用身份組定時收入",
+        color=discord.Color.green() if 啟用 else discord.Color.orange()
+    )
+    if 啟用:
+        embed.add_field(name="發放間隔", value=f"每 {間隔小時} 小時", inline=True)
+        embed.add_field(name="💡 提示", value="擁有收入身份組的成員會自動獲得 `/收入身份組列表` 中的收入，簽到時不再額外加成", inline=False)
+    
+    await interaction.response.send_message(embed=embed)
+
+def format_bucket(index: int) -> str:
+    """餘額分桶的顯示文字"""
+    low, high = ledger.bucket_range(index)
+    return f"{low:,}+" if high is None else f"{low:,}-{high:,}"
+
+@bot.tree.command(name="經濟統計", description="查看貨幣的流通量和財富分布（管理員）")
+@app_commands.describe(貨幣id="要查看的貨幣")
+async def economy_stats(interaction: discord.Interaction, 貨幣id: str):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
         await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
         return
     
+    currency_data = guilds[guild_id]['currencies'][currency_id]
+    book = get_guild_ledger(guild_id)
+    stats = book.currency_stats(currency_id)
+    
+    embed = discord.Embed(
+        title=f"📊 {currency_data['emoji']} {currency_data['name']} 經濟統計",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="流通總量", value=f"{stats['supply']:,} {currency_data['emoji']}", inline=True)
+    embed.add_field(name="持有人數", value=f"{stats['holders']:,} 人", inline=True)
+    if stats['holders']:
+        embed.add_field(name="平均持有", value=f"{stats['supply'] // stats['holders']:,} {currency_data['emoji']}", inline=True)
+        median = book.quantile_bucket(currency_id, 0.5)
+        top = book.quantile_bucket(currency_id, 0.9)
+        embed.add_field(name="中位數區間", value=format_bucket(median), inline=True)
+        embed.add_field(name="前10%門檻區間", value=format_bucket(top), inline=True)
+        
+        # 餘額分布長條圖
+        peak = max(stats['histogram'])
+        lines = []
+        for index, count in enumerate(stats['histogram']):
+            if count == 0:
+                continue
+            bar = "█" * max(1, round(count / peak * 12))
+            lines.append(f"`{format_bucket(index):>19}` {bar} {count:,}")
+        embed.add_field(name="餘額分布", value="\n".join(lines), inline=False)
+    
+    # 各來源的累計淨發放（系統帳戶餘額的相反數）
+    sources = []
+    for kind, name in TRANSACTION_KIND_NAMES.items():
+        issued = -book.balance(ledger.system_account(kind), currency_id)
+        if issued:
+            sources.append(f"{name}: {issued:+,}")
+    if sources:
+        embed.add_field(name="累計淨發放", value="\n".join(sources), inline=False)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="快取統計", description="查看數據快取的命中率和淘汰次數（管理員）")
+async def cache_stats(interaction: discord.Interaction):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    embed = discord.Embed(
+        title="🗄️ 數據快取統計",
+        description=f"每種數據最多快取 {DATA_CACHE_MAX_RECORDS:,} 筆記錄（`DATA_CACHE_MAX_RECORDS`）",
+        color=discord.Color.blue()
+    )
+    for name, store in (('👤 用戶', user_store), ('🎭 角色', character_store), ('🏪 商店', shop_store), ('📅 簽到', checkin_store)):
+        stats = store.stats()
+        embed.add_field(
+            name=name,
+            value=(
+                f"命中率: {stats['hit_rate']:.1%}\n"
+                f"命中 / 未命中: {stats['hits']:,} / {stats['misses']:,}\n"
+                f"淘汰: {stats['evictions']:,}\n"
+                f"快取: {stats['cached_shards']:,} 個伺服器，{stats['cached_records']:,} 筆"
+            ),
+            inline=True
+        )
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ========== 貨幣兌換指令 ==========
+
+def get_exchange_config(guild_data: dict) -> dict:
+    """伺服器的兌換設置 {'version', 'rates': {"來源>目標": 匯率}, 'pools': {"A|B": {'fee'}}}"""
+    config = guild_data.setdefault('exchange', {})
+    config.setdefault('version', 0)
+    config.setdefault('rates', {})
+    config.setdefault('pools', {})
+    return config
+
+def pool_reserves(book: ledger.GuildLedger, pool: str, from_currency: str, to_currency: str) -> tuple:
+    """兌換池的 (來源貨幣儲備, 目標貨幣儲備)"""
+    account = ledger.pool_account(pool)
+    return book.balance(account, from_currency), book.balance(account, to_currency)
+
+@bot.tree.command(name="設置匯率", description="設置兩種貨幣之間的固定匯率（管理員）")
+@app_commands.describe(
+    來源貨幣="兌換前的貨幣ID",
+    目標貨幣="兌換後的貨幣ID",
+    匯率="1 單位來源貨幣可換多少目標貨幣（設為0刪除）"
+)
+async def set_exchange_rate(interaction: discord.Interaction, 來源貨幣: str, 目標貨幣: str, 匯率: float):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    from_currency = 來源貨幣.lower().strip()
+    to_currency = 目標貨幣.lower().strip()
+    
+    for currency_id in (from_currency, to_currency):
+        if currency_id not in guilds[guild_id]['currencies']:
+            await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+            return
+    
+    if from_currency == to_currency:
+        await interaction.response.send_message("❌ 來源貨幣和目標貨幣不能相同！", ephemeral=True)
+        return
+    
+    if 匯率 < 0:
+        await interaction.response.send_message("❌ 匯率不能為負數！", ephemeral=True)
+        return
+    
+    config = get_exchange_config(guilds[guild_id])
+    key = exchange.rate_key(from_currency, to_currency)
+    if 匯率 == 0:
+        config['rates'].pop(key, None)
+    else:
+        config['rates'][key] = 匯率
+    config['version'] += 1
+    save_guilds(guilds)
+    exchange.invalidate(guild_id)
+    
+    from_data = guilds[guild_id]['currencies'][from_currency]
+    to_data = guilds[guild_id]['currencies'][to_currency]
+    if 匯率 == 0:
+        message = f"✅ 已刪除 {from_data['emoji']} {from_data['name']} → {to_data['emoji']} {to_data['name']} 的匯率"
+    else:
+        message = f"✅ 匯率已設置: 1 {from_data['emoji']} {from_data['name']} = **{匯率:g}** {to_data['emoji']} {to_data['name']}"
+    await interaction.response.send_message(message)
+
+@bot.tree.command(name="建立兌換池", description="建立或注資兩種貨幣的自動做市兌換池（管理員）")
+@app_commands.describe(
+    貨幣a="第一種貨幣ID",
+    貨幣b="第二種貨幣ID",
+    注資a="注入兌換池的第一種貨幣數量",
+    注資b="注入兌換池的第二種貨幣數量",
+    手續費="每次兌換的手續費百分比（默認0.3）"
+)
+async def create_exchange_pool(
+    interaction: discord.Interaction,
+    貨幣a: str,
+    貨幣b: str,
+    注資a: int,
+    注資b: int,
+    手續費: Optional[float] = None
+):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    currency_a = 貨幣a.lower().strip()
+    currency_b = 貨幣b.lower().strip()
+    
+    for currency_id in (currency_a, currency_b):
+        if currency_id not in guilds[guild_id]['currencies']:
+            await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+            return
+    
+    if currency_a == currency_b:
+        await interaction.response.send_message("❌ 兩種貨幣不能相同！", ephemeral=True)
+        return
+    
+    if 注資a < 0 or 注資b < 0:
+        await interaction.response.send_message("❌ 注資數量不能為負數！", ephemeral=True)
+        return
+    
+    if 手續費 is not None and not 0 <= 手續費 / 100 <= exchange.MAX_POOL_FEE:
+        await interaction.response.send_message(f"❌ 手續費必須在 0 到 {exchange.MAX_POOL_FEE * 100:g}% 之間！", ephemeral=True)
+        return
+    
+    config = get_exchange_config(guilds[guild_id])
+    pool = exchange.pool_key(currency_a, currency_b)
+    book = get_guild_ledger(guild_id)
+    reserve_a, reserve_b = pool_reserves(book, pool, currency_a, currency_b)
+    if reserve_a + 注資a <= 0 or reserve_b + 注資b <= 0:
+        await interaction.response.send_message("❌ 兌換池的兩種貨幣儲備都必須大於0！", ephemeral=True)
+        return
+    
+    if 注資a or 注資b:
+        account = ledger.pool_account(pool)
+        seed_account = ledger.system_account('exchange_seed')
+        try:
+            book.post('exchange_seed', [
+                (account, currency_a, 注資a), (seed_account, currency_a, -注資a),
+                (account, currency_b, 注資b), (seed_account, currency_b, -注資b)
+            ], key=interaction_key(interaction, 'exchange_seed'), memo=f"管理員 {interaction.user.display_name} 注資")
+        except ledger.DuplicateTransaction:
+            await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+            return
+    
+    pool_config = config['pools'].setdefault(pool, {'fee': exchange.DEFAULT_POOL_FEE})
+    if 手續費 is not None:
+        pool_config['fee'] = 手續費 / 100
+    save_guilds(guilds)
+    
+    reserve_a, reserve_b = pool_reserves(book, pool, currency_a, currency_b)
+    data_a = guilds[guild_id]['currencies'][currency_a]
+    data_b = guilds[guild_id]['currencies'][currency_b]
+    embed = discord.Embed(
+        title="✅ 兌換池已更新",
+        description=f"{data_a['emoji']} {data_a['name']} ⇄ {data_b['emoji']} {data_b['name']}",
+        color=discord.Color.green()
+    )
+    embed.add_field(name="儲備", value=f"{reserve_a:,} {data_a['emoji']}\n{reserve_b:,} {data_b['emoji']}", inline=True)
+    embed.add_field(name="當前價格", value=f"1 {data_a['emoji']} ≈ {exchange.spot_price(reserve_a, reserve_b):.4g} {data_b['emoji']}", inline=True)
+    embed.add_field(name="手續費", value=f"{pool_config['fee'] * 100:g}%", inline=True)
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="兌換", description="把一種貨幣兌換成另一種貨幣")
+@app_commands.describe(
+    來源貨幣="要兌換出去的貨幣ID",
+    目標貨幣="想要獲得的貨幣ID",
+    金額="兌換的來源貨幣數量"
+)
+async def exchange_currency(interaction: discord.Interaction, 來源貨幣: str, 目標貨幣: str, 金額: int):
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    from_currency = 來源貨幣.lower().strip()
+    to_currency = 目標貨幣.lower().strip()
+    
+    for currency_id in (from_currency, to_currency):
+        if currency_id not in guilds[guild_id]['currencies']:
+            await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+            return
+    
+    if from_currency == to_currency:
+        await interaction.response.send_message("❌ 來源貨幣和目標貨幣不能相同！", ephemeral=True)
+        return
+    
     if 金額 <= 0:
         await interaction.response.send_message("❌ 金額必須大於0！", ephemeral=True)
         return
     
+    from_data = guilds[guild_id]['currencies'][from_currency]
+    to_data = guilds[guild_id]['currencies'][to_currency]
+    user_id = str(interaction.user.id)
+    user_key = get_user_key(guild_id, user_id)
+    init_user(user_id, guild_id)
+    users = get_users()
+    
+    balance = users[user_key]['balances'].get(from_currency, 0)
+    if balance < 金額:
+        await interaction.response.send_message(
+            f"❌ {from_data['name']}不足！你只有 {balance} {from_data['emoji']}",
+            ephemeral=True
+        )
+        return
+    
+    # 有兌換池時優先使用兌換池，否則使用固定匯率
+    config = get_exchange_config(guilds[guild_id])
+    pool = exchange.pool_key(from_currency, to_currency)
+    book = get_guild_ledger(guild_id, users)
+    if pool in config['pools']:
+        reserve_in, reserve_out = pool_reserves(book, pool, from_currency, to_currency)
+        received = exchange.quote_pool(金額, reserve_in, reserve_out, config['pools'][pool]['fee'])
+        counterparty = ledger.pool_account(pool)
+        method = "兌換池"
+    else:
+        rate = exchange.get_matrix(guild_id, config).get(from_currency, to_currency)
+        if rate is None:
+            await interaction.response.send_message(
+                f"❌ {from_data['name']}和{to_data['name']}之間沒有設置匯率或兌換池！",
+                ephemeral=True
+            )
+            return
+        received = exchange.quote_fixed(金額, rate)
+        counterparty = ledger.system_account('exchange')
+        method = f"固定匯率 1:{rate:g}"
+    
+    if received <= 0:
+        await interaction.response.send_message("❌ 兌換金額太少，無法獲得任何目標貨幣！", ephemeral=True)
+        return
+    
+    # 付出和獲得記為同一筆交易，與轉帳使用相同的記帳和保存流程
+    try:
+        post_transaction(
+            users, guild_id, 'exchange',
+            [(user_id, from_currency, -金額), (user_id, to_currency, received)],
+            counterparty=counterparty,
+            key=interaction_key(interaction, 'exchange'),
+            memo=f"{金額} {from_data['name']} → {received} {to_data['name']}"
+        )
+    except ledger.DuplicateTransaction:
+        await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+        return
+    save_users(users)
+    
+    embed = discord.Embed(
+        title="✅ 兌換成功",
+        description=f"**{金額}** {from_data['emoji']} {from_data['name']} → **{received}** {to_data['emoji']} {to_data['name']}",
+        color=discord.Color.green()
+    )
+    embed.add_field(name="兌換方式", value=method, inline=True)
+    embed.add_field(
+        name="你的餘額",
+        value=f"{users[user_key]['balances'][from_currency]} {from_data['emoji']}\n{users[user_key]['balances'][to_currency]} {to_data['emoji']}",
+        inline=True
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="匯率列表", description="查看所有貨幣匯率和兌換池")
+async def list_exchange_rates(interaction: discord.Interaction):
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    currencies = guilds[guild_id]['currencies']
+    config = get_exchange_config(guilds[guild_id])
+    
+    embed = discord.Embed(title="💱 匯率列表", color=discord.Color.blue())
+    
+    rate_lines = []
+    for key, rate in config['rates'].items():
+        from_currency, _, to_currency = key.partition('>')
+        if from_currency in currencies and to_currency in currencies:
+            rate_lines.append(
+                f"1 {currencies[from_currency]['emoji']} {currencies[from_currency]['name']} = "
+                f"{rate:g} {currencies[to_currency]['emoji']} {currencies[to_currency]['name']}"
+            )
+    if rate_lines:
+        embed.add_field(name="固定匯率", value="\n".join(rate_lines[:20]), inline=False)
+    
+    book = get_guild_ledger(guild_id)
+    pool_lines = []
+    for pool, pool_config in config['pools'].items():
+        currency_a, _, currency_b = pool.partition('|')
+        if currency_a not in currencies or currency_b not in currencies:
+            continue
+        reserve_a, reserve_b = pool_reserves(book, pool, currency_a, currency_b)
+        pool_lines.append(
+            f"{currencies[currency_a]['emoji']} ⇄ {currencies[currency_b]['emoji']} "
+            f"1:{exchange.spot_price(reserve_a, reserve_b):.4g}（儲備 {reserve_a:,} / {reserve_b:,}，手續費 {pool_config['fee'] * 100:g}%）"
+        )
+    if pool_lines:
+        embed.add_field(name="兌換池", value="\n".join(pool_lines[:20]), inline=False)
+    
+    if not rate_lines and not pool_lines:
+        embed.description = "目前沒有設置任何匯率或兌換池"
+    
+    await interaction.response.send_message(embed=embed)
+
+# ========== 管理員金錢管理指令 ==========
+
+@bot.tree.command(name="添加金錢", description="給玩家添加金錢（管理員）")
+@app_commands.describe(
+    用戶="要添加金錢的玩家",
+    貨幣id="貨幣類型",
+    金額="要添加的金額"
+)
+async def add_money(interaction: discord.Interaction, 用戶: discord.User, 貨幣id: str, 金額: int):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
+    init_guild(guild_id)
+    
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    if 金額 <= 0:
+        await interaction.response.send_message("❌ 金額必須大於0！", ephemeral=True)
+        return
+    
+    currency_data = guilds[guild_id]['currencies'][currency_id]
+    user_id = str(用戶.id)
+    user_key = get_user_key(guild_id, user_id)
+    init_user(user_id, guild_id)
+    
+    users = get_users()
+    try:
+        post_transaction(
+            users, guild_id, 'admin_add',
+            [(user_id, currency_id, 金額)],
+            key=interaction_key(interaction, 'admin_add'),
+            memo=f"管理員 {interaction.user.display_name} 添加"
+        )
+    except ledger.DuplicateTransaction:
+        await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+        return
+    save_users(users)
+    
+    embed = discord.Embed(
+        title="✅ 添加金錢成功",
+        description=f"已為 {用戶.mention} 添加 **{金額}** {currency_data['emoji']} {currency_data['name']}",
+        color=discord.Color.green()
+    )
+    embed.add_field(
+        name="當前餘額",
+        value=f"{users[user_key]['balances'][currency_id]} {currency_data['emoji']}",
+        inline=True
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="移除金錢", description="移除玩家的金錢（管理員）")
+@app_commands.describe(
+    用戶="要移除金錢的玩家",
+    貨幣id="貨幣類型",
+    金額="要移除的金額"
+)
+async def remove_money(interaction: discord.Interaction, 用戶: discord.User, 貨幣id: str, 金額: int):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    guilds = get_guilds()
+    init_guild(guild_id)
+    
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    if 金額 <= 0:
+        await interaction.response.send_message("❌ 金額必須大於0！", ephemeral=True)
+        return
+    
+    currency_data = guilds[guild_id]['currencies'][currency_id]
+    user_id = str(用戶.id)
+    user_key = get_user_key(guild_id, user_id)
+    init_user(user_id, guild_id)
+    
+    users = get_users()
+    old_balance = users[user_key]['balances'].get(currency_id, 0)
+    actual_removed = min(old_balance, 金額)
+    try:
+        post_transaction(
+            users, guild_id, 'admin_remove',
+            [(user_id, currency_id, -actual_removed)],
+            key=interaction_key(interaction, 'admin_remove'),
+            memo=f"管理員 {interaction.user.display_name} 移除"
+        )
+    except ledger.DuplicateTransaction:
+        await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+        return
+    users[user_key]['balances'].setdefault(currency_id, 0)
+    save_users(users)
+    
+    embed = discord.Embed(
+        title="✅ 移除金錢成功",
+        description=f"已從 {用戶.mention} 移除 **{actual_removed}** {currency_data['emoji']} {currency_data['name']}",
+        color=discord.Color.orange()
+    )
+    
+    if actual_removed < 金額:
+        embed.add_field(
+            name="⚠️ 注意",
+            value=f"用戶餘額不足，實際移除 {actual_removed}，餘額已歸零",
+            inline=False
+        )
+    
+    embed.add_field(
+        name="當前餘額",
+        value=f"{users[user_key]['balances'][currency_id]} {currency_data['emoji']}",
+        inline=True
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="查看餘額", description="查看玩家的餘額（管理員）")
+@app_commands.describe(用戶="要查看的玩家")
+async def check_balance(interaction: discord.Interaction, 用戶: discord.User):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    user_id = str(用戶.id)
+    user_key = get_user_key(guild_id, user_id)
+    init_user(user_id, guild_id)
+    
+    users = get_users()
+    guilds = get_guilds()
+    
+    embed = discord.Embed(
+        title=f"💰 {用戶.display_name} 的餘額",
+        color=discord.Color.gold()
+    )
+    
+    balances_text = []
+    for curr_id, balance in users[user_key]['balances'].items():
+        if curr_id in guilds[guild_id]['currencies']:
+            curr_data = guilds[guild_id]['currencies'][curr_id]
+            balances_text.append(f"{curr_data['emoji']} {curr_data['name']}: **{balance}**")
+    
+    if balances_text:
+        embed.description = "\n".join(balances_text)
+    else:
+        embed.description = "該用戶暫無任何貨幣"
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ========== 批量發放指令 ==========
+
+# 每批處理的人數（每批單獨入帳和保存），超過此人數時回報進度
+BATCH_CHUNK_SIZE = 500
+# 單次批量操作的最大人數
+BATCH_MAX_TARGETS = 100000
+# 更新進度訊息的最短間隔（秒），避免編輯訊息觸發 Discord 的頻率限制
+BATCH_PROGRESS_INTERVAL = 1.0
+
+USER_ID_PATTERN = re.compile(r"\d{15,21}")
+
+async def resolve_batch_targets(
+    interaction: discord.Interaction,
+    role: Optional[discord.Role],
+    mentions: Optional[str],
+    attachment: Optional[discord.Attachment]
+) -> List[str]:
+    """從身份組、@提及列表和ID文字檔收集目標用戶ID（去重，保持順序），無效時拋出 ValueError"""
+    candidates = []
+    if role is not None:
+        candidates.extend(str(member.id) for member in role.members if not member.bot)
+    if mentions:
+        candidates.extend(USER_ID_PATTERN.findall(mentions))
+    if attachment is not None:
+        if attachment.size > 2 * 1024 * 1024:
+            raise ValueError("ID文字檔不能超過2MB")
+        try:
+            text = (await attachment.read()).decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValueError("ID文字檔必須是UTF-8編碼的文字檔")
+        candidates.extend(USER_ID_PATTERN.findall(text))
+    
+    if not candidates:
+        raise ValueError("請指定身份組、用戶列表或上傳ID文字檔")
+    
+    targets = list(dict.fromkeys(candidates))
+    if len(targets) > BATCH_MAX_TARGETS:
+        raise ValueError(f"一次最多只能處理 {BATCH_MAX_TARGETS} 位玩家")
+    
+    # 分段篩選並回報進度，期間讓出事件循環
+    guild = interaction.guild
+    filtered = []
+    async for _, chunk in batch_chunks(interaction, targets, "正在準備批量操作"):
+        for user_id in chunk:
+            member = guild.get_member(int(user_id))
+            if member is None or not member.bot:
+                filtered.append(user_id)
+    return filtered
+
+async def batch_chunks(interaction: discord.Interaction, targets: List[str], label: str):
+    """依序產生 (批次編號, 這一批的用戶ID)，每批 BATCH_CHUNK_SIZE 人
+    
+    每批處理完後讓出事件循環；大批量時更新進度訊息（最多每 BATCH_PROGRESS_INTERVAL 秒一次）。
+    """
+    last_report = 0.0
+    for index, start in enumerate(range(0, len(targets), BATCH_CHUNK_SIZE)):
+        yield index, targets[start:start + BATCH_CHUNK_SIZE]
+        done = min(start + BATCH_CHUNK_SIZE, len(targets))
+        if len(targets) > BATCH_CHUNK_SIZE:
+            now = asyncio.get_running_loop().time()
+            if done == len(targets) or now - last_report >= BATCH_PROGRESS_INTERVAL:
+                last_report = now
+                await interaction.edit_original_response(content=f"⏳ {label}… {done}/{len(targets)}")
+        await asyncio.sleep(0)
+
+async def post_batch_in_chunks(interaction: discord.Interaction, guild_id: str, kind: str,
+                               targets: List[str], build_changes, memo: str) -> Optional[list]:
+    """分批入帳批量操作，每批使用各自的冪等鍵和用戶數據視圖並單獨保存
+    
+    build_changes(users, 這一批的用戶ID) 返回 [(用戶ID, 貨幣ID, 金額)]。
+    返回這次實際入帳的變更；所有批次都已入帳過（重複的互動）時返回 None。
+    """
+    posted = []
+    chunks = duplicates = 0
+    async for index, chunk in batch_chunks(interaction, targets, "正在寫入"):
+        chunks += 1
+        users = get_users()
+        changes = build_changes(users, chunk)
+        try:
+            post_transaction(
+                users, guild_id, kind, changes,
+                key=interaction_key(interaction, f"{kind}:{index}"),
+                memo=memo
+            )
+        except ledger.DuplicateTransaction:
+            duplicates += 1
+            continue
+        save_users(users)
+        posted.extend(changes)
+    if chunks and duplicates == chunks:
+        return None
+    return posted
+
+def format_batch_targets(user_ids: List[str], limit: int = 10) -> str:
+    """批量結果中顯示的用戶列表"""
+    text = " ".join(f"<@{user_id}>" for user_id in user_ids[:limit])
+    if len(user_ids) > limit:
+        text += f" …等 {len(user_ids)} 人"
+    return text or "無"
+
+@bot.tree.command(name="批量添加金錢", description="給身份組或多位玩家添加金錢（管理員）")
+@app_commands.describe(
+    貨幣id="貨幣類型",
+    金額="每位玩家添加的金額",
+    身份組="發放給此身份組的所有成員",
+    用戶列表="@提及或用戶ID（以空白分隔）",
+    id檔案="包含用戶ID的文字檔（每行一個或以逗號分隔）"
+)
+async def batch_add_money(
+    interaction: discord.Interaction,
+    貨幣id: str,
+    金額: int,
+    身份組: Optional[discord.Role] = None,
+    用戶列表: Optional[str] = None,
+    id檔案: Optional[discord.Attachment] = None
+):
+    if not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    init_guild(guild_id)
+    guilds = get_guilds()
+    currency_id = 貨幣id.lower().strip()
+    
+    if currency_id not in guilds[guild_id]['currencies']:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    if 金額 <= 0:
+        await interaction.response.send_message("❌ 金額必須大於0！", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    try:
+        targets = await resolve_batch_targets(interaction, 身份組, 用戶列表, id檔案)
+    except ValueError as e:
+        await interaction.edit_original_response(content=f"❌ {e}")
+        return
+    
+    # 每批記為一筆交易並單獨保存
+    posted = await post_batch_in_chunks(
+        interaction, guild_id, 'batch_add', targets,
+        lambda users, chunk: [(user_id, currency_id, 金額) for user_id in chunk],
+        memo=f"管理員 {interaction.user.display_name} 批量添加"
+    )
+    if posted is None:
+        await interaction.edit_original_response(content=DUPLICATE_TRANSACTION_MESSAGE)
+        return
+    
     currency_data = guilds[guild_id]['currencies'][currency_id]
-    user_id = str(用戶.id)
-    user_key = get_user_key(guild_id, user_id)
-    init_user(user_id, guild_id)
-    
-    users = get_users()
-    if currency_id not in users[user_key]['balances']:
-        users[user_key]['balances'][currency_id] = 0
-    users[user_key]['balances'][currency_id] += 金額
-    save_users(users)
-    
     embed = discord.Embed(
-        title="✅ 添加金錢成功",
-        description=f"已為 {用戶.mention} 添加 **{金額}** {currency_data['emoji']} {currency_data['name']}",
+        title="✅ 批量添加金錢成功",
+        description=f"已為 **{len(targets)}** 位玩家各添加 **{金額}** {currency_data['emoji']} {currency_data['name']}",
         color=discord.Color.green()
     )
-    embed.add_field(
-        name="當前餘額",
-        value=f"{users[user_key]['balances'][currency_id]} {currency_data['emoji']}",
-        inline=True
-    )
+    embed.add_field(name="發放總額", value=f"{金額 * len(targets)} {currency_data['emoji']}", inline=True)
+    embed.add_field(name="玩家", value=format_batch_targets(targets), inline=False)
     
-    await interaction.response.send_message(embed=embed)
+    await interaction.edit_original_response(content=None, embed=embed)
 
-@bot.tree.command(name="移除金錢", description="移除玩家的金錢（管理員）")
+@bot.tree.command(name="批量移除金錢", description="移除身份組或多位玩家的金錢（管理員）")
 @app_commands.describe(
-    用戶="要移除金錢的玩家",
     貨幣id="貨幣類型",
-    金額="要移除的金額"
+    金額="每位玩家移除的金額",
+    身份組="移除此身份組所有成員的金錢",
+    用戶列表="@提及或用戶ID（以空白分隔）",
+    id檔案="包含用戶ID的文字檔（每行一個或以逗號分隔）"
 )
-async def remove_money(interaction: discord.Interaction, 用戶: discord.User, 貨幣id: str, 金額: int):
+async def batch_remove_money(
+    interaction: discord.Interaction,
+    貨幣id: str,
+    金額: int,
+    身份組: Optional[discord.Role] = None,
+    用戶列表: Optional[str] = None,
+    id檔案: Optional[discord.Attachment] = None
+):
     if not await check_admin_permission(interaction):
         await interaction.response.send_message(
             "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
@@ -2194,9 +4710,8 @@ async def remove_money(interaction: discord.Interaction, 用戶: discord.User, 
         return
     
     guild_id = str(interaction.guild.id)
-    guilds = get_guilds()
     init_guild(guild_id)
-    
+    guilds = get_guilds()
     currency_id = 貨幣id.lower().strip()
     
     if currency_id not in guilds[guild_id]['currencies']:
@@ -2207,45 +4722,61 @@ async def remove_money(interaction: discord.Interaction, 用戶: discord.User, 
         await interaction.response.send_message("❌ 金額必須大於0！", ephemeral=True)
         return
     
-    currency_data = guilds[guild_id]['currencies'][currency_id]
-    user_id = str(用戶.id)
-    user_key = get_user_key(guild_id, user_id)
-    init_user(user_id, guild_id)
-    
-    users = get_users()
-    if currency_id not in users[user_key]['balances']:
-        users[user_key]['balances'][currency_id] = 0
+    await interaction.response.defer()
     
-    old_balance = users[user_key]['balances'][currency_id]
-    users[user_key]['balances'][currency_id] = max(0, old_balance - 金額)
-    save_users(users)
+    try:
+        targets = await resolve_batch_targets(interaction, 身份組, 用戶列表, id檔案)
+    except ValueError as e:
+        await interaction.edit_original_response(content=f"❌ {e}")
+        return
     
-    actual_removed = old_balance - users[user_key]['balances'][currency_id]
+    def removals(users, chunk):
+        # 按這一批讀取時的餘額計算（沒有記錄的玩家餘額視為0，不創建記錄）
+        changes = []
+        for user_id in chunk:
+            user = users.get(get_user_key(guild_id, user_id))
+            if user is not None:
+                changes.append((user_id, currency_id, -min(user['balances'].get(currency_id, 0), 金額)))
+        return changes
+    
+    # 每批記為一筆交易並單獨保存
+    posted = await post_batch_in_chunks(
+        interaction, guild_id, 'batch_remove', targets, removals,
+        memo=f"管理員 {interaction.user.display_name} 批量移除"
+    )
+    if posted is None:
+        await interaction.edit_original_response(content=DUPLICATE_TRANSACTION_MESSAGE)
+        return
+    total_removed = -sum(amount for _, _, amount in posted)
+    insufficient = len(targets) - sum(1 for _, _, amount in posted if -amount == 金額)
     
+    currency_data = guilds[guild_id]['currencies'][currency_id]
     embed = discord.Embed(
-        title="✅ 移除金錢成功",
-        description=f"已從 {用戶.mention} 移除 **{actual_removed}** {currency_data['emoji']} {currency_data['name']}",
+        title="✅ 批量移除金錢成功",
+        description=f"已從 **{len(targets)}** 位玩家各移除最多 **{金額}** {currency_data['emoji']} {currency_data['name']}",
         color=discord.Color.orange()
     )
+    embed.add_field(name="實際移除總額", value=f"{total_removed} {currency_data['emoji']}", inline=True)
+    if insufficient:
+        embed.add_field(name="⚠️ 餘額不足", value=f"{insufficient} 位玩家餘額不足，已歸零", inline=True)
+    embed.add_field(name="玩家", value=format_batch_targets(targets), inline=False)
     
-    if actual_removed < 金額:
-        embed.add_field(
-            name="⚠️ 注意",
-            value=f"用戶餘額不足，實際移除 {actual_removed}，餘額已歸零",
-            inline=False
-        )
-    
-    embed.add_field(
-        name="當前餘額",
-        value=f"{users[user_key]['balances'][currency_id]} {currency_data['emoji']}",
-        inline=True
-    )
-    
-    await interaction.response.send_message(embed=embed)
+    await interaction.edit_original_response(content=None, embed=embed)
 
-@bot.tree.command(name="查看餘額", description="查看玩家的餘額（管理員）")
-@app_commands.describe(用戶="要查看的玩家")
-async def check_balance(interaction: discord.Interaction, 用戶: discord.User):
+@bot.tree.command(name="批量增加經驗值", description="為身份組或多位玩家的角色增加經驗值（管理員）")
+@app_commands.describe(
+    經驗值="每個角色增加的經驗值",
+    身份組="為此身份組所有成員的角色增加經驗值",
+    用戶列表="@提及或用戶ID（以空白分隔）",
+    id檔案="包含用戶ID的文字檔（每行一個或以逗號分隔）"
+)
+async def batch_add_exp(
+    interaction: discord.Interaction,
+    經驗值: int,
+    身份組: Optional[discord.Role] = None,
+    用戶列表: Optional[str] = None,
+    id檔案: Optional[discord.Attachment] = None
+):
     if not await check_admin_permission(interaction):
         await interaction.response.send_message(
             "❌ 此指令僅限管理員使用！\n💡 需要Discord管理員權限或被設為機器人管理員。",
@@ -2253,31 +4784,183 @@ async def check_balance(interaction: discord.Interaction, 用戶: discord.User):
         )
         return
     
+    if 經驗值 <= 0:
+        await interaction.response.send_message("❌ 經驗值必須大於0！", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
     guild_id = str(interaction.guild.id)
-    user_id = str(用戶.id)
-    user_key = get_user_key(guild_id, user_id)
-    init_user(user_id, guild_id)
+    try:
+        targets = await resolve_batch_targets(interaction, 身份組, 用戶列表, id檔案)
+    except ValueError as e:
+        await interaction.edit_original_response(content=f"❌ {e}")
+        return
     
-    users = get_users()
-    guilds = get_guilds()
+    # 每批單獨載入、修改和保存
+    table = get_level_table(guild_id)
+    updated = []
+    skipped = 0
+    level_ups = []
+    async for _, chunk in batch_chunks(interaction, targets, "正在寫入"):
+        characters = get_characters()
+        changed = []
+        for user_id in chunk:
+            char = characters.get(f"char_{get_user_key(guild_id, user_id)}")
+            if char is None:
+                skipped += 1
+                continue
+            old_level = table.level_from_exp(char['exp'])
+            char['exp'] += 經驗值
+            char['level'] = table.level_from_exp(char['exp'])
+            changed.append(char)
+            updated.append(user_id)
+            if char['level'] > old_level:
+                level_ups.append(user_id)
+        if changed:
+            save_characters(characters)
+            for char in changed:
+                record_exp(char)
     
     embed = discord.Embed(
-        title=f"💰 {用戶.display_name} 的餘額",
-        color=discord.Color.gold()
+        title="✅ 批量增加經驗值成功",
+        description=f"已為 **{len(updated)}** 個角色各增加 **{經驗值}** 點經驗值",
+        color=discord.Color.green()
     )
+    if skipped:
+        embed.add_field(name="⚠️ 跳過", value=f"{skipped} 位玩家還沒有創建角色", inline=True)
+    if level_ups:
+        embed.add_field(name="🎉 升級", value=f"{len(level_ups)} 位玩家升級\n{format_batch_targets(level_ups)}", inline=False)
+    embed.add_field(name="玩家", value=format_batch_targets(updated), inline=False)
     
-    balances_text = []
-    for curr_id, balance in users[user_key]['balances'].items():
-        if curr_id in guilds[guild_id]['currencies']:
-            curr_data = guilds[guild_id]['currencies'][curr_id]
-            balances_text.append(f"{curr_data['emoji']} {curr_data['name']}: **{balance}**")
-    
-    if balances_text:
-        embed.description = "\n".join(balances_text)
+    await interaction.edit_original_response(content=None, embed=embed)
+
+# ========== 排行榜指令 ==========
+
+LEADERBOARD_PAGE_SIZE = 10
+
+def resolve_leaderboard(guild_id: str, board: str):
+    """根據排行榜類型返回 (排行榜, 標題, 分數格式化函數)，找不到時返回 None
+    
+    board 格式: "balance:<貨幣ID>"、"exp" 或 "streak"
+    """
+    kind, _, arg = board.partition(':')
+    if kind == 'exp':
+        table = get_level_table(guild_id)
+        return (
+            get_exp_leaderboard(guild_id),
+            "🏆 等級排行榜",
+            lambda score: f"Lv.{table.level_from_exp(score)}（{score:,} EXP）"
+        )
+    if kind == 'streak':
+        return (
+            get_streak_leaderboard(guild_id),
+            "🏆 連續簽到排行榜",
+            lambda score: f"{score} 天 🔥"
+        )
+    if kind == 'balance':
+        guilds = get_guilds()
+        currency_data = guilds.get(guild_id, {}).get('currencies', {}).get(arg)
+        if currency_data is None:
+            return None
+        return (
+            get_guild_ledger(guild_id).leaderboard(arg),
+            f"🏆 {currency_data['emoji']} {currency_data['name']} 富豪榜",
+            lambda score: f"{score:,} {currency_data['emoji']}"
+        )
+    return None
+
+def build_leaderboard_embed(guild_id: str, board: str, page: int, viewer_id: int) -> Optional[discord.Embed]:
+    """排行榜頁面（只取出當前頁的項目）"""
+    resolved = resolve_leaderboard(guild_id, board)
+    if resolved is None:
+        return None
+    ranking, title, format_score = resolved
+    
+    embed = discord.Embed(title=title, color=discord.Color.gold())
+    entries = ranking.page(page * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE)
+    if entries:
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        embed.description = "\n".join(
+            f"{medals.get(rank, f'`#{rank}`')} <@{user_id}> — **{format_score(score)}**"
+            for rank, user_id, score in entries
+        )
     else:
-        embed.description = "該用戶暫無任何貨幣"
+        embed.description = "還沒有任何玩家上榜"
     
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    viewer_rank = ranking.rank(str(viewer_id))
+    if viewer_rank is not None:
+        embed.add_field(
+            name="你的排名",
+            value=f"第 **{viewer_rank}** 名（{format_score(ranking.score(str(viewer_id)))}）",
+            inline=False
+        )
+    
+    pages = max(1, (len(ranking) + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE)
+    embed.set_footer(text=f"第 {page + 1}/{pages} 頁 | 共 {len(ranking)} 位玩家")
+    return embed
+
+class LeaderboardView(discord.ui.View):
+    def __init__(self, guild_id: str, board: str, page: int = 0):
+        super().__init__(timeout=300)
+        self.guild_id = guild_id
+        self.board = board
+        self.page = page
+    
+    @discord.ui.button(label='上一頁', style=discord.ButtonStyle.gray, emoji='◀️')
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.page > 0:
+            self.page -= 1
+            await self.update_display(interaction)
+        else:
+            await interaction.response.send_message("已經是第一頁了！", ephemeral=True)
+    
+    @discord.ui.button(label='下一頁', style=discord.ButtonStyle.gray, emoji='▶️')
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        resolved = resolve_leaderboard(self.guild_id, self.board)
+        if resolved and (self.page + 1) * LEADERBOARD_PAGE_SIZE < len(resolved[0]):
+            self.page += 1
+            await self.update_display(interaction)
+        else:
+            await interaction.response.send_message("已經是最後一頁了！", ephemeral=True)
+    
+    async def update_display(self, interaction: discord.Interaction):
+        embed = build_leaderboard_embed(self.guild_id, self.board, self.page, interaction.user.id)
+        if embed is None:
+            await interaction.response.send_message("❌ 這個排行榜已不存在！", ephemeral=True)
+            return
+        await interaction.response.edit_message(embed=embed, view=self)
+
+@bot.tree.command(name="排行榜", description="查看貨幣的富豪排行榜")
+@app_commands.describe(貨幣id="貨幣類型", 頁數="從第幾頁開始查看")
+async def balance_leaderboard(interaction: discord.Interaction, 貨幣id: str, 頁數: int = 1):
+    guild_id = str(interaction.guild.id)
+    currency_id = 貨幣id.lower().strip()
+    board = f"balance:{currency_id}"
+    page = max(0, 頁數 - 1)
+    
+    embed = build_leaderboard_embed(guild_id, board, page, interaction.user.id)
+    if embed is None:
+        await interaction.response.send_message(f"❌ 找不到貨幣ID `{currency_id}`！", ephemeral=True)
+        return
+    
+    await interaction.response.send_message(embed=embed, view=LeaderboardView(guild_id, board, page))
+
+@bot.tree.command(name="等級排行榜", description="查看角色等級排行榜")
+@app_commands.describe(頁數="從第幾頁開始查看")
+async def exp_leaderboard(interaction: discord.Interaction, 頁數: int = 1):
+    guild_id = str(interaction.guild.id)
+    page = max(0, 頁數 - 1)
+    embed = build_leaderboard_embed(guild_id, 'exp', page, interaction.user.id)
+    await interaction.response.send_message(embed=embed, view=LeaderboardView(guild_id, 'exp', page))
+
+@bot.tree.command(name="簽到排行榜", description="查看連續簽到天數排行榜")
+@app_commands.describe(頁數="從第幾頁開始查看")
+async def streak_leaderboard(interaction: discord.Interaction, 頁數: int = 1):
+    guild_id = str(interaction.guild.id)
+    page = max(0, 頁數 - 1)
+    embed = build_leaderboard_embed(guild_id, 'streak', page, interaction.user.id)
+    await interaction.response.send_message(embed=embed, view=LeaderboardView(guild_id, 'streak', page))
 
 # ========== 其他指令 ==========
 
@@ -2311,7 +4994,6 @@ async def transfer_money(interaction: discord.Interaction, 用戶: discord.User,
     receiver_id = str(用戶.id)
     
     sender_key = get_user_key(guild_id, sender_id)
-    receiver_key = get_user_key(guild_id, receiver_id)
     
     init_user(sender_id, guild_id)
     init_user(receiver_id, guild_id)
@@ -2327,11 +5009,16 @@ async def transfer_money(interaction: discord.Interaction, 用戶: discord.User,
         )
         return
     
-    users[sender_key]['balances'][currency_id] = sender_balance - 金額
-    
-    if currency_id not in users[receiver_key]['balances']:
-        users[receiver_key]['balances'][currency_id] = 0
-    users[receiver_key]['balances'][currency_id] += 金額
+    # 付款和收款為一組平衡的分錄
+    try:
+        post_transaction(
+            users, guild_id, 'transfer',
+            [(sender_id, currency_id, -金額), (receiver_id, currency_id, 金額)],
+            key=interaction_key(interaction, 'transfer')
+        )
+    except ledger.DuplicateTransaction:
+        await interaction.response.send_message(DUPLICATE_TRANSACTION_MESSAGE, ephemeral=True)
+        return
     
     save_users(users)
     
@@ -2348,6 +5035,117 @@ async def transfer_money(interaction: discord.Interaction, 用戶: discord.User,
     
     await interaction.response.send_message(embed=embed)
 
+HISTORY_PAGE_SIZE = 10
+
+def format_counterparty(account: Optional[str]) -> str:
+    """交易對方的顯示文字"""
+    if not account:
+        return ""
+    user_id = ledger.account_user_id(account)
+    if user_id is not None:
+        return f"<@{user_id}>"
+    if account.startswith("shop:"):
+        return f"商店 `{account.split('/', 1)[1]}`"
+    if account.startswith("pool:"):
+        return "兌換池"
+    return ""
+
+def build_history_embed(guild_id: str, user: discord.abc.User, records: list, total: int, page: int) -> discord.Embed:
+    """交易紀錄頁面"""
+    guilds = get_guilds()
+    currencies = guilds.get(guild_id, {}).get('currencies', {})
+    
+    embed = discord.Embed(
+        title=f"📜 {user.display_name} 的交易紀錄",
+        color=discord.Color.blue()
+    )
+    
+    if not records:
+        embed.description = "還沒有任何交易紀錄"
+        return embed
+    
+    lines = []
+    for record in records:
+        currency_data = currencies.get(record['currency_id'])
+        currency_text = f"{currency_data['emoji']} {currency_data['name']}" if currency_data else f"`{record['currency_id']}`"
+        kind_name = TRANSACTION_KIND_NAMES.get(record['kind'], record['kind'])
+        amount = record['amount']
+        # 轉帳的方向顯示在對方前面
+        counterparty = format_counterparty(record.get('counterparty'))
+        if counterparty and record['kind'] == 'transfer':
+            counterparty = f"{'給' if amount < 0 else '來自'} {counterparty}"
+        detail = " ".join(part for part in (counterparty, record.get('memo', '')) if part)
+        line = f"<t:{int(record['ts'])}:R> {kind_name} **{amount:+d}** {currency_text}"
+        if detail:
+            line += f"\n　└ {detail}"
+        lines.append(line)
+    embed.description = "\n".join(lines)
+    embed.set_footer(text=f"第 {page + 1} 頁 | 共 {total} 筆交易")
+    return embed
+
+class TransactionHistoryView(discord.ui.View):
+    """交易紀錄翻頁（以紀錄編號為游標，不需要計算偏移量）"""
+    
+    def __init__(self, guild_id: str, user: discord.abc.User, viewer_id: int, records: list):
+        super().__init__(timeout=300)
+        self.guild_id = guild_id
+        self.user = user
+        self.viewer_id = viewer_id
+        self.records = records
+        # 已瀏覽頁面的游標（每頁第一筆之後的編號），用於返回較新的頁面
+        self.cursors = []
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.viewer_id:
+            await interaction.response.send_message("❌ 這不是你的交易紀錄頁面！", ephemeral=True)
+            return False
+        return True
+    
+    @discord.ui.button(label='較新', style=discord.ButtonStyle.gray, emoji='◀️')
+    async def newer_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not self.cursors:
+            await interaction.response.send_message("已經是最新的紀錄了！", ephemeral=True)
+            return
+        self.cursors.pop()
+        before = self.cursors[-1] if self.cursors else None
+        await self.show_page(interaction, before)
+    
+    @discord.ui.button(label='較舊', style=discord.ButtonStyle.gray, emoji='▶️')
+    async def older_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not self.records or self.records[-1]['n'] <= 1:
+            await interaction.response.send_message("已經是最舊的紀錄了！", ephemeral=True)
+            return
+        before = self.records[-1]['n']
+        self.cursors.append(before)
+        await self.show_page(interaction, before)
+    
+    async def show_page(self, interaction: discord.Interaction, before: Optional[int]):
+        book = get_guild_ledger(self.guild_id)
+        user_id = str(self.user.id)
+        self.records = book.user_history(user_id, before, HISTORY_PAGE_SIZE)
+        embed = build_history_embed(self.guild_id, self.user, self.records, book.users.count(user_id), len(self.cursors))
+        await interaction.response.edit_message(embed=embed, view=self)
+
+@bot.tree.command(name="交易紀錄", description="查看金錢的收支紀錄")
+@app_commands.describe(用戶="要查看的玩家（查看其他人需要管理員權限）")
+async def transaction_history(interaction: discord.Interaction, 用戶: Optional[discord.User] = None):
+    target = 用戶 or interaction.user
+    if target.id != interaction.user.id and not await check_admin_permission(interaction):
+        await interaction.response.send_message(
+            "❌ 只有管理員可以查看其他玩家的交易紀錄！",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = str(interaction.guild.id)
+    user_id = str(target.id)
+    book = get_guild_ledger(guild_id)
+    records = book.user_history(user_id, None, HISTORY_PAGE_SIZE)
+    
+    embed = build_history_embed(guild_id, target, records, book.users.count(user_id), 0)
+    view = TransactionHistoryView(guild_id, target, interaction.user.id, records)
+    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
 @bot.tree.command(name="商品設置", description="設置商品的屬性（商店擁有者）")
 @app_commands.describe(
     商店id="商店ID",
@@ -2372,27 +5170,8 @@ async def item_settings(interaction: discord.Interaction, 商店id: str, 商品i
     
     item = shops[shop_key][shop_id]['items'][item_id]
     
-    embed = discord.Embed(
-        title=f"⚙️ {item['name']} (`{item_id}`) - 設置",
-        description="點擊下方按鈕切換商品屬性",
-        color=discord.Color.blue()
-    )
-    embed.add_field(name="可使用", value="✅ 是" if item.get('usable', True) else "❌ 否", inline=True)
-    embed.add_field(name="可轉售", value="✅ 是" if item.get('resellable', True) else "❌ 否", inline=True)
-    embed.add_field(name="消耗型", value="✅ 是" if item.get('consumable', True) else "❌ 否", inline=True)
-    
-    stock = item.get('stock', -1)
-    stock_display = "無限 ♾️" if stock == -1 else f"{stock} 個"
-    embed.add_field(name="📦 庫存", value=stock_display, inline=True)
-    
-    # 顯示描述
-    embed.add_field(name="📝 商品描述", value=item.get('description', '無'), inline=False)
-    if item.get('use_description'):
-        embed.add_field(name="✨ 使用描述", value=item['use_description'], inline=False)
-    else:
-        embed.add_field(name="✨ 使用描述", value="未設置（使用 `/修改使用描述` 設置）", inline=False)
-    
-    view = ItemSettingsView(shop_key, shop_id, item_id, user_id)
+    embed = build_item_settings_embed(item, item_id)
+    view = ItemSettingsView(item, shop_id, item_id, user_id)
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
 @bot.tree.command(name="修改使用描述", description="修改物品使用時的描述")
@@ -2498,12 +5277,43 @@ async def remove_admin(interaction: discord.Interaction, 用戶: discord.User):
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="添加管理員身份組", description="讓身份組的所有成員成為機器人管理員（需要Discord管理員權限）")
+@app_commands.describe(身份組="要設為管理員的身份組")
+@app_commands.checks.has_permissions(administrator=True)
+async def add_admin_role_command(interaction: discord.Interaction, 身份組: discord.Role):
+    guild_id = str(interaction.guild.id)
+    add_admin_role(guild_id, str(身份組.id))
+    
+    embed = discord.Embed(
+        title="✅ 管理員身份組添加成功",
+        description=f"擁有 {身份組.mention} 的成員現在可以使用管理員指令",
+        color=discord.Color.green()
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="移除管理員身份組", description="移除身份組的機器人管理員權限（需要Discord管理員權限）")
+@app_commands.describe(身份組="要移除管理員權限的身份組")
+@app_commands.checks.has_permissions(administrator=True)
+async def remove_admin_role_command(interaction: discord.Interaction, 身份組: discord.Role):
+    guild_id = str(interaction.guild.id)
+    remove_admin_role(guild_id, str(身份組.id))
+    
+    embed = discord.Embed(
+        title="✅ 管理員身份組移除成功",
+        description=f"{身份組.mention} 的管理員權限已被移除",
+        color=discord.Color.orange()
+    )
+    
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="管理員列表", description="查看所有機器人管理員")
 async def list_admins(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
     guilds = load_json(GUILDS_FILE, {})
+    admin_roles = guilds.get(guild_id, {}).get('admin_roles', [])
     
-    if guild_id not in guilds or 'bot_admins' not in guilds[guild_id] or not guilds[guild_id]['bot_admins']:
+    if (guild_id not in guilds or not guilds[guild_id].get('bot_admins')) and not admin_roles:
         await interaction.response.send_message(
             "❌ 目前沒有設置任何機器人管理員。\n💡 Discord管理員可以使用 `/添加管理員` 來設置。",
             ephemeral=True
@@ -2517,7 +5327,7 @@ async def list_admins(interaction: discord.Interaction):
     )
     
     admin_mentions = []
-    for admin_id in guilds[guild_id]['bot_admins']:
+    for admin_id in guilds[guild_id].get('bot_admins', []):
         user = interaction.guild.get_member(int(admin_id))
         if user:
             admin_mentions.append(f"• {user.mention} ({user.name})")
@@ -2530,6 +5340,13 @@ async def list_admins(interaction: discord.Interaction):
         inline=False
     )
     
+    if admin_roles:
+        embed.add_field(
+            name="管理員身份組",
+            value="\n".join(f"• <@&{role_id}>" for role_id in admin_roles),
+            inline=False
+        )
+    
     embed.set_footer(text="💡 Discord管理員始終擁有所有權限")
     
     await interaction.response.send_message(embed=embed)
@@ -2585,22 +5402,54 @@ async def help_command(interaction: discord.Interaction):
         value="""
         `/創建角色` - 創建RPG角色
         `/角色卡` - 查看角色信息
-        `/等級經驗表` - 查看等級經驗值對照表
+        `/等級經驗表` - 查看等級經驗值對照表（一次最多50級）
+        `/設置等級曲線` - 設置伺服器的等級曲線（管理員）
+        `/設置聊天經驗` - 設置聊天獲得經驗值（管理員）
+        `/設置語音收入` - 設置語音頻道每分鐘收入（管理員）
         `/增加經驗值` - 為角色增加經驗值（管理員）
         """,
         inline=False
     )
     
+    embed.add_field(
+        name="🎽 裝備系統",
+        value="""
+        `/設置裝備屬性` - 把商品設為裝備並設置屬性（商店擁有者）
+        `/裝備` - 從背包穿上裝備
+        `/卸下` - 卸下裝備並放回背包
+        """,
+        inline=False
+    )
+    
+    embed.add_field(
+        name="⚔️ 戰鬥系統",
+        value="""
+        `/討伐` - 挑戰怪物獲得經驗值
+        `/決鬥` - 與其他玩家的角色決鬥
+        `/戰鬥模擬` - 批量模擬戰鬥平衡數值（管理員）
+        """,
+        inline=False
+    )
+    
     embed.add_field(
         name="💰 經濟系統",
         value="""
         `/簽到` - 每日簽到（支持多種貨幣獨立簽到）
         `/贈送金幣` - 贈送金幣給其他玩家
+        `/交易紀錄` - 查看金錢的收支紀錄
+        `/排行榜` - 查看貨幣的富豪排行榜
+        `/等級排行榜` `/簽到排行榜` - 查看等級和連續簽到排行榜
         `/設置簽到收入` - 設置身份組收入（管理員）
         `/收入身份組列表` - 查看收入身份組
+        `/設置定時收入` - 身份組收入定時自動發放（管理員）
+        `/經濟統計` - 查看貨幣流通量和財富分布（管理員）
+        `/快取統計` - 查看數據快取命中率（管理員）
+        `/兌換` `/匯率列表` - 貨幣兌換
+        `/設置匯率` `/建立兌換池` - 設置固定匯率或自動做市兌換池（管理員）
         `/添加金錢` - 給玩家添加金錢（管理員）
         `/移除金錢` - 移除玩家金錢（管理員）
         `/查看餘額` - 查看玩家餘額（管理員）
+        `/批量添加金錢` `/批量移除金錢` `/批量增加經驗值` - 批量發放給身份組或多位玩家（管理員）
         """,
         inline=False
     )
@@ -2610,6 +5459,7 @@ async def help_command(interaction: discord.Interaction):
         value="""
         `/添加管理員` - 設置機器人管理員（需Discord管理員）
         `/移除管理員` - 移除機器人管理員（需Discord管理員）
+        `/添加管理員身份組` `/移除管理員身份組` - 按身份組設置管理員（需Discord管理員）
         `/管理員列表` - 查看所有機器人管理員
         """,
         inline=False
@@ -2619,16 +5469,207 @@ async def help_command(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+# ==================== 背景預熱 ====================
+
+# 預熱任務（保留引用避免被回收）
+warm_up_task = None
+
+async def warm_up_caches():
+    """連線後在背景按優先順序預熱快取，不延遲機器人上線
+    
+    1. 所有伺服器的設置快取（管理員、等級曲線、匯率矩陣）
+    2. 按成員數由多到少逐個伺服器載入用戶、角色、商店、簽到分片，並建立排行榜和載入帳本
+    
+    預熱期間收到的請求直接按需載入自己需要的分片，不需要等待預熱完成。
+    """
+    await bot.wait_until_ready()
+    started = datetime.now()
+    guilds = get_guilds()
+    live_guilds = [
+        str(guild.id)
+        for guild in sorted(bot.guilds, key=lambda g: g.member_count or 0, reverse=True)
+        if str(guild.id) in guilds
+    ]
+    
+    for guild_id in live_guilds:
+        get_admin_sets(guild_id)
+        get_level_table(guild_id, guilds)
+        exchange.get_matrix(guild_id, guilds[guild_id].get('exchange'))
+    await asyncio.sleep(0)
+    
+    warmed = 0
+    for guild_id in live_guilds:
+        loaded = [store.preload(guild_id) for store in (user_store, character_store, shop_store, checkin_store)]
+        if not all(loaded):
+            # 快取已滿，其餘伺服器在使用時才載入
+            break
+        if guild_id not in exp_leaderboards:
+            build_ranking_index(guild_id)
+        get_guild_ledger(guild_id)
+        warmed += 1
+        await asyncio.sleep(0)
+    
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f'🔥 已預熱 {warmed}/{len(live_guilds)} 個伺服器的數據（{elapsed:.1f} 秒）')
+
+# ==================== 指令同步 ====================
+
+def command_tree_hash() -> str:
+    """斜線指令定義的雜湊值（指令、參數、描述任何變更都會改變）"""
+    payload = sorted((command.to_dict() for command in bot.tree.get_commands()), key=lambda c: c['name'])
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+async def sync_command_tree():
+    """只在指令定義變更（或換了機器人帳號）時同步斜線指令"""
+    tree_hash = command_tree_hash()
+    application_id = str(bot.application_id)
+    synced = load_json(COMMAND_SYNC_FILE, {})
+    if synced.get('hash') == tree_hash and synced.get('application_id') == application_id:
+        print('✅ 斜線指令沒有變更，跳過同步')
+        return
+    try:
+        commands_synced = await bot.tree.sync()
+    except Exception as e:
+        print(f'❌ 同步指令時出錯: {e}')
+        return
+    save_json(COMMAND_SYNC_FILE, {'hash': tree_hash, 'application_id': application_id})
+    print(f'✅ 同步了 {len(commands_synced)} 個斜線指令')
+
 # ==================== 事件處理 ====================
 
+@bot.event
+async def setup_hook():
+    global warm_up_task
+    # 數據在連線後於背景預熱，不阻塞登入
+    warm_up_task = asyncio.create_task(warm_up_caches())
+    flush_activity.start()
+    pay_passive_income.start()
+    sweep_tombstones.start()
+    archive_departed_guilds.start()
+    # setup_hook 每個進程只執行一次，重新連線觸發的 on_ready 不會重複同步
+    await sync_command_tree()
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    # 持久化按鈕和選單（斜線指令由指令樹處理）
+    await route_component(interaction)
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    guild_id = str(guild.id)
+    if not restore_archived_guild(guild_id):
+        # 寬限期內重新加入，數據還在
+        guilds = get_guilds()
+        if guilds.get(guild_id, {}).pop('left_at', None) is not None:
+            save_guilds(guilds)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    # 只記錄離開時間，超過寬限期後才歸檔
+    guilds = get_guilds()
+    guild_id = str(guild.id)
+    if guild_id in guilds:
+        guilds[guild_id]['left_at'] = datetime.now().timestamp()
+        save_guilds(guilds)
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    if member.bot:
+        return
+    guild_id = str(member.guild.id)
+    user_id = str(member.id)
+    was_earning = voice_tracker.is_active(guild_id, user_id)
+    earning = is_voice_earning(after)
+    
+    # 只記錄會話開始/結束時間，時長在離開或定期結算時才計算
+    if earning and not was_earning:
+        voice_tracker.join(guild_id, user_id, after.channel.id)
+    elif was_earning and not earning:
+        voice_tracker.leave(guild_id, user_id)
+
+@bot.event
+async def on_message(message: discord.Message):
+    if message.author.bot or message.guild is None:
+        return
+    # 只在記憶體中記錄，不讀寫文件（是否啟用使用快取的設置）
+    guild_id = str(message.guild.id)
+    if is_message_exp_enabled(guild_id):
+        message_xp_tracker.record(guild_id, str(message.author.id), message.channel.id)
+    await bot.process_commands(message)
+
 @bot.event
 async def on_ready():
     print(f'✅ 機器人已登入為 {bot.user}')
+    
+    # 記錄啟動時已在語音頻道中的用戶（重複調用不會重置會話）
+    for guild in bot.guilds:
+        for channel in guild.voice_channels:
+            for member in channel.members:
+                if not member.bot and is_voice_earning(member.voice):
+                    voice_tracker.join(str(guild.id), str(member.id), channel.id)
+
+# ==================== 關閉流程 ====================
+
+# 關閉時等待執行中的互動完成的最長秒數
+SHUTDOWN_DRAIN_SECONDS = 10
+
+def flush_pending_state():
+    """把記憶體中尚未寫入的狀態全部保存（活動獎勵、帳本檢查點）"""
+    # 結算進行中的語音會話（重新啟動後 on_ready 會重新開始計時）
+    voice_tracker.checkpoint()
+    message_pending = message_xp_tracker.drain()
+    voice_minutes = voice_tracker.drain()
+    if message_pending or voice_minutes:
+        try:
+            apply_activity_rewards(message_pending, voice_minutes)
+        except Exception as e:
+            print(f'❌ 寫入活動獎勵時出錯: {e}')
+    ledger_book.checkpoint_all()
+
+async def graceful_shutdown(reason: str):
+    """停止接受互動，在期限內等待執行中的互動完成後關閉連線（由 main 在連線關閉後保存狀態）"""
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    print(f'🛑 收到 {reason}，開始關閉...')
+    
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_DRAIN_SECONDS
+    while in_flight_total() and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.1)
+    if in_flight_total():
+        print(f'⚠️ 仍有 {in_flight_total()} 個互動未完成，不再等待')
+    
+    # 定時收入發放計入執行中的互動，上面已等待它在分組之間停下（進度已保存，下次啟動時繼續）；
+    # 其他定時任務只在唯讀的掃描階段讓出事件循環，寫入階段不會被取消打斷
+    for loop_task in (flush_activity, pay_passive_income, sweep_tombstones, archive_departed_guilds):
+        loop_task.cancel()
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    
+    # 先關閉連線，之後不會再收到訊息和語音事件，保存的狀態不會再增加
+    await bot.close()
+
+async def main(token: str):
+    discord.utils.setup_logging()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(graceful_shutdown(sig.name)))
+        except NotImplementedError:
+            # Windows 不支援，按 Ctrl+C 時由下方的 finally 保存
+            pass
     try:
-        synced = await bot.tree.sync()
-        print(f'✅ 同步了 {len(synced)} 個斜線指令')
-    except Exception as e:
-        print(f'❌ 同步指令時出錯: {e}')
+        async with bot:
+            await bot.start(token)
+    finally:
+        # 連線已關閉；先讓已派發的事件處理完再保存
+        try:
+            await asyncio.sleep(0)
+        finally:
+            flush_pending_state()
+            print('💾 已保存所有數據')
 
 # ==================== 啟動機器人 ====================
 
@@ -2637,4 +5678,7 @@ if __name__ == "__main__":
     if not TOKEN:
         print("❌ 錯誤: 請設置 DISCORD_TOKEN 環境變數")
     else:
-        bot.run(TOKEN)
\ No newline at end of file
+        try:
+            asyncio.run(main(TOKEN))
+        except KeyboardInterrupt:
+            pass
\ No newline at end of file
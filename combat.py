@@ -0,0 +1,186 @@
+"""戰鬥模組
+
+使用角色卡的 HP、攻擊力、防禦力進行回合制戰鬥。
+相同的種子總是得到相同的結果，方便重播和平衡測試。
+
+批量模擬器把所有場次的狀態存放在陣列中，逐回合推進，
+用於大量模擬（平衡數值），可直接執行本文件測試每秒場數：
+
+    python combat.py
+"""
+import random
+import time
+from array import array
+from typing import Dict, List, Optional
+
+# 每場戰鬥的最大回合數（超過則平手）
+MAX_ROUNDS = 50
+
+# 傷害浮動範圍（±10%）
+DAMAGE_VARIANCE = 0.1
+
+# 暴擊機率和倍率
+CRIT_CHANCE = 0.1
+CRIT_MULTIPLIER = 1.5
+
+# 怪物列表
+MONSTERS: Dict[str, dict] = {
+    'slime': {'name': '史萊姆', 'emoji': '🟢', 'hp': 60, 'attack': 10, 'defense': 2, 'exp': 20},
+    'goblin': {'name': '哥布林', 'emoji': '👺', 'hp': 90, 'attack': 16, 'defense': 6, 'exp': 45},
+    'wolf': {'name': '野狼', 'emoji': '🐺', 'hp': 120, 'attack': 22, 'defense': 8, 'exp': 80},
+    'orc': {'name': '獸人戰士', 'emoji': '👹', 'hp': 220, 'attack': 30, 'defense': 15, 'exp': 160},
+    'golem': {'name': '石像魔', 'emoji': '🗿', 'hp': 400, 'attack': 35, 'defense': 35, 'exp': 320},
+    'dragon': {'name': '遠古巨龍', 'emoji': '🐉', 'hp': 1200, 'attack': 80, 'defense': 50, 'exp': 1500},
+}
+
+
+class Combatant:
+    """參與戰鬥的一方"""
+
+    __slots__ = ('name', 'hp', 'max_hp', 'attack', 'defense')
+
+    def __init__(self, name: str, hp: int, max_hp: int, attack: int, defense: int):
+        self.name = name
+        self.hp = max(0, hp)
+        self.max_hp = max(1, max_hp)
+        self.attack = max(0, attack)
+        self.defense = max(0, defense)
+
+    @classmethod
+    def from_character(cls, char: dict, hp: Optional[int] = None) -> 'Combatant':
+        """從角色數據創建（不指定 HP 時為滿血），有裝備時使用快取的衍生屬性"""
+        stats = char.get('derived_stats') or char
+        if hp is None:
+            hp = stats['max_hp']
+        return cls(char['name'], hp, stats['max_hp'], stats['attack'], stats['defense'])
+
+    @classmethod
+    def from_monster(cls, monster_id: str) -> 'Combatant':
+        monster = MONSTERS[monster_id]
+        return cls(monster['name'], monster['hp'], monster['hp'], monster['attack'], monster['defense'])
+
+
+def roll_damage(rng: random.Random, attack: int, defense: int) -> tuple:
+    """計算一次攻擊的傷害，返回 (傷害, 是否暴擊)"""
+    variance = 1 + (rng.random() * 2 - 1) * DAMAGE_VARIANCE
+    damage = attack * variance - defense * 0.5
+    crit = rng.random() < CRIT_CHANCE
+    if crit:
+        damage *= CRIT_MULTIPLIER
+    return max(1, int(damage)), crit
+
+
+def fight(a: Combatant, b: Combatant, seed: Optional[int] = None, log_limit: int = 20) -> dict:
+    """單場戰鬥（a 先攻），不修改傳入的 Combatant
+
+    返回 {'winner': 'a' | 'b' | None, 'rounds', 'a_hp', 'b_hp', 'log'}
+    """
+    rng = random.Random(seed)
+    hp = [a.hp, b.hp]
+    fighters = (a, b)
+    log: List[str] = []
+    rounds = 0
+    winner = None
+
+    while rounds < MAX_ROUNDS and winner is None:
+        rounds += 1
+        for attacker_idx in (0, 1):
+            defender_idx = 1 - attacker_idx
+            attacker = fighters[attacker_idx]
+            defender = fighters[defender_idx]
+            damage, crit = roll_damage(rng, attacker.attack, defender.defense)
+            hp[defender_idx] = max(0, hp[defender_idx] - damage)
+            if len(log) < log_limit:
+                crit_text = "💥暴擊！" if crit else ""
+                log.append(f"R{rounds} {attacker.name} → {defender.name} {crit_text}{damage} 傷害（剩 {hp[defender_idx]}）")
+            if hp[defender_idx] == 0:
+                winner = 'a' if attacker_idx == 0 else 'b'
+                break
+
+    return {
+        'winner': winner,
+        'rounds': rounds,
+        'a_hp': hp[0],
+        'b_hp': hp[1],
+        'log': log
+    }
+
+
+def simulate_batch(a: Combatant, b: Combatant, fights: int, seed: int = 0) -> dict:
+    """批量模擬多場戰鬥（陣列存放每場的血量，逐回合推進所有未結束的場次）
+
+    返回 {'fights', 'a_wins', 'b_wins', 'draws', 'avg_rounds', 'a_win_rate'}
+    """
+    rng = random.Random(seed)
+    rand = rng.random
+    a_hp = array('i', [a.hp]) * fights
+    b_hp = array('i', [b.hp]) * fights
+    ended_round = array('i', [0]) * fights
+    active = list(range(fights))
+
+    # 預先計算雙方的傷害參數
+    a_base = a.attack
+    a_def_cut = b.defense * 0.5
+    b_base = b.attack
+    b_def_cut = a.defense * 0.5
+    spread = DAMAGE_VARIANCE * 2
+    low = 1 - DAMAGE_VARIANCE
+
+    a_wins = b_wins = 0
+    rounds = 0
+    while active and rounds < MAX_ROUNDS:
+        rounds += 1
+        still_active = []
+        for i in active:
+            # a 攻擊
+            damage = a_base * (low + rand() * spread) - a_def_cut
+            if rand() < CRIT_CHANCE:
+                damage *= CRIT_MULTIPLIER
+            hp = b_hp[i] - max(1, int(damage))
+            if hp <= 0:
+                b_hp[i] = 0
+                ended_round[i] = rounds
+                a_wins += 1
+                continue
+            b_hp[i] = hp
+            # b 攻擊
+            damage = b_base * (low + rand() * spread) - b_def_cut
+            if rand() < CRIT_CHANCE:
+                damage *= CRIT_MULTIPLIER
+            hp = a_hp[i] - max(1, int(damage))
+            if hp <= 0:
+                a_hp[i] = 0
+                ended_round[i] = rounds
+                b_wins += 1
+                continue
+            a_hp[i] = hp
+            still_active.append(i)
+        active = still_active
+
+    for i in active:
+        ended_round[i] = MAX_ROUNDS
+    draws = len(active)
+
+    return {
+        'fights': fights,
+        'a_wins': a_wins,
+        'b_wins': b_wins,
+        'draws': draws,
+        'avg_rounds': sum(ended_round) / fights if fights else 0,
+        'a_win_rate': a_wins / fights if fights else 0
+    }
+
+
+def benchmark(fights: int = 20000, seed: int = 0) -> float:
+    """測試批量模擬的速度，返回每秒場數"""
+    hero = Combatant('勇者', 150, 150, 25, 12)
+    monster = Combatant.from_monster('wolf')
+    start = time.perf_counter()
+    simulate_batch(hero, monster, fights, seed)
+    elapsed = time.perf_counter() - start
+    return fights / elapsed if elapsed > 0 else float('inf')
+
+
+if __name__ == "__main__":
+    rate = benchmark()
+    print(f"⚔️ 批量模擬: {rate:,.0f} 場/秒")
@@ -0,0 +1,341 @@
+"""分片數據存儲模組
+
+用戶、角色、商店和簽到數據按伺服器分片存放（data/<名稱>/<guild_id>.json），
+只有被訪問到的伺服器分片才會載入記憶體。已載入的分片放在 LRU 快取中，
+快取的總記錄數超過上限時淘汰最久未使用的分片，之後需要時再從磁碟載入，
+所以記憶體用量只取決於活躍的伺服器，不隨加入的伺服器數量增長。
+
+get() 返回整個數據集的映射視圖（按鍵讀寫的用法和原本的字典相同）:
+按鍵訪問時才載入該鍵所屬伺服器的分片，讀取記錄時得到的是副本，
+未保存的修改不會影響快取或其他視圖。save() 只寫回這個視圖修改過的記錄；
+如果這些記錄在讀取後已被其他視圖保存過，拋出 StaleWriteError，不覆蓋較新的數據。
+視圖不支持遍歷整個數據集（會載入所有分片），需要時按伺服器使用 guild()。
+"""
+import copy
+import json
+import os
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 每個數據集快取的默認記錄數上限（可用環境變數 DATA_CACHE_MAX_RECORDS 設置）
+DEFAULT_MAX_RECORDS = 20000
+
+ShardOf = Callable[[str], Optional[str]]
+
+# 視圖中已刪除的記錄
+_DELETED = object()
+
+
+class StaleWriteError(Exception):
+    """要保存的記錄在讀取後已被其他視圖修改"""
+
+    def __init__(self, guild_id: str, keys: List[str]):
+        self.guild_id = guild_id
+        self.keys = keys
+        super().__init__(f"伺服器 {guild_id} 的記錄已被修改: {', '.join(keys[:5])}")
+
+
+def guild_prefix_shard(key: str) -> Optional[str]:
+    """鍵格式為 {guild_id}_... 的數據集（用戶、商店、簽到）"""
+    if not isinstance(key, str):
+        return None
+    guild_id, sep, _ = key.partition('_')
+    return guild_id if sep and guild_id else None
+
+
+def character_shard(key: str) -> Optional[str]:
+    """角色的鍵格式為 char_{guild_id}_{user_id}"""
+    if not isinstance(key, str) or not key.startswith('char_'):
+        return None
+    return guild_prefix_shard(key[5:])
+
+
+class ShardedStore:
+    """按伺服器分片、以 LRU 快取已載入分片的數據集"""
+
+    def __init__(self, directory: str, shard_of: ShardOf,
+                 max_records: int = DEFAULT_MAX_RECORDS, legacy_file: Optional[str] = None):
+        self.directory = directory
+        self.shard_of = shard_of
+        self.max_records = max_records
+        # {guild_id: {鍵: 記錄}}
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._cached_records = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        if legacy_file:
+            self._migrate(legacy_file)
+
+    def _path(self, guild_id: str) -> str:
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def _migrate(self, legacy_file: str):
+        """把舊的單一 JSON 文件拆分成伺服器分片（只執行一次）"""
+        if not os.path.exists(legacy_file):
+            return
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        shards: Dict[str, dict] = {}
+        for key, record in records.items():
+            guild_id = self.shard_of(key)
+            if guild_id is None:
+                print(f"⚠️ 無法判斷 {key} 所屬的伺服器，已跳過")
+                continue
+            shards.setdefault(guild_id, {})[key] = record
+        for guild_id, shard in shards.items():
+            existing = self._read(guild_id)
+            existing.update(shard)
+            self._write(guild_id, existing)
+        os.replace(legacy_file, legacy_file + ".migrated")
+
+    def _read(self, guild_id: str) -> dict:
+        path = self._path(guild_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write(self, guild_id: str, records: dict):
+        path = self._path(guild_id)
+        if not records:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _put(self, guild_id: str, records: dict):
+        old = self._cache.pop(guild_id, None)
+        if old is not None:
+            self._cached_records -= len(old)
+        self._cache[guild_id] = records
+        self._cached_records += len(records)
+        # 至少保留剛放入的分片
+        while self._cached_records > self.max_records and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_records -= len(evicted)
+            self.evictions += 1
+
+    def shard(self, guild_id: str) -> dict:
+        """獲取快取中的伺服器分片（不在快取中時從磁碟載入）
+
+        返回的字典只能讀取；保存時整個分片會被替換，不會原地修改。
+        """
+        records = self._cache.get(guild_id)
+        if records is not None:
+            self.hits += 1
+            self._cache.move_to_end(guild_id)
+            return records
+        self.misses += 1
+        records = self._read(guild_id)
+        self._put(guild_id, records)
+        return records
+
+    def _current(self, guild_id: str) -> dict:
+        """視圖讀取用的最新分片（不計入命中統計）"""
+        records = self._cache.get(guild_id)
+        if records is None:
+            records = self._read(guild_id)
+            self._put(guild_id, records)
+        return records
+
+    def preload(self, guild_id: str) -> bool:
+        """預先載入分片（不計入命中統計），快取放不下時不載入，返回分片是否在快取中
+
+        預熱按優先順序進行，放不下時停止可以避免淘汰先前載入的更重要的分片。
+        """
+        if guild_id in self._cache:
+            return True
+        records = self._read(guild_id)
+        if self._cache and self._cached_records + len(records) > self.max_records:
+            return False
+        self._put(guild_id, records)
+        return True
+
+    def guild_ids(self) -> set:
+        """所有有數據的伺服器（磁碟上的分片和快取中的分片）"""
+        ids = set(self._cache)
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                ids.add(name[:-5])
+        return ids
+
+    def get(self) -> 'StoreView':
+        return StoreView(self)
+
+    def save(self, view: 'StoreView'):
+        """寫回視圖修改過的記錄（沒有修改的分片不寫入）
+
+        先檢查所有分片，有記錄在讀取後被其他視圖保存過時拋出 StaleWriteError，不寫入任何分片。
+        """
+        pending = []
+        for guild_id, records in view.shards.items():
+            changes = records.changes()
+            if not changes:
+                continue
+            current = self._current(guild_id)
+            stale = [key for key, _, original in changes if current.get(key) != original]
+            if stale:
+                raise StaleWriteError(guild_id, stale)
+            pending.append((guild_id, records, changes, current))
+
+        for guild_id, records, changes, current in pending:
+            updated = dict(current)
+            for key, value, _ in changes:
+                if value is _DELETED:
+                    updated.pop(key, None)
+                else:
+                    updated[key] = copy.deepcopy(value)
+            self._write(guild_id, updated)
+            self._put(guild_id, updated)
+            records.saved(updated)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'cached_shards': len(self._cache),
+            'cached_records': self._cached_records,
+            'max_records': self.max_records
+        }
+
+
+class GuildRecords(MutableMapping):
+    """一個伺服器分片的視圖: 讀取記錄時複製，修改只保存在視圖中，直到 ShardedStore.save()
+
+    尚未訪問的記錄從快取中的最新分片讀取，其他視圖先保存的新記錄也能看到。
+    """
+
+    def __init__(self, store: ShardedStore, guild_id: str):
+        self._store = store
+        self._guild_id = guild_id
+        # 視圖中的記錄副本 {鍵: 記錄或 _DELETED}
+        self._local: Dict[str, object] = {}
+        # 首次訪問時快取中的記錄（不存在時為 None），保存時用來檢查是否被其他視圖修改
+        self._original: Dict[str, object] = {}
+
+    @property
+    def _base(self) -> dict:
+        return self._store._current(self._guild_id)
+
+    def _touch(self, key: str):
+        if key not in self._original:
+            self._original[key] = self._base.get(key)
+
+    def __getitem__(self, key: str):
+        if key in self._local:
+            value = self._local[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        value = copy.deepcopy(self._base[key])
+        self._touch(key)
+        self._local[key] = value
+        return value
+
+    def __setitem__(self, key: str, value):
+        self._touch(key)
+        self._local[key] = value
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._touch(key)
+        self._local[key] = _DELETED
+
+    def __contains__(self, key) -> bool:
+        if key in self._local:
+            return self._local[key] is not _DELETED
+        return key in self._base
+
+    def __iter__(self) -> Iterator[str]:
+        base = self._base
+        keys = [key for key in base if self._local.get(key) is not _DELETED]
+        keys += [key for key, value in self._local.items() if value is not _DELETED and key not in base]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def clear(self):
+        # MutableMapping.clear() 逐個 popitem，每次都重新列出所有鍵
+        for key in list(self):
+            self._touch(key)
+            self._local[key] = _DELETED
+
+    def changes(self) -> List[Tuple[str, object, object]]:
+        """修改過的記錄 [(鍵, 新記錄或 _DELETED, 讀取時的記錄)]"""
+        changes = []
+        for key, value in self._local.items():
+            original = self._original[key]
+            if value is _DELETED:
+                if original is not None:
+                    changes.append((key, value, original))
+            elif value != original:
+                changes.append((key, value, original))
+        return changes
+
+    def saved(self, base: dict):
+        """保存後以寫入的分片為基準（視圖中的副本繼續有效）"""
+        self._original = {key: base.get(key) for key in self._local}
+
+
+class StoreView(MutableMapping):
+    """整個數據集的映射視圖，按需載入伺服器分片
+
+    只支持按鍵讀寫；遍歷和計數會載入所有分片，因此直接拋出 TypeError。
+    """
+
+    def __init__(self, store: ShardedStore):
+        self.store = store
+        # 這個視圖訪問過的分片 {guild_id: 分片視圖}
+        self.shards: Dict[str, GuildRecords] = {}
+
+    def guild(self, guild_id: str) -> GuildRecords:
+        """伺服器的所有記錄（可直接修改，保存視圖時寫回）"""
+        records = self.shards.get(guild_id)
+        if records is None:
+            self.store.shard(guild_id)
+            records = GuildRecords(self.store, guild_id)
+            self.shards[guild_id] = records
+        return records
+
+    def __getitem__(self, key: str):
+        guild_id = self.store.shard_of(key)
+        if guild_id is None:
+            raise KeyError(key)
+        return self.guild(guild_id)[key]
+
+    def __setitem__(self, key: str, value):
+        guild_id = self.store.shard_of(key)
+        if guild_id is None:
+            raise ValueError(f"無法判斷 {key} 所屬的伺服器")
+        self.guild(guild_id)[key] = value
+
+    def __delitem__(self, key: str):
+        guild_id = self.store.shard_of(key)
+        if guild_id is None:
+            raise KeyError(key)
+        del self.guild(guild_id)[key]
+
+    def __contains__(self, key) -> bool:
+        guild_id = self.store.shard_of(key)
+        return guild_id is not None and key in self.guild(guild_id)
+
+    def __bool__(self) -> bool:
+        # 不能用 __len__ 判斷（不支持計數），視圖本身總是有效的
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        raise TypeError("數據集視圖不支持遍歷，請使用 guild() 按伺服器訪問")
+
+    def __len__(self) -> int:
+        raise TypeError("數據集視圖不支持計數，請使用 guild() 按伺服器訪問")
@@ -0,0 +1,91 @@
+"""裝備模組
+
+角色有武器、防具、飾品三個裝備欄位，裝備的屬性加成與角色基礎屬性合併成衍生屬性。
+衍生屬性快取在角色數據的 derived_stats 中，只在穿脫裝備或商品目錄變更時重新計算，
+角色卡和戰鬥直接讀取快取。
+"""
+from typing import Optional
+
+# 裝備欄位
+SLOTS = {
+    'weapon': '⚔️ 武器',
+    'armor': '🛡️ 防具',
+    'accessory': '💍 飾品'
+}
+
+# 裝備可加成的屬性
+STAT_KEYS = ('attack', 'defense', 'max_hp', 'max_mp')
+
+STAT_NAMES = {
+    'attack': '攻擊力',
+    'defense': '防禦力',
+    'max_hp': '生命上限',
+    'max_mp': '魔力上限'
+}
+
+
+def item_stats(item: dict) -> dict:
+    """商品的屬性加成（只保留非零的屬性）"""
+    stats = item.get('stats') or {}
+    return {key: int(stats[key]) for key in STAT_KEYS if stats.get(key)}
+
+
+def compute_stats(char: dict) -> dict:
+    """基礎屬性加上所有裝備加成"""
+    derived = {key: char[key] for key in STAT_KEYS}
+    for entry in (char.get('equipment') or {}).values():
+        for key, value in entry.get('stats', {}).items():
+            if key in derived:
+                derived[key] += value
+    derived['max_hp'] = max(1, derived['max_hp'])
+    derived['max_mp'] = max(1, derived['max_mp'])
+    derived['attack'] = max(0, derived['attack'])
+    derived['defense'] = max(0, derived['defense'])
+    return derived
+
+
+def refresh_stats(char: dict, catalog_version: int) -> dict:
+    """重新計算並快取衍生屬性"""
+    derived = compute_stats(char)
+    derived['catalog_version'] = catalog_version
+    char['derived_stats'] = derived
+    return derived
+
+
+def cached_stats(char: dict, catalog_version: int) -> Optional[dict]:
+    """快取仍然有效時返回衍生屬性，否則返回 None"""
+    derived = char.get('derived_stats')
+    if derived is not None and derived.get('catalog_version') == catalog_version:
+        return derived
+    return None
+
+
+def stats_of(char: dict) -> dict:
+    """戰鬥和顯示使用的屬性（有快取時用快取，沒有裝備系統數據時用基礎屬性）"""
+    return char.get('derived_stats') or char
+
+
+def equip(char: dict, slot: str, entry: dict, catalog_version: int) -> Optional[dict]:
+    """穿上裝備，返回被替換下來的裝備（如有）"""
+    if slot not in SLOTS:
+        raise ValueError(f"未知的裝備欄位: {slot}")
+    equipment = char.setdefault('equipment', {})
+    previous = equipment.get(slot)
+    equipment[slot] = entry
+    refresh_stats(char, catalog_version)
+    return previous
+
+
+def unequip(char: dict, slot: str, catalog_version: int) -> Optional[dict]:
+    """卸下裝備，返回卸下的裝備（欄位為空時返回 None）"""
+    equipment = char.get('equipment') or {}
+    previous = equipment.pop(slot, None)
+    if previous is not None:
+        refresh_stats(char, catalog_version)
+    return previous
+
+
+def format_stats(stats: dict) -> str:
+    """屬性加成的顯示文字，例如: 攻擊力+5 防禦力-2"""
+    parts = [f"{STAT_NAMES[key]}{value:+d}" for key, value in stats.items() if key in STAT_NAMES and value]
+    return " ".join(parts) or "無屬性加成"
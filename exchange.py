@@ -0,0 +1,147 @@
+"""貨幣兌換模組
+
+兩種兌換方式:
+- 固定匯率: 管理員設置 1 單位來源貨幣可換多少目標貨幣（未設置反向匯率時自動使用倒數）
+- 兌換池: 恆定乘積做市（儲備A × 儲備B 不變），兌換越多價格越差，儲備存放在帳本的兌換池帳戶
+
+固定匯率編譯成匯率矩陣並按設置版本快取，查詢為 O(1)。
+可直接執行本文件測試每秒可完成的兌換次數（報價並寫入臨時帳本）:
+
+    python exchange.py
+"""
+import random
+import time
+from typing import Dict, Optional, Tuple
+
+# 兌換池的默認手續費（0.3%）
+DEFAULT_POOL_FEE = 0.003
+
+# 兌換池手續費上限
+MAX_POOL_FEE = 0.1
+
+
+def rate_key(from_currency: str, to_currency: str) -> str:
+    """固定匯率的鍵（有方向）"""
+    return f"{from_currency}>{to_currency}"
+
+
+def pool_key(currency_a: str, currency_b: str) -> str:
+    """兌換池的鍵（與方向無關）"""
+    return "|".join(sorted((currency_a, currency_b)))
+
+
+class RateMatrix:
+    """固定匯率矩陣 {(來源, 目標): 匯率}"""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self._rates: Dict[Tuple[str, str], float] = {}
+        explicit = {}
+        for key, rate in (rates or {}).items():
+            from_currency, _, to_currency = key.partition('>')
+            if rate > 0 and from_currency and to_currency:
+                explicit[(from_currency, to_currency)] = rate
+        for (from_currency, to_currency), rate in explicit.items():
+            self._rates[(from_currency, to_currency)] = rate
+            # 沒有單獨設置反向匯率時使用倒數
+            if (to_currency, from_currency) not in explicit:
+                self._rates[(to_currency, from_currency)] = 1 / rate
+
+    def get(self, from_currency: str, to_currency: str) -> Optional[float]:
+        return self._rates.get((from_currency, to_currency))
+
+    def items(self):
+        return self._rates.items()
+
+    def __len__(self):
+        return len(self._rates)
+
+
+# 伺服器匯率矩陣快取 {guild_id: (設置版本, RateMatrix)}
+_guild_matrices: Dict[str, Tuple[int, RateMatrix]] = {}
+
+
+def get_matrix(guild_id: str, config: Optional[dict] = None) -> RateMatrix:
+    """獲取伺服器的匯率矩陣，只有設置版本變更時才重新編譯"""
+    config = config or {}
+    version = config.get('version', 0)
+    cached = _guild_matrices.get(guild_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    matrix = RateMatrix(config.get('rates'))
+    _guild_matrices[guild_id] = (version, matrix)
+    return matrix
+
+
+def invalidate(guild_id: str):
+    """清除伺服器的匯率矩陣快取"""
+    _guild_matrices.pop(guild_id, None)
+
+
+def quote_fixed(amount: int, rate: float) -> int:
+    """按固定匯率兌換可得的數量（向下取整）"""
+    return int(amount * rate)
+
+
+def quote_pool(amount_in: int, reserve_in: int, reserve_out: int, fee: float = DEFAULT_POOL_FEE) -> int:
+    """兌換池可得的數量（扣除手續費後按恆定乘積計算，向下取整）"""
+    if amount_in <= 0 or reserve_in <= 0 or reserve_out <= 0:
+        return 0
+    effective_in = amount_in * (1 - fee)
+    return int(reserve_out * effective_in / (reserve_in + effective_in))
+
+
+def spot_price(reserve_in: int, reserve_out: int) -> float:
+    """兌換池當前的邊際價格（1 單位來源貨幣約可換多少目標貨幣）"""
+    if reserve_in <= 0:
+        return 0.0
+    return reserve_out / reserve_in
+
+
+def benchmark(conversions: int = 20000, currencies: int = 20, users: int = 1000, seed: int = 0) -> float:
+    """測試完整兌換（報價並寫入臨時帳本）的速度，返回每秒兌換次數
+
+    和 /兌換 指令相同: 偶數次使用兌換池（儲備從帳本讀取），奇數次使用固定匯率，
+    每次兌換作為一筆帶冪等鍵的交易寫入帳本。相同貨幣的組合不計入兌換次數。
+    """
+    import tempfile
+    import ledger
+
+    rng = random.Random(seed)
+    names = [f"c{i}" for i in range(currencies)]
+    rates = {rate_key(a, b): rng.uniform(0.1, 10) for a in names for b in names if a < b}
+    matrix = get_matrix("benchmark", {'version': 1, 'rates': rates})
+    pairs = [pair for pair in ((rng.choice(names), rng.choice(names)) for _ in range(1024)) if pair[0] != pair[1]]
+    accounts = [ledger.user_account(f"u{i}") for i in range(users)]
+    exchange_account = ledger.system_account('exchange')
+
+    with tempfile.TemporaryDirectory() as directory:
+        book = ledger.GuildLedger(directory)
+        # 開始前給玩家和兌換池足夠的餘額
+        for name in names:
+            entries = [(account, name, 10 ** 9) for account in accounts]
+            entries += [(ledger.pool_account(pool_key(name, other)), name, 10 ** 9) for other in names if other != name]
+            entries.append((ledger.system_account('benchmark'), name, -sum(amount for _, _, amount in entries)))
+            book.post('benchmark', entries)
+
+        start = time.perf_counter()
+        for i in range(conversions):
+            from_currency, to_currency = pairs[i % len(pairs)]
+            if i & 1:
+                received = quote_fixed(100, matrix.get(from_currency, to_currency))
+                counterparty = exchange_account
+            else:
+                counterparty = ledger.pool_account(pool_key(from_currency, to_currency))
+                received = quote_pool(100, book.balance(counterparty, from_currency), book.balance(counterparty, to_currency))
+            account = accounts[i % len(accounts)]
+            book.post('exchange', [
+                (account, from_currency, -100), (account, to_currency, received),
+                (counterparty, from_currency, 100), (counterparty, to_currency, -received)
+            ], key=f"benchmark:{i}")
+        elapsed = time.perf_counter() - start
+    invalidate("benchmark")
+    return conversions / elapsed if elapsed > 0 else float('inf')
+
+
+if __name__ == "__main__":
+    rate = benchmark()
+    print(f"💱 貨幣兌換: {rate:,.0f} 次/秒")
@@ -0,0 +1,66 @@
+"""排行榜模組
+
+以排序列表保存 (-分數, 鍵)，更新和名次查詢使用二分搜尋，
+分頁查詢直接切片，不需要每次重新排序所有玩家。
+同分時按鍵排序，名次穩定。
+"""
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class Leaderboard:
+    """按分數由高到低排列的排行榜"""
+
+    def __init__(self, items: Iterable[Tuple[str, int]] = (), keep_zero: bool = False):
+        # 分數為0（或以下）的項目默認不上榜
+        self.keep_zero = keep_zero
+        self._scores: Dict[str, int] = {}
+        for key, score in items:
+            if self._eligible(score):
+                self._scores[key] = score
+        # 初始數據一次排序
+        self._entries: List[Tuple[int, str]] = sorted((-score, key) for key, score in self._scores.items())
+
+    def _eligible(self, score: int) -> bool:
+        return self.keep_zero or score > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._scores
+
+    def score(self, key: str) -> Optional[int]:
+        return self._scores.get(key)
+
+    def remove(self, key: str):
+        score = self._scores.pop(key, None)
+        if score is None:
+            return
+        index = bisect_left(self._entries, (-score, key))
+        if index < len(self._entries) and self._entries[index] == (-score, key):
+            del self._entries[index]
+
+    def update(self, key: str, score: int):
+        """設置分數（不上榜的分數會移除該項目）"""
+        if self._scores.get(key) == score:
+            return
+        self.remove(key)
+        if self._eligible(score):
+            self._scores[key] = score
+            insort(self._entries, (-score, key))
+
+    def rank(self, key: str) -> Optional[int]:
+        """名次（從1開始），不在榜上時返回 None"""
+        score = self._scores.get(key)
+        if score is None:
+            return None
+        return bisect_left(self._entries, (-score, key)) + 1
+
+    def page(self, offset: int = 0, limit: int = 10) -> List[Tuple[int, str, int]]:
+        """返回 [(名次, 鍵, 分數)]"""
+        offset = max(0, offset)
+        return [
+            (offset + i + 1, key, -neg_score)
+            for i, (neg_score, key) in enumerate(self._entries[offset:offset + limit])
+        ]
@@ -0,0 +1,508 @@
+"""交易帳本模組
+
+每筆交易由一組借貸分錄組成，同一貨幣的分錄金額加總必須為0（複式記帳），
+可用冪等鍵（由 interaction ID 產生）防止重試的互動重複入帳。
+
+帳本按伺服器分開存放:
+
+    <目錄>/<guild_id>/journal-<n>.jsonl   交易日誌（只追加），每個分段 JOURNAL_SEGMENT_SIZE 筆
+    <目錄>/<guild_id>/accounts.json       檢查點: 各帳戶的即時餘額、最後序號和最近的冪等鍵
+    <目錄>/<guild_id>/users/<user_id>-<n>.jsonl  每位玩家自己的交易紀錄分段
+
+各帳戶的即時餘額常駐記憶體，讀取餘額為 O(1)；載入時從檢查點開始重播之後的日誌。
+查詢歷史時只讀取需要的分段，不需要掃描整個日誌。
+玩家的交易紀錄另外按玩家分段保存，最近的幾筆保留在記憶體中，
+翻頁時只讀取該玩家的分段。
+
+每種貨幣的流通總量、持有人數和餘額分布（以10的次方分桶）隨每筆分錄增量更新，
+統計查詢為 O(1)。每種貨幣的餘額排行榜在首次查詢時建立，之後同樣隨分錄更新。
+"""
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from leaderboard import Leaderboard
+
+# 每個日誌分段的交易筆數
+JOURNAL_SEGMENT_SIZE = int(os.getenv('LEDGER_SEGMENT_SIZE', '500'))
+
+# 每寫入多少筆交易保存一次檢查點
+CHECKPOINT_INTERVAL = int(os.getenv('LEDGER_CHECKPOINT_INTERVAL', '200'))
+
+# 保留的最近冪等鍵數量（Discord 的互動重試都在幾分鐘內，不需要永久保存）
+IDEMPOTENCY_WINDOW = int(os.getenv('LEDGER_IDEMPOTENCY_WINDOW', '10000'))
+
+# 玩家交易紀錄每個分段的筆數
+USER_SEGMENT_SIZE = int(os.getenv('LEDGER_USER_SEGMENT_SIZE', '100'))
+
+# 每位玩家保留在記憶體中的最近交易筆數
+RECENT_HISTORY_SIZE = int(os.getenv('LEDGER_RECENT_HISTORY_SIZE', '50'))
+
+# 記憶體中最多保留多少位玩家的最近交易
+MAX_CACHED_HISTORIES = int(os.getenv('LEDGER_MAX_CACHED_HISTORIES', '5000'))
+
+# 餘額分布的分桶數量: 1-9、10-99、100-999 ……，最後一桶包含所有更大的餘額
+HISTOGRAM_BUCKETS = 10
+
+# 分錄格式: (帳戶, 貨幣ID, 金額變化)
+Entry = Tuple[str, str, int]
+
+
+def user_account(user_id: str) -> str:
+    """玩家帳戶名稱"""
+    return f"user:{user_id}"
+
+
+def system_account(name: str) -> str:
+    """系統帳戶名稱（發放獎勵、管理員調整等金錢的來源和去向）"""
+    return f"system:{name}"
+
+
+def shop_account(owner_id: str, shop_id: str) -> str:
+    """商店帳戶名稱（購買商品的金錢去向）"""
+    return f"shop:{owner_id}/{shop_id}"
+
+
+def pool_account(pool: str) -> str:
+    """兌換池帳戶名稱（帳戶餘額即兌換池的儲備）"""
+    return f"pool:{pool}"
+
+
+def account_user_id(account: str) -> Optional[str]:
+    """玩家帳戶對應的用戶ID，其他帳戶返回 None"""
+    if account.startswith("user:"):
+        return account[5:]
+    return None
+
+
+def balance_bucket(balance: int) -> int:
+    """正數餘額所在的分桶（按位數）"""
+    return min(len(str(balance)) - 1, HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_range(index: int) -> Tuple[int, Optional[int]]:
+    """分桶的餘額範圍 (最小值, 最大值)，最後一桶沒有上限"""
+    low = 10 ** index
+    high = None if index == HISTOGRAM_BUCKETS - 1 else 10 ** (index + 1) - 1
+    return low, high
+
+
+class DuplicateTransaction(Exception):
+    """冪等鍵已經入帳"""
+
+    def __init__(self, transaction: dict):
+        super().__init__(f"交易已入帳: {transaction.get('key')}")
+        self.transaction = transaction
+
+
+class UserHistory:
+    """按玩家分段保存的交易紀錄
+
+    每位玩家的紀錄依序編號（n 從 1 開始），每 USER_SEGMENT_SIZE 筆一個文件。
+    最近的 RECENT_HISTORY_SIZE 筆保留在環形緩衝區中，超過的只在磁碟上；
+    記憶體中的玩家數量以 LRU 限制。
+    """
+
+    def __init__(self, directory: str, segment_size: int = USER_SEGMENT_SIZE,
+                 recent_size: int = RECENT_HISTORY_SIZE, max_cached: int = MAX_CACHED_HISTORIES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.recent_size = recent_size
+        self.max_cached = max_cached
+        # {user_id: [紀錄總數, 最近紀錄 deque（尚未載入時為 None）]}
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, user_id: str, index: int) -> str:
+        return os.path.join(self.directory, f"{user_id}-{index}.jsonl")
+
+    def _read_segment(self, user_id: str, index: int) -> List[dict]:
+        path = self._segment_path(user_id, index)
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def _state(self, user_id: str) -> list:
+        """玩家的 [紀錄總數, 最近紀錄]，不在記憶體時從最後一個分段推算總數"""
+        state = self._cache.get(user_id)
+        if state is not None:
+            self._cache.move_to_end(user_id)
+            return state
+        index = 0
+        while os.path.exists(self._segment_path(user_id, index + 1)):
+            index += 1
+        last = self._read_segment(user_id, index)
+        count = last[-1]['n'] if last else 0
+        state = [count, None]
+        self._cache[user_id] = state
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return state
+
+    def _recent(self, user_id: str, state: list) -> deque:
+        if state[1] is None:
+            count = state[0]
+            recent = deque(maxlen=self.recent_size)
+            first = max(1, count - self.recent_size + 1)
+            if count:
+                for index in range((first - 1) // self.segment_size, (count - 1) // self.segment_size + 1):
+                    for record in self._read_segment(user_id, index):
+                        if first <= record['n'] <= count:
+                            recent.append(record)
+            state[1] = recent
+        return state[1]
+
+    def count(self, user_id: str) -> int:
+        return self._state(user_id)[0]
+
+    def append(self, user_id: str, record: dict) -> dict:
+        """追加一筆紀錄（寫入玩家的分段文件，已載入時同時放入最近紀錄）"""
+        return self.extend(user_id, [record])[0]
+
+    def extend(self, user_id: str, records: List[dict]) -> List[dict]:
+        """依序追加多筆紀錄，每個分段只打開一次文件"""
+        state = self._state(user_id)
+        numbered = [dict(record, n=state[0] + i + 1) for i, record in enumerate(records)]
+        start = 0
+        while start < len(numbered):
+            index = (numbered[start]['n'] - 1) // self.segment_size
+            end = start
+            while end < len(numbered) and (numbered[end]['n'] - 1) // self.segment_size == index:
+                end += 1
+            with open(self._segment_path(user_id, index), 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in numbered[start:end]))
+            start = end
+        if numbered:
+            state[0] = numbered[-1]['n']
+            if state[1] is not None:
+                state[1].extend(numbered)
+        return numbered
+
+    def page(self, user_id: str, before: Optional[int] = None, limit: int = 10) -> List[dict]:
+        """由新到舊返回玩家的紀錄（before 為游標，只返回編號小於它的紀錄）"""
+        state = self._state(user_id)
+        start = state[0] if before is None else min(before - 1, state[0])
+        if start <= 0 or limit <= 0:
+            return []
+        end = max(1, start - limit + 1)
+
+        recent = self._recent(user_id, state)
+        if recent and recent[0]['n'] <= end:
+            # 整頁都在最近紀錄中
+            offset = recent[0]['n']
+            return [recent[n - offset] for n in range(start, end - 1, -1)]
+
+        records: List[dict] = []
+        for index in range((start - 1) // self.segment_size, (end - 1) // self.segment_size - 1, -1):
+            for record in reversed(self._read_segment(user_id, index)):
+                if end <= record['n'] <= start:
+                    records.append(record)
+        return records
+
+
+class GuildLedger:
+    """單個伺服器的帳本"""
+
+    def __init__(self, directory: str, segment_size: int = JOURNAL_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        # {帳戶: {貨幣ID: 餘額}}
+        self.balances: Dict[str, Dict[str, int]] = {}
+        # {貨幣ID: {'supply': 流通總量, 'holders': 持有人數, 'histogram': [各分桶人數]}}
+        self.stats: Dict[str, dict] = {}
+        # {貨幣ID: 餘額排行榜}（首次查詢時建立）
+        self.leaderboards: Dict[str, Leaderboard] = {}
+        # {冪等鍵: 交易序號}
+        self._keys: "OrderedDict[str, int]" = OrderedDict()
+        self.last_seq = 0
+        self._checkpoint_seq = 0
+        os.makedirs(directory, exist_ok=True)
+        self.users = UserHistory(os.path.join(directory, "users"))
+        self._load()
+
+    # ========== 載入與檢查點 ==========
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.directory, "accounts.json")
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"journal-{index:06d}.jsonl")
+
+    def _segment_of(self, seq: int) -> int:
+        return (seq - 1) // self.segment_size
+
+    def _load(self):
+        path = self._checkpoint_path()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.balances = data.get('balances', {})
+            self.last_seq = self._checkpoint_seq = data.get('seq', 0)
+            for key, seq in data.get('keys', []):
+                self._keys[key] = seq
+            self._rebuild_stats()
+
+        # 重播檢查點之後的日誌
+        index = self._segment_of(self.last_seq + 1)
+        while os.path.exists(self._segment_path(index)):
+            for txn in self._read_segment(index):
+                if txn['seq'] > self.last_seq:
+                    self._apply(txn)
+            index += 1
+
+    def _read_segment(self, index: int) -> List[dict]:
+        path = self._segment_path(index)
+        if not os.path.exists(path):
+            return []
+        transactions = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    transactions.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 寫入中斷留下的半行，忽略
+                    continue
+        return transactions
+
+    def checkpoint(self):
+        """保存即時餘額（有新交易時才寫入）"""
+        if self._checkpoint_seq == self.last_seq:
+            return
+        data = {
+            'seq': self.last_seq,
+            'balances': self.balances,
+            'keys': list(self._keys.items())
+        }
+        tmp_path = self._checkpoint_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self._checkpoint_path())
+        self._checkpoint_seq = self.last_seq
+
+    # ========== 統計 ==========
+
+    def _currency_stats(self, currency_id: str) -> dict:
+        stats = self.stats.get(currency_id)
+        if stats is None:
+            stats = {'supply': 0, 'holders': 0, 'histogram': [0] * HISTOGRAM_BUCKETS}
+            self.stats[currency_id] = stats
+        return stats
+
+    def _update_stats(self, currency_id: str, old: int, new: int):
+        """玩家餘額從 old 變為 new 時更新統計"""
+        stats = self._currency_stats(currency_id)
+        stats['supply'] += new - old
+        if old > 0:
+            stats['holders'] -= 1
+            stats['histogram'][balance_bucket(old)] -= 1
+        if new > 0:
+            stats['holders'] += 1
+            stats['histogram'][balance_bucket(new)] += 1
+
+    def _rebuild_stats(self):
+        """從檢查點的餘額重建統計（只在載入時執行一次）"""
+        self.stats = {}
+        for account, balances in self.balances.items():
+            if account_user_id(account) is None:
+                continue
+            for currency_id, balance in balances.items():
+                self._update_stats(currency_id, 0, balance)
+
+    def currency_stats(self, currency_id: str) -> dict:
+        """貨幣的流通總量、持有人數和餘額分布"""
+        stats = self._currency_stats(currency_id)
+        return {
+            'supply': stats['supply'],
+            'holders': stats['holders'],
+            'histogram': list(stats['histogram'])
+        }
+
+    def quantile_bucket(self, currency_id: str, q: float) -> Optional[int]:
+        """持有人中第 q 分位數（0~1）所在的分桶，沒有持有人時返回 None"""
+        stats = self._currency_stats(currency_id)
+        if stats['holders'] <= 0:
+            return None
+        target = max(1, int(stats['holders'] * q + 0.5))
+        seen = 0
+        for index, count in enumerate(stats['histogram']):
+            seen += count
+            if seen >= target:
+                return index
+        return HISTOGRAM_BUCKETS - 1
+
+    def leaderboard(self, currency_id: str) -> Leaderboard:
+        """貨幣的餘額排行榜（鍵為用戶ID）"""
+        board = self.leaderboards.get(currency_id)
+        if board is None:
+            board = Leaderboard(
+                (account_user_id(account), balances[currency_id])
+                for account, balances in self.balances.items()
+                if currency_id in balances and account.startswith("user:")
+            )
+            self.leaderboards[currency_id] = board
+        return board
+
+    # ========== 記帳 ==========
+
+    def _apply(self, txn: dict):
+        for account, currency_id, amount in txn['entries']:
+            account_balances = self.balances.setdefault(account, {})
+            old = account_balances.get(currency_id, 0)
+            account_balances[currency_id] = old + amount
+            if account.startswith("user:"):
+                self._update_stats(currency_id, old, old + amount)
+                board = self.leaderboards.get(currency_id)
+                if board is not None:
+                    board.update(account_user_id(account), old + amount)
+        key = txn.get('key')
+        if key:
+            self._keys[key] = txn['seq']
+            self._keys.move_to_end(key)
+            while len(self._keys) > IDEMPOTENCY_WINDOW:
+                self._keys.popitem(last=False)
+        self.last_seq = txn['seq']
+
+    def balance(self, account: str, currency_id: str) -> int:
+        """帳戶的即時餘額"""
+        return self.balances.get(account, {}).get(currency_id, 0)
+
+    def seen(self, key: str) -> bool:
+        """冪等鍵是否已經入帳"""
+        return key in self._keys
+
+    def find(self, key: str) -> Optional[dict]:
+        """查找冪等鍵對應的交易（不在保留範圍內時返回 None）"""
+        seq = self._keys.get(key)
+        if seq is None:
+            return None
+        for txn in self._read_segment(self._segment_of(seq)):
+            if txn['seq'] == seq:
+                return txn
+        return None
+
+    def post(self, kind: str, entries: List[Entry], key: Optional[str] = None,
+             memo: str = "", now: Optional[float] = None) -> dict:
+        """記錄一筆交易並返回交易記錄
+
+        同一貨幣的分錄必須平衡；冪等鍵已入帳時拋出 DuplicateTransaction。
+        """
+        if key and self.seen(key):
+            raise DuplicateTransaction(self.find(key) or {'key': key, 'seq': self._keys[key]})
+
+        entries = [(account, currency_id, int(amount)) for account, currency_id, amount in entries if amount]
+        if not entries:
+            raise ValueError("交易沒有任何分錄")
+        totals: Dict[str, int] = {}
+        for _, currency_id, amount in entries:
+            totals[currency_id] = totals.get(currency_id, 0) + amount
+        unbalanced = [currency_id for currency_id, total in totals.items() if total != 0]
+        if unbalanced:
+            raise ValueError(f"分錄不平衡: {', '.join(unbalanced)}")
+
+        txn = {
+            'seq': self.last_seq + 1,
+            'ts': time.time() if now is None else now,
+            'kind': kind,
+            'key': key,
+            'memo': memo,
+            'entries': [list(entry) for entry in entries]
+        }
+        # 先寫日誌再更新記憶體，寫入失敗時帳本保持不變
+        with open(self._segment_path(self._segment_of(txn['seq'])), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(txn, ensure_ascii=False) + "\n")
+        self._apply(txn)
+        self._record_user_history(txn)
+
+        if self.last_seq - self._checkpoint_seq >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+        return txn
+
+    def _record_user_history(self, txn: dict):
+        """把交易中每位玩家的分錄寫入該玩家的交易紀錄
+
+        對方帳戶為同一貨幣中金額方向相反的第一個帳戶，先建立索引再逐筆查找；
+        同一位玩家的多筆分錄合併為一次寫入。
+        """
+        first_by_side: Dict[Tuple[str, bool], str] = {}
+        for account, currency_id, amount in txn['entries']:
+            first_by_side.setdefault((currency_id, amount > 0), account)
+
+        per_user: Dict[str, List[dict]] = {}
+        for account, currency_id, amount in txn['entries']:
+            user_id = account_user_id(account)
+            if user_id is None:
+                continue
+            per_user.setdefault(user_id, []).append({
+                'seq': txn['seq'],
+                'ts': txn['ts'],
+                'kind': txn['kind'],
+                'currency_id': currency_id,
+                'amount': amount,
+                'counterparty': first_by_side.get((currency_id, amount <= 0)),
+                'memo': txn['memo']
+            })
+        for user_id, records in per_user.items():
+            self.users.extend(user_id, records)
+
+    # ========== 查詢 ==========
+
+    def history(self, before: Optional[int] = None, limit: int = 10) -> List[dict]:
+        """由新到舊返回交易（before 為游標，只返回序號小於它的交易）"""
+        start = self.last_seq if before is None else min(before - 1, self.last_seq)
+        results: List[dict] = []
+        if start <= 0 or limit <= 0:
+            return results
+        index = self._segment_of(start)
+        while index >= 0 and len(results) < limit:
+            for txn in reversed(self._read_segment(index)):
+                if txn['seq'] <= start:
+                    results.append(txn)
+                    if len(results) >= limit:
+                        break
+            index -= 1
+        return results
+
+    def user_history(self, user_id: str, before: Optional[int] = None, limit: int = 10) -> List[dict]:
+        """玩家的交易紀錄（由新到舊）"""
+        return self.users.page(user_id, before, limit)
+
+
+class Ledger:
+    """所有伺服器的帳本（首次使用時才載入）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._guilds: Dict[str, GuildLedger] = {}
+
+    def guild(self, guild_id: str) -> GuildLedger:
+        book = self._guilds.get(guild_id)
+        if book is None:
+            book = GuildLedger(os.path.join(self.directory, guild_id))
+            self._guilds[guild_id] = book
+        return book
+
+    def unload(self, guild_id: str):
+        """保存檢查點後從記憶體移除伺服器帳本（之後可直接搬移帳本目錄）"""
+        book = self._guilds.pop(guild_id, None)
+        if book is not None:
+            book.checkpoint()
+
+    def checkpoint_all(self):
+        """保存所有已載入帳本的檢查點"""
+        for book in self._guilds.values():
+            book.checkpoint()
@@ -0,0 +1,244 @@
+"""等級與經驗值計算模組
+
+預先計算每個等級所需的總經驗值門檻，等級查詢使用二分搜尋（O(log n)），
+超出預計算範圍時使用公式反推。
+
+每個伺服器可設置自己的等級曲線（多項式、指數或自訂表格），
+曲線只在設置變更時重新編譯成門檻表，其餘時間直接使用快取。
+"""
+import math
+import os
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# 預計算的最高等級（可用環境變數 LEVEL_TABLE_MAX 調整）
+DEFAULT_MAX_LEVEL = int(os.getenv('LEVEL_TABLE_MAX', '1000'))
+
+# 默認經驗值公式: base * level^exponent
+DEFAULT_BASE = 100
+DEFAULT_EXPONENT = 1.5
+
+# 自訂表格最多的等級數
+MAX_TABLE_LEVELS = 10000
+
+# 經驗值門檻上限（超過的門檻一律視為此值，使門檻保持遞增）
+MAX_THRESHOLD = 2 ** 63 - 1
+
+CURVE_TYPES = ('polynomial', 'exponential', 'table')
+
+# ==================== 等級曲線 ====================
+
+class PolynomialCurve:
+    """多項式曲線: base × level^exponent"""
+
+    def __init__(self, base: float = DEFAULT_BASE, exponent: float = DEFAULT_EXPONENT):
+        if base <= 0 or exponent <= 0:
+            raise ValueError("基數和指數必須大於0")
+        self.base = base
+        self.exponent = exponent
+
+    def threshold(self, level: int) -> int:
+        try:
+            return min(MAX_THRESHOLD, int(self.base * (level ** self.exponent)))
+        except OverflowError:
+            return MAX_THRESHOLD
+
+    def estimate_level(self, exp: int) -> int:
+        return int((exp / self.base) ** (1 / self.exponent))
+
+    def describe(self) -> str:
+        return f"{self.base:g} × level^{self.exponent:g}"
+
+
+class ExponentialCurve:
+    """指數曲線: base × growth^(level-1)"""
+
+    def __init__(self, base: float = DEFAULT_BASE, growth: float = 1.1):
+        if base <= 0:
+            raise ValueError("基數必須大於0")
+        if growth <= 1:
+            raise ValueError("成長率必須大於1")
+        self.base = base
+        self.growth = growth
+
+    def threshold(self, level: int) -> int:
+        try:
+            return min(MAX_THRESHOLD, int(self.base * (self.growth ** (level - 1))))
+        except OverflowError:
+            return MAX_THRESHOLD
+
+    def estimate_level(self, exp: int) -> int:
+        if exp < self.base:
+            return 1
+        return 1 + int(math.log(exp / self.base) / math.log(self.growth))
+
+    def describe(self) -> str:
+        return f"{self.base:g} × {self.growth:g}^(level-1)"
+
+
+class TableCurve:
+    """自訂表格: thresholds[i] 為升到 Lv.(i+1) 所需的總經驗值，超出表格後按最後一級的差值線性延伸"""
+
+    def __init__(self, thresholds: List[int]):
+        if len(thresholds) < 2:
+            raise ValueError("等級表至少需要2個等級")
+        if len(thresholds) > MAX_TABLE_LEVELS:
+            raise ValueError(f"等級表最多 {MAX_TABLE_LEVELS} 個等級")
+        if thresholds[0] < 0:
+            raise ValueError("經驗值不能為負數")
+        for prev, curr in zip(thresholds, thresholds[1:]):
+            if curr <= prev:
+                raise ValueError("等級表的經驗值必須嚴格遞增")
+        self.values = [int(v) for v in thresholds]
+        self.step = self.values[-1] - self.values[-2]
+
+    def threshold(self, level: int) -> int:
+        last = len(self.values)
+        if level <= last:
+            return min(MAX_THRESHOLD, self.values[max(level, 1) - 1])
+        return min(MAX_THRESHOLD, self.values[-1] + (level - last) * self.step)
+
+    def estimate_level(self, exp: int) -> int:
+        last = len(self.values)
+        if exp <= self.values[-1]:
+            return last
+        return last + (exp - self.values[-1]) // self.step
+
+    def describe(self) -> str:
+        return f"自訂表格（{len(self.values)} 級）"
+
+
+def curve_from_config(config: Optional[dict]):
+    """根據伺服器保存的曲線設置創建曲線（None 表示默認曲線）"""
+    if not config:
+        return PolynomialCurve()
+    curve_type = config.get('type', 'polynomial')
+    if curve_type == 'polynomial':
+        return PolynomialCurve(config.get('base', DEFAULT_BASE), config.get('exponent', DEFAULT_EXPONENT))
+    if curve_type == 'exponential':
+        return ExponentialCurve(config.get('base', DEFAULT_BASE), config.get('growth', 1.1))
+    if curve_type == 'table':
+        return TableCurve(config.get('thresholds', []))
+    raise ValueError(f"未知的曲線類型: {curve_type}")
+
+
+def validate_config(config: Optional[dict]):
+    """檢查曲線設置，參數無效或 Lv.2 就達到經驗值上限時拋出 ValueError
+
+    之後才達到上限的曲線仍然有效，門檻表在上限前一級封頂（見 LevelTable.capped）。
+    """
+    curve = curve_from_config(config)
+    if curve.threshold(2) >= MAX_THRESHOLD:
+        raise ValueError(f"Lv.2 所需經驗值已超過上限 {MAX_THRESHOLD}，請降低基數或成長率")
+
+# ==================== 門檻表 ====================
+
+class LevelTable:
+    """預計算的等級經驗值門檻表"""
+
+    def __init__(self, curve=None, max_level: int = DEFAULT_MAX_LEVEL):
+        if max_level < 2:
+            raise ValueError("max_level 必須 ≥ 2")
+        self.curve = curve or PolynomialCurve()
+        if isinstance(self.curve, TableCurve):
+            max_level = len(self.curve.values)
+        # thresholds[level] = 升到該等級所需的總經驗值（thresholds[0] 為 0）
+        self.thresholds: List[int] = [0]
+        # 門檻達到經驗值上限的曲線在前一級封頂，封頂後不會再升級
+        self.capped = False
+        for level in range(1, max_level + 1):
+            threshold = self.curve.threshold(level)
+            if threshold >= MAX_THRESHOLD:
+                self.capped = True
+                break
+            self.thresholds.append(threshold)
+        self.max_level = len(self.thresholds) - 1
+
+    def exp_for_level(self, level: int) -> int:
+        """升到指定等級所需的總經驗值（封頂後為上限）"""
+        if 0 <= level <= self.max_level:
+            return self.thresholds[level]
+        if self.capped:
+            return MAX_THRESHOLD
+        return self.curve.threshold(level)
+
+    def level_from_exp(self, exp: int) -> int:
+        """根據總經驗值計算等級（最低為1級）"""
+        level = bisect_right(self.thresholds, exp) - 1
+        if level >= self.max_level:
+            level = self._level_beyond_table(exp)
+        return max(1, level)
+
+    def _level_beyond_table(self, exp: int) -> int:
+        """超出預計算範圍時，用公式反推等級後修正取整誤差"""
+        if self.capped:
+            return self.max_level
+        level = max(self.max_level, self.curve.estimate_level(exp))
+        # 門檻到達上限後不再增加，停止往上找
+        while self.curve.threshold(level + 1) <= exp and self.curve.threshold(level + 1) < MAX_THRESHOLD:
+            level += 1
+        while level > self.max_level and self.curve.threshold(level) > exp:
+            level -= 1
+        return level
+
+    def progress(self, exp: int) -> dict:
+        """返回當前等級、本級進度和升級所需經驗值"""
+        level = self.level_from_exp(exp)
+        exp_for_current = self.exp_for_level(level)
+        exp_for_next = self.exp_for_level(level + 1)
+        return {
+            'level': level,
+            'exp_for_current': exp_for_current,
+            'exp_for_next': exp_for_next,
+            'progress': exp - exp_for_current,
+            'needed': exp_for_next - exp_for_current
+        }
+
+    def describe(self) -> str:
+        return self.curve.describe()
+
+
+# 默認門檻表（模組載入時計算一次）
+default_table = LevelTable()
+
+# 伺服器門檻表快取 {guild_id: (曲線版本, LevelTable)}
+_guild_tables: Dict[str, Tuple[int, LevelTable]] = {}
+
+
+def get_table(guild_id: str, config: Optional[dict] = None) -> LevelTable:
+    """獲取伺服器的門檻表，只有曲線版本變更時才重新編譯"""
+    if not config:
+        return default_table
+    version = config.get('version', 0)
+    cached = _guild_tables.get(guild_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    table = LevelTable(curve_from_config(config))
+    _guild_tables[guild_id] = (version, table)
+    return table
+
+
+def invalidate(guild_id: str):
+    """清除伺服器的門檻表快取"""
+    _guild_tables.pop(guild_id, None)
+
+
+def parse_thresholds(text: str) -> List[int]:
+    """解析管理員上傳的等級表（以逗號、空白或換行分隔的整數）"""
+    values = []
+    for token in text.replace(',', ' ').split():
+        try:
+            values.append(int(token))
+        except ValueError:
+            raise ValueError(f"無法解析的數值: {token[:20]}")
+    return values
+
+
+def exp_for_level(level: int) -> int:
+    """計算升到指定等級所需的總經驗值"""
+    return default_table.exp_for_level(level)
+
+
+def level_from_exp(exp: int) -> int:
+    """根據經驗值計算等級"""
+    return default_table.level_from_exp(exp)
@@ -0,0 +1,109 @@
+"""指令頻率限制模組
+
+令牌桶: 每個桶只保存 [剩餘令牌, 上次更新時間]，取用時按經過的時間補充令牌，
+不需要定時器。每個指令可分別設置每位用戶和每個伺服器的桶，
+所有桶存放在同一個 LRU 字典中，超過上限時淘汰最久未使用的桶
+（閒置夠久的桶本來就是滿的，淘汰後重新建立不影響結果）。
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# 限制格式: (桶容量, 補滿所需秒數)
+Limit = Tuple[int, float]
+
+# 未單獨設置的指令使用的限制
+DEFAULT_LIMITS: Dict[str, Limit] = {
+    'user': (8, 10),
+    'guild': (120, 10)
+}
+
+# 各指令的限制（未列出的範圍使用默認值，設為 None 表示不限制）
+COMMAND_LIMITS: Dict[str, Dict[str, Optional[Limit]]] = {
+    '贈送金幣': {'user': (3, 15), 'guild': (40, 10)},
+    '兌換': {'user': (3, 15), 'guild': (40, 10)},
+    '背包': {'user': (3, 10)},
+    '簽到': {'user': (2, 10)},
+    '討伐': {'user': (3, 10)},
+    '決鬥': {'user': (2, 10)},
+    '交易紀錄': {'user': (5, 10)},
+    '排行榜': {'user': (3, 10), 'guild': (30, 10)},
+    'shop_view': {'user': (6, 10), 'guild': (100, 10)},
+    'inventory_view': {'user': (6, 10)},
+}
+
+# 最多保存的桶數量
+MAX_BUCKETS = 50000
+
+
+class RateLimiter:
+    """以令牌桶實現的頻率限制器"""
+
+    def __init__(self, command_limits: Optional[Dict[str, Dict[str, Optional[Limit]]]] = None,
+                 default_limits: Optional[Dict[str, Limit]] = None, max_buckets: int = MAX_BUCKETS):
+        self.command_limits = COMMAND_LIMITS if command_limits is None else command_limits
+        self.default_limits = DEFAULT_LIMITS if default_limits is None else default_limits
+        self.max_buckets = max_buckets
+        # {(範圍, 指令, ID): [剩餘令牌, 上次更新時間]}
+        self._buckets: "OrderedDict[tuple, list]" = OrderedDict()
+        # 合併默認值後的各指令限制 {指令: ((範圍, 限制), ...)}
+        self._resolved: Dict[str, tuple] = {}
+
+    def limits_for(self, command: str) -> tuple:
+        resolved = self._resolved.get(command)
+        if resolved is None:
+            limits = dict(self.default_limits)
+            limits.update(self.command_limits.get(command, {}))
+            resolved = tuple((scope, limits.get(scope)) for scope in ('user', 'guild'))
+            self._resolved[command] = resolved
+        return resolved
+
+    def configure(self, command: str, scope: str, limit: Optional[Limit]):
+        """設置指令在某個範圍（'user' 或 'guild'）的限制"""
+        self.command_limits.setdefault(command, {})[scope] = limit
+        self._resolved.pop(command, None)
+
+    def _bucket(self, key: tuple, capacity: int, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(capacity), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    @staticmethod
+    def _refill(bucket: list, capacity: int, period: float, now: float):
+        elapsed = now - bucket[1]
+        if elapsed > 0:
+            bucket[0] = min(float(capacity), bucket[0] + elapsed * capacity / period)
+            bucket[1] = now
+
+    def acquire(self, command: str, user_id: int, guild_id: Optional[int] = None,
+                now: Optional[float] = None) -> float:
+        """嘗試取用一個令牌，成功返回 0，否則返回需要等待的秒數（不扣除任何桶）"""
+        if now is None:
+            now = time.monotonic()
+        buckets = []
+        retry_after = 0.0
+        owners = {'user': user_id, 'guild': guild_id}
+        for scope, limit in self.limits_for(command):
+            owner = owners[scope]
+            if limit is None or owner is None:
+                continue
+            capacity, period = limit
+            bucket = self._bucket((scope, command, owner), capacity, now)
+            self._refill(bucket, capacity, period, now)
+            if bucket[0] < 1:
+                retry_after = max(retry_after, (1 - bucket[0]) * period / capacity)
+            buckets.append(bucket)
+        if retry_after > 0:
+            return retry_after
+        for bucket in buckets:
+            bucket[0] -= 1
+        return 0.0
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,74 @@
+"""HP/MP 自然恢復模組
+
+角色只保存最後一次更新時的 HP/MP 和時間戳，當前值在讀取時按時間推算，
+不需要定時遍歷所有角色。
+"""
+import time
+from typing import Optional, Tuple
+
+# 默認每分鐘恢復最大值的比例
+DEFAULT_HP_REGEN_RATIO = 0.05
+DEFAULT_MP_REGEN_RATIO = 0.05
+
+
+def max_vitals(char: dict) -> Tuple[int, int]:
+    """角色的 HP/MP 上限（包含裝備加成的衍生屬性快取）"""
+    stats = char.get('derived_stats') or char
+    return stats['max_hp'], stats['max_mp']
+
+
+def regen_rates(char: dict) -> Tuple[float, float]:
+    """角色每分鐘的 HP/MP 恢復量（未設置時按最大值比例計算）"""
+    max_hp, max_mp = max_vitals(char)
+    hp_rate = char.get('hp_regen')
+    if hp_rate is None:
+        hp_rate = max(1.0, max_hp * DEFAULT_HP_REGEN_RATIO)
+    mp_rate = char.get('mp_regen')
+    if mp_rate is None:
+        mp_rate = max(1.0, max_mp * DEFAULT_MP_REGEN_RATIO)
+    return hp_rate, mp_rate
+
+
+def _recovered(stored: int, max_value: int, rate: float, minutes: float) -> int:
+    if stored >= max_value:
+        return max_value
+    return min(max_value, int(stored + rate * minutes))
+
+
+def current_vitals(char: dict, now: Optional[float] = None) -> Tuple[int, int]:
+    """推算角色當前的 (HP, MP)，不修改角色數據"""
+    max_hp, max_mp = max_vitals(char)
+    updated_at = char.get('vitals_updated_at')
+    if updated_at is None:
+        return min(char['hp'], max_hp), min(char['mp'], max_mp)
+    if now is None:
+        now = time.time()
+    minutes = max(0.0, now - updated_at) / 60
+    hp_rate, mp_rate = regen_rates(char)
+    return (
+        _recovered(char['hp'], max_hp, hp_rate, minutes),
+        _recovered(char['mp'], max_mp, mp_rate, minutes)
+    )
+
+
+def set_vitals(char: dict, hp: int, mp: Optional[int] = None, now: Optional[float] = None):
+    """寫入新的 HP/MP（先結算恢復量），並記錄時間戳"""
+    if now is None:
+        now = time.time()
+    if mp is None:
+        _, mp = current_vitals(char, now)
+    max_hp, max_mp = max_vitals(char)
+    char['hp'] = max(0, min(max_hp, hp))
+    char['mp'] = max(0, min(max_mp, mp))
+    char['vitals_updated_at'] = now
+
+
+def minutes_until_full(char: dict, now: Optional[float] = None) -> Tuple[float, float]:
+    """距離 HP/MP 完全恢復還需多少分鐘"""
+    hp, mp = current_vitals(char, now)
+    max_hp, max_mp = max_vitals(char)
+    hp_rate, mp_rate = regen_rates(char)
+    return (
+        max(0.0, (max_hp - hp) / hp_rate),
+        max(0.0, (max_mp - mp) / mp_rate)
+    )